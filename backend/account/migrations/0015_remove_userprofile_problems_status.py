@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0014_approve_existing_admins'),
+        ('problem', '0015_userproblemstatus'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='acm_problems_status',
+        ),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='oi_problems_status',
+        ),
+    ]
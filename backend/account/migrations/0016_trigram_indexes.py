@@ -0,0 +1,18 @@
+from django.db import migrations
+
+from utils.search import AddTrigramIndex
+
+
+class Migration(migrations.Migration):
+    # AddTrigramIndex 并发创建索引，不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('account', '0015_remove_userprofile_problems_status'),
+    ]
+
+    operations = [
+        AddTrigramIndex(table='user', column='username', name='user_username_trgm'),
+        AddTrigramIndex(table='user', column='email', name='user_email_trgm'),
+        AddTrigramIndex(table='user_profile', column='real_name', name='user_profile_real_name_trgm'),
+    ]
@@ -61,7 +61,7 @@ class User(AbstractBaseUser):
         return self.problem_permission == ProblemPermission.ALL
 
     def is_contest_admin(self, contest):
-        return self.is_authenticated and (contest.created_by == self or self.admin_type == AdminType.SUPER_ADMIN)
+        return self.is_authenticated and (contest.created_by_id == self.id or self.admin_type == AdminType.SUPER_ADMIN)
 
     class Meta:
         db_table = "user"
@@ -69,25 +69,6 @@ class User(AbstractBaseUser):
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    # acm_problems_status examples:
-    # {
-    #     "problems": {
-    #         "1": {
-    #             "status": JudgeStatus.ACCEPTED,
-    #             "_id": "1000"
-    #         }
-    #     },
-    #     "contest_problems": {
-    #         "1": {
-    #             "status": JudgeStatus.ACCEPTED,
-    #             "_id": "1000"
-    #         }
-    #     }
-    # }
-    acm_problems_status = JSONField(default=dict)
-    # like acm_problems_status, merely add "score" field
-    oi_problems_status = JSONField(default=dict)
-
     real_name = models.TextField(null=True)
     avatar = models.TextField(default=f"{settings.AVATAR_URI_PREFIX}/default.png")
     blog = models.URLField(null=True)
@@ -110,11 +91,5 @@ class UserProfile(models.Model):
         self.submission_number = models.F("submission_number") + 1
         self.save()
 
-    # 计算总分时， 应先减掉上次该题所得分数， 然后再加上本次所得分数
-    def add_score(self, this_time_score, last_time_score=None):
-        last_time_score = last_time_score or 0
-        self.total_score = models.F("total_score") - last_time_score + this_time_score
-        self.save()
-
     class Meta:
         db_table = "user_profile"
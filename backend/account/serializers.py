@@ -1,5 +1,6 @@
 from django import forms
 
+from problem.utils import get_user_problems_status
 from utils.api import serializers, UsernameSerializer
 
 from .models import AdminType, ProblemPermission, User, UserProfile
@@ -82,6 +83,12 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_real_name(self, obj):
         return obj.real_name if self.show_real_name else None
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # 题目状态保存在 user_problem_status 表中，这里保持原来的返回格式
+        data["acm_problems_status"], data["oi_problems_status"] = get_user_problems_status(instance.user_id)
+        return data
+
 
 class EditUserSerializer(serializers.Serializer):
     id = serializers.IntegerField()
@@ -3,12 +3,13 @@ import re
 import xlsxwriter
 
 from django.db import transaction, IntegrityError
-from django.db.models import Q
 from django.http import HttpResponse
 from django.contrib.auth.hashers import make_password
 
+from contest.scoreboard import invalidate_user_scoreboards
 from submission.models import Submission
 from utils.api import APIView, validate_serializer
+from utils.search import search
 from utils.shortcuts import rand_str
 
 from ..decorators import super_admin_required
@@ -62,6 +63,9 @@ class UserAdminAPI(APIView):
             return self.error("Email already exists")
 
         pre_username = user.username
+        # 这些字段会影响比赛排名中的行
+        pre_real_name = UserProfile.objects.filter(user=user).values_list("real_name", flat=True).first()
+        pre_rank_info = (user.username, user.admin_type, user.is_disabled, pre_real_name)
         user.username = data["username"].lower()
         user.email = data["email"].lower()
         user.admin_type = data["admin_type"]
@@ -100,6 +104,8 @@ class UserAdminAPI(APIView):
             Submission.objects.filter(username=pre_username).update(username=user.username)
 
         UserProfile.objects.filter(user=user).update(real_name=data["real_name"])
+        if pre_rank_info != (user.username, user.admin_type, user.is_disabled, data["real_name"]):
+            invalidate_user_scoreboards([user.id])
         return self.success(UserAdminSerializer(user).data)
 
     @super_admin_required
@@ -119,9 +125,7 @@ class UserAdminAPI(APIView):
 
         keyword = request.GET.get("keyword", None)
         if keyword:
-            user = user.filter(Q(username__icontains=keyword) |
-                               Q(userprofile__real_name__icontains=keyword) |
-                               Q(email__icontains=keyword))
+            user = search(user, ("username", "userprofile__real_name", "email"), keyword)
         return self.success(self.paginate_data(request, user, UserAdminSerializer))
 
     @super_admin_required
@@ -132,7 +136,9 @@ class UserAdminAPI(APIView):
         ids = id.split(",")
         if str(request.user.id) in ids:
             return self.error("Current user can not be deleted")
-        User.objects.filter(id__in=ids).delete()
+        with transaction.atomic():
+            invalidate_user_scoreboards(ids)
+            User.objects.filter(id__in=ids).delete()
         return self.success()
 
 
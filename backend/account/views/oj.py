@@ -11,7 +11,7 @@ from django.utils.timezone import now
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from otpauth import OtpAuth
 
-from problem.models import Problem
+from contest.scoreboard import invalidate_user_scoreboards
 from utils.constants import ContestRuleType
 from options.options import SysOptions
 from utils.api import APIView, validate_serializer, CSRFExemptAPIView
@@ -55,9 +55,12 @@ class UserProfileAPI(APIView):
     def put(self, request):
         data = request.data
         user_profile = request.user.userprofile
+        pre_real_name = user_profile.real_name
         for k, v in data.items():
             setattr(user_profile, k, v)
         user_profile.save()
+        if user_profile.real_name != pre_real_name:
+            invalidate_user_scoreboards([request.user.id])
         return self.success(UserProfileSerializer(user_profile, show_real_name=True).data)
 
 
@@ -394,19 +397,7 @@ class UserRankAPI(APIView):
 class ProfileProblemDisplayIDRefreshAPI(APIView):
     @login_required
     def get(self, request):
-        profile = request.user.userprofile
-        acm_problems = profile.acm_problems_status.get("problems", {})
-        oi_problems = profile.oi_problems_status.get("problems", {})
-        ids = list(acm_problems.keys()) + list(oi_problems.keys())
-        if not ids:
-            return self.success()
-        display_ids = Problem.objects.filter(id__in=ids, visible=True).values_list("_id", flat=True)
-        id_map = dict(zip(ids, display_ids))
-        for k, v in acm_problems.items():
-            v["_id"] = id_map[k]
-        for k, v in oi_problems.items():
-            v["_id"] = id_map[k]
-        profile.save(update_fields=["acm_problems_status", "oi_problems_status"])
+        # 题目的显示 ID 在读取题目状态时从 problem 表中获取，不需要再刷新
         return self.success()
 
 
@@ -46,3 +46,8 @@ class AnnouncementAPITest(APITestCase):
     def test_get_announcement_list(self):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
+
+    def test_get_announcement_count_only(self):
+        resp = self.client.get(self.url, data={"limit": "0"})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"], {"results": [], "total": 1})
@@ -1,11 +1,25 @@
 import hashlib
+import json
+import socket
+import time
+from datetime import timedelta
 from unittest import mock
 
+import requests
+
 from django.conf import settings
+from django.test import override_settings
 from django.utils import timezone
 
-from options.options import SysOptions
+from judge.client import JudgeServerClient
+from judge.dispatcher import ChooseJudgeServer, process_pending_task, get_waiting_queue_metrics
+from judge.scheduler import LEASE_TTL, acquire_slot, get_task_number, register_judge_server, unregister_judge_server
+from judge.tasks import judge_task
+from options.options import OptionsCache, SysOptions, options_cache
+from submission.models import Submission
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
 from .models import JudgeServer
 
 
@@ -44,6 +58,21 @@ class SMTPConfigTest(APITestCase):
         resp = self.client.put(self.url, data=data)
         self.assertSuccess(resp)
 
+    @mock.patch.object(OptionsCache, "_start_listener")
+    @mock.patch("options.options.connection")
+    def test_get_then_edit_without_password(self, connection, _):
+        self.test_create_smtp_config()
+        # 使用进程内的配置缓存
+        connection.in_atomic_block = False
+        options_cache.clear()
+        self.addCleanup(options_cache.clear)
+        resp = self.client.get(self.url)
+        self.assertSuccess(resp)
+        self.assertNotIn("password", resp.data["data"])
+        data = {"server": "smtp1.test.com", "email": "test2@test.com", "port": 465, "tls": True}
+        self.assertSuccess(self.client.put(self.url, data=data))
+        self.assertEqual(SysOptions.smtp_config["password"], self.password)
+
     @mock.patch("conf.views.send_email")
     def test_test_smtp(self, mocked_send_email):
         url = self.reverse("smtp_test_api")
@@ -129,6 +158,83 @@ class JudgeServerAPITest(APITestCase):
         self.assertTrue(JudgeServer.objects.get(id=self.server.id).is_disabled)
 
 
+class JudgeServerSchedulerTest(APITestCase):
+    def setUp(self):
+        self.server = JudgeServer.objects.create(hostname="testhostname", judger_version="1.0.4", cpu_core=1,
+                                                 cpu_usage=0, memory_usage=0, service_url="http://127.0.0.1",
+                                                 last_heartbeat=timezone.now())
+        unregister_judge_server(self.server.hostname)
+        register_judge_server(self.server)
+
+    def tearDown(self):
+        unregister_judge_server(self.server.hostname)
+
+    def test_acquire_and_release_slot(self):
+        with ChooseJudgeServer() as first:
+            self.assertEqual(first.service_url, self.server.service_url)
+            with ChooseJudgeServer() as second:
+                self.assertIsNotNone(second)
+                with ChooseJudgeServer() as third:
+                    self.assertIsNone(third)
+                self.assertEqual(get_task_number(self.server.hostname), 2)
+        self.assertEqual(get_task_number(self.server.hostname), 0)
+
+    def test_disabled_server(self):
+        self.server.is_disabled = True
+        register_judge_server(self.server)
+        self.assertIsNone(acquire_slot())
+
+    def test_expired_lease(self):
+        acquire_slot()
+        acquire_slot()
+        self.assertIsNone(acquire_slot())
+        self.server.last_heartbeat = timezone.now() + timedelta(seconds=LEASE_TTL)
+        register_judge_server(self.server)
+        with mock.patch("judge.scheduler.time.time", return_value=time.time() + LEASE_TTL + 1):
+            self.assertIsNotNone(acquire_slot())
+
+    @mock.patch("judge.tasks.judge_concurrent_task.send")
+    def test_drain_waiting_queue(self, judge_concurrent_task):
+        cache.delete(CacheKey.waiting_queue)
+        cache.delete(CacheKey.waiting_queue_metrics)
+        for i in range(3):
+            cache.lpush(CacheKey.waiting_queue, json.dumps({"submission_id": str(i), "problem_id": 1,
+                                                            "enqueue_time": time.time()}))
+        process_pending_task()
+        judge_concurrent_task.assert_called_once()
+        tasks = judge_concurrent_task.call_args[0][0]
+        self.assertEqual([task["submission_id"] for task in tasks], ["0", "1"])
+        metrics = get_waiting_queue_metrics()
+        self.assertEqual(metrics["depth"], 1)
+        self.assertEqual(metrics["dispatched"], 2)
+        cache.delete(CacheKey.waiting_queue)
+
+    def test_release_slot_on_error(self):
+        cache.delete(CacheKey.waiting_queue)
+        slot = acquire_slot()
+        with self.assertRaises(Submission.DoesNotExist):
+            judge_task.fn("missing", 1, list(slot))
+        self.assertEqual(get_task_number(self.server.hostname), 0)
+
+    @mock.patch("judge.client.requests.Session.post", side_effect=requests.ConnectionError)
+    def test_mark_server_unhealthy(self, post):
+        slot = acquire_slot()
+        self.assertIsNone(JudgeServerClient(slot, "token").post("/judge", data={"src": ""}))
+        self.assertIsNone(acquire_slot())
+
+    @override_settings(JUDGE_SERVER_READ_TIMEOUT=0.2)
+    def test_read_timeout_keeps_server(self):
+        # 连接由内核完成，请求发出后一直没有响应，经过 session 中的 HTTPAdapter 和 Retry
+        with socket.socket() as server:
+            server.bind(("127.0.0.1", 0))
+            server.listen(1)
+            slot = acquire_slot()._replace(service_url=f"http://127.0.0.1:{server.getsockname()[1]}")
+            with mock.patch("judge.client.logger") as logger:
+                self.assertIsNone(JudgeServerClient(slot, "token").post("/judge", data={"src": ""}))
+        self.assertIsInstance(logger.exception.call_args[0][0], requests.ReadTimeout)
+        self.assertIsNotNone(acquire_slot())
+
+
 class LanguageListAPITest(APITestCase):
     def test_get_languages(self):
         resp = self.client.get(self.reverse("language_list_api"))
@@ -16,9 +16,11 @@ from requests.exceptions import RequestException
 from account.decorators import super_admin_required
 from account.models import User
 from contest.models import Contest
-from judge.dispatcher import process_pending_task
+from judge.dispatcher import process_pending_task, get_waiting_queue_metrics
+from judge.scheduler import register_judge_server, unregister_judge_server, get_task_number
 from options.options import SysOptions
 from problem.models import Problem
+from problem.test_case import delete_test_case_archives, prune_test_case_objects
 from submission.models import Submission
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer
 from utils.shortcuts import send_email, get_env
@@ -36,7 +38,7 @@ class SMTPAPI(APIView):
         smtp = SysOptions.smtp_config
         if not smtp:
             return self.success(None)
-        smtp.pop("password")
+        smtp = {k: v for k, v in smtp.items() if k != "password"}
         return self.success(smtp)
 
     @super_admin_required
@@ -48,11 +50,13 @@ class SMTPAPI(APIView):
     @super_admin_required
     @validate_serializer(EditSMTPConfigSerializer)
     def put(self, request):
-        smtp = SysOptions.smtp_config
+        # 配置缓存中的对象被所有请求共享，复制之后再修改
+        smtp = dict(SysOptions.smtp_config)
         data = request.data
         for item in ["server", "port", "email", "tls"]:
             smtp[item] = data[item]
-        if "password" in data:
+        # 没有填写新密码时保留原来的密码
+        if data.get("password"):
             smtp["password"] = data["password"]
         SysOptions.smtp_config = smtp
         return self.success()
@@ -110,13 +114,15 @@ class JudgeServerAPI(APIView):
     def get(self, request):
         servers = JudgeServer.objects.all().order_by("-last_heartbeat")
         return self.success({"token": SysOptions.judge_server_token,
-                             "servers": JudgeServerSerializer(servers, many=True).data})
+                             "servers": JudgeServerSerializer(servers, many=True).data,
+                             "waiting_queue": get_waiting_queue_metrics()})
 
     @super_admin_required
     def delete(self, request):
         hostname = request.GET.get("hostname")
         if hostname:
             JudgeServer.objects.filter(hostname=hostname).delete()
+            unregister_judge_server(hostname)
         return self.success()
 
     @validate_serializer(EditJudgeServerSerializer)
@@ -124,6 +130,9 @@ class JudgeServerAPI(APIView):
     def put(self, request):
         is_disabled = request.data.get("is_disabled", False)
         JudgeServer.objects.filter(id=request.data["id"]).update(is_disabled=is_disabled)
+        server = JudgeServer.objects.filter(id=request.data["id"]).first()
+        if server:
+            register_judge_server(server)
         if not is_disabled:
             process_pending_task()
         return self.success()
@@ -146,17 +155,21 @@ class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
             server.service_url = data["service_url"]
             server.ip = request.ip
             server.last_heartbeat = timezone.now()
-            server.save(update_fields=["judger_version", "cpu_core", "memory_usage", "service_url", "ip", "last_heartbeat"])
+            # task_number 只用于展示，真正的槽位计数在 redis 的租约中
+            server.task_number = get_task_number(server.hostname)
+            server.save(update_fields=["judger_version", "cpu_core", "memory_usage", "service_url", "ip", "last_heartbeat",
+                                       "task_number"])
         except JudgeServer.DoesNotExist:
-            JudgeServer.objects.create(hostname=data["hostname"],
-                                       judger_version=data["judger_version"],
-                                       cpu_core=data["cpu_core"],
-                                       memory_usage=data["memory"],
-                                       cpu_usage=data["cpu"],
-                                       ip=request.META["REMOTE_ADDR"],
-                                       service_url=data["service_url"],
-                                       last_heartbeat=timezone.now(),
-                                       )
+            server = JudgeServer.objects.create(hostname=data["hostname"],
+                                                judger_version=data["judger_version"],
+                                                cpu_core=data["cpu_core"],
+                                                memory_usage=data["memory"],
+                                                cpu_usage=data["cpu"],
+                                                ip=request.META["REMOTE_ADDR"],
+                                                service_url=data["service_url"],
+                                                last_heartbeat=timezone.now(),
+                                                )
+        register_judge_server(server)
         # 新server上线 处理队列中的，防止没有新的提交而导致一直waiting
         process_pending_task()
 
@@ -188,9 +201,11 @@ class TestCasePruneAPI(APIView):
         test_case_id = request.GET.get("id")
         if test_case_id:
             self.delete_one(test_case_id)
+            prune_test_case_objects()
             return self.success()
         for id in self.get_orphan_ids():
             self.delete_one(id)
+        prune_test_case_objects()
         return self.success()
 
     @staticmethod
@@ -206,6 +221,7 @@ class TestCasePruneAPI(APIView):
         test_case_dir = os.path.join(settings.TEST_CASE_DIR, id)
         if os.path.isdir(test_case_dir):
             shutil.rmtree(test_case_dir, ignore_errors=True)
+        delete_test_case_archives(id)
 
 
 class ReleaseNotesAPI(APIView):
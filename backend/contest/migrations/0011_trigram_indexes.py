@@ -0,0 +1,16 @@
+from django.db import migrations
+
+from utils.search import AddTrigramIndex
+
+
+class Migration(migrations.Migration):
+    # AddTrigramIndex 并发创建索引，不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('contest', '0010_auto_20190326_0201'),
+    ]
+
+    operations = [
+        AddTrigramIndex(table='contest', column='title', name='contest_title_trgm'),
+    ]
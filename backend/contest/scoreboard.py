@@ -0,0 +1,292 @@
+import json
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from account.models import AdminType
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from utils.events import get_channel, publish_event
+from .models import ACMContestRank, Contest, OIContestRank
+from .serializers import ACMContestRankSerializer, OIContestRankSerializer
+
+# ACM 排名的分数为 accepted_number * SCORE_BASE - total_time，total_time 以秒计，不会超过该值
+SCORE_BASE = 10 ** 10
+
+# KEYS: board, rows, versions, built
+# ARGV: start, member_1, score_1, row_1, member_2, ...
+# 只覆盖在 start 之前写入的行，重建期间判题更新的行以判题结果为准
+_REBUILD_SCRIPT = """
+local start = tonumber(ARGV[1])
+local fresh = {}
+for i = 2, #ARGV, 3 do
+    local member = ARGV[i]
+    fresh[member] = true
+    if tonumber(redis.call("HGET", KEYS[3], member) or 0) < start then
+        redis.call("ZADD", KEYS[1], ARGV[i + 1], member)
+        redis.call("HSET", KEYS[2], member, ARGV[i + 2])
+        redis.call("HSET", KEYS[3], member, start)
+    end
+end
+for _, member in ipairs(redis.call("HKEYS", KEYS[2])) do
+    if not fresh[member] and tonumber(redis.call("HGET", KEYS[3], member) or 0) < start then
+        redis.call("ZREM", KEYS[1], member)
+        redis.call("HDEL", KEYS[2], member)
+        redis.call("HDEL", KEYS[3], member)
+    end
+end
+redis.call("SET", KEYS[4], start)
+"""
+
+# KEYS: board, rows, versions, sequences
+# ARGV: member, sequence, score, row, now
+# 判题结果在事务提交后才写入，只有序号比已经写入的更大时才覆盖，避免较旧的排名行覆盖较新的
+_UPDATE_SCRIPT = """
+if tonumber(redis.call("HGET", KEYS[4], ARGV[1]) or 0) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+redis.call("HSET", KEYS[2], ARGV[1], ARGV[4])
+redis.call("HSET", KEYS[3], ARGV[1], ARGV[5])
+redis.call("HSET", KEYS[4], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: meta, versions
+# ARGV: version, create_time, old_version_ttl, rows_key_prefix
+# 只有比当前版本新时才切换，切换后所有不是当前版本的行设置过期时间，并发生成的快照也不会遗留
+_SWAP_SCRIPT = """
+local current = tonumber(redis.call("HGET", KEYS[1], "version") or 0)
+if tonumber(ARGV[1]) > current then
+    redis.call("HSET", KEYS[1], "version", ARGV[1], "create_time", ARGV[2])
+    current = tonumber(ARGV[1])
+end
+redis.call("PERSIST", ARGV[4] .. current)
+for _, member in ipairs(redis.call("SMEMBERS", KEYS[2])) do
+    if tonumber(member) ~= current then
+        redis.call("EXPIRE", ARGV[4] .. member, ARGV[3])
+        redis.call("SREM", KEYS[2], member)
+    end
+end
+return current
+"""
+
+# KEYS: meta, versions
+# ARGV: old_version_ttl, rows_key_prefix
+_INVALIDATE_SNAPSHOT_SCRIPT = """
+for _, member in ipairs(redis.call("SMEMBERS", KEYS[2])) do
+    redis.call("EXPIRE", ARGV[2] .. member, ARGV[1])
+end
+redis.call("DEL", KEYS[1], KEYS[2])
+"""
+
+_scripts = {}
+
+
+def _get_script(source):
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = cache.register_script(source)
+    return script
+
+
+class ContestScoreboard(object):
+    """
+    比赛排名保存在 redis 中，sorted set 按分数排序，hash 中保存序列化后的排名行
+    每次判题结果只更新一个用户，读取一页的复杂度为 O(log n + page)，不再访问数据库
+    """
+    def __init__(self, contest):
+        self.contest = contest
+        prefix = f"{CacheKey.contest_scoreboard}:{contest.id}"
+        self.board_key = prefix
+        self.rows_key = f"{prefix}:rows"
+        self.versions_key = f"{prefix}:versions"
+        self.built_key = f"{prefix}:built"
+        # 每次更新的序号，在持有排名行锁时取得，顺序与数据库中的更新顺序一致
+        self.sequence_key = f"{prefix}:sequence"
+        self.sequences_key = f"{prefix}:sequences"
+        self.lock_key = f"{prefix}:lock"
+
+    @property
+    def is_acm(self):
+        return self.contest.rule_type == ContestRuleType.ACM
+
+    def get_score(self, rank):
+        if self.is_acm:
+            return rank.accepted_number * SCORE_BASE - rank.total_time
+        return rank.total_score
+
+    def serialize(self, rank):
+        serializer = ACMContestRankSerializer if self.is_acm else OIContestRankSerializer
+        return json.dumps(serializer(rank, is_contest_admin=True).data)
+
+    def get_rank_queryset(self):
+        model = ACMContestRank if self.is_acm else OIContestRank
+        return model.objects.filter(contest=self.contest,
+                                    user__admin_type=AdminType.REGULAR_USER,
+                                    user__is_disabled=False).select_related("user", "user__userprofile")
+
+    def next_sequence(self):
+        return cache.redis_incr(self.sequence_key)
+
+    def update_on_commit(self, rank):
+        """
+        在持有排名行锁的事务中调用，事务提交之后写入 redis，回滚时不修改
+        """
+        sequence = self.next_sequence()
+        transaction.on_commit(lambda: self.update(rank, sequence))
+
+    def update(self, rank, sequence=None):
+        """
+        :param sequence: 持有排名行锁时取得的序号，写入时如果已经有序号更大的行则丢弃这次更新
+        """
+        if rank.user.admin_type != AdminType.REGULAR_USER or rank.user.is_disabled:
+            return
+        if sequence is None:
+            sequence = self.next_sequence()
+        member = str(rank.user_id)
+        row = self.serialize(rank)
+        keys = [self.board_key, self.rows_key, self.versions_key, self.sequences_key]
+        if not _get_script(_UPDATE_SCRIPT)(keys=keys, args=[member, sequence, self.get_score(rank), row, time.time()]):
+            return
+        # 非实时排名的比赛只在生成新快照时通知
+        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
+            row = json.loads(row)
+            row["user"]["real_name"] = None
+            publish_event(get_channel("contest_rank", self.contest.id), {"type": "rank", "row": row})
+
+    def rebuild(self):
+        start = time.time()
+        args = [start]
+        for rank in self.get_rank_queryset():
+            args.extend([str(rank.user_id), self.get_score(rank), self.serialize(rank)])
+        _get_script(_REBUILD_SCRIPT)(keys=[self.board_key, self.rows_key, self.versions_key, self.built_key], args=args)
+
+    def ensure_built(self):
+        if cache.exists(self.built_key):
+            return
+        with cache.lock(self.lock_key, timeout=60):
+            if not cache.exists(self.built_key):
+                self.rebuild()
+
+    def invalidate(self):
+        """
+        重判等无法增量更新的情况调用，下一次读取时从数据库重建
+        """
+        cache.delete(self.built_key)
+
+    def count(self):
+        return cache.zcard(self.board_key)
+
+    def __getitem__(self, item):
+        if item.stop <= item.start:
+            return []
+        members = cache.zrevrange(self.board_key, item.start, item.stop - 1)
+        if not members:
+            return []
+        return [json.loads(row) for row in cache.hmget(self.rows_key, members) if row]
+
+
+class _SnapshotRows(object):
+    def __init__(self, key):
+        self.key = key
+
+    def count(self):
+        return cache.llen(self.key)
+
+    def __getitem__(self, item):
+        if item.stop <= item.start:
+            return []
+        return [json.loads(row) for row in cache.lrange(self.key, item.start, item.stop - 1)]
+
+
+class ContestRankSnapshot(object):
+    """
+    非实时排名比赛的排名快照，每个版本是一个不可变的 list，保存序列化后的排名行
+    生成新版本后切换 meta 中的版本号，其他版本保留 OLD_VERSION_TTL 后过期，保证正在读取的请求不受影响
+    """
+    # 切换版本后旧版本的保留时间
+    OLD_VERSION_TTL = 60
+
+    def __init__(self, contest):
+        self.contest = contest
+        self.meta_key = f"{CacheKey.contest_rank_snapshot}:{contest.id}"
+        self.sequence_key = f"{self.meta_key}:sequence"
+        # 还没有设置过期时间的版本号
+        self.versions_key = f"{self.meta_key}:versions"
+        self.lock_key = f"{self.meta_key}:lock"
+
+    def _rows_key(self, version):
+        return f"{self.meta_key}:{version}"
+
+    def _get_meta(self):
+        meta = cache.hgetall(self.meta_key)
+        if not meta:
+            return None
+        return {"version": int(meta[b"version"]), "create_time": float(meta[b"create_time"])}
+
+    def publish(self):
+        scoreboard = ContestScoreboard(self.contest)
+        scoreboard.ensure_built()
+        members = cache.zrevrange(scoreboard.board_key, 0, -1)
+        rows = [row for row in cache.hmget(scoreboard.rows_key, members) if row] if members else []
+        version = cache.redis_incr(self.sequence_key)
+
+        pipe = cache.pipeline()
+        pipe.sadd(self.versions_key, version)
+        for index in range(0, len(rows), 1000):
+            pipe.rpush(self._rows_key(version), *rows[index:index + 1000])
+        pipe.execute()
+        _get_script(_SWAP_SCRIPT)(keys=[self.meta_key, self.versions_key],
+                                  args=[version, time.time(), self.OLD_VERSION_TTL, self._rows_key("")])
+        publish_event(get_channel("contest_rank", self.contest.id), {"type": "snapshot", "version": version})
+        return self._get_meta()
+
+    def get(self):
+        """
+        返回当前版本的 meta，没有快照或快照过期时只有一个请求重新生成，其他请求等待或继续使用旧版本
+        """
+        meta = self._get_meta()
+        if meta:
+            interval = settings.CONTEST_RANK_SNAPSHOT_INTERVAL
+            if not interval or time.time() - meta["create_time"] < interval:
+                return meta
+            lock = cache.lock(self.lock_key, timeout=60)
+            if not lock.acquire(blocking=False):
+                return meta
+        else:
+            lock = cache.lock(self.lock_key, timeout=60, blocking_timeout=30)
+            if not lock.acquire():
+                return self._get_meta() or self.publish()
+        try:
+            current = self._get_meta()
+            if current and (not meta or current["version"] != meta["version"]):
+                return current
+            return self.publish()
+        finally:
+            lock.release()
+
+    def get_rows(self, version):
+        return _SnapshotRows(self._rows_key(version))
+
+    def invalidate(self):
+        _get_script(_INVALIDATE_SNAPSHOT_SCRIPT)(keys=[self.meta_key, self.versions_key],
+                                                 args=[self.OLD_VERSION_TTL, self._rows_key("")])
+
+
+def invalidate_user_scoreboards(user_ids):
+    """
+    用户被禁用、删除、修改管理员类型或者显示的名字之后，参加过的比赛的排名和快照在下一次读取时重建
+    需要在删除用户之前调用，事务提交之后才清除缓存，重建时读到的是修改后的数据
+    """
+    contest_ids = set(ACMContestRank.objects.filter(user_id__in=user_ids).values_list("contest_id", flat=True))
+    contest_ids.update(OIContestRank.objects.filter(user_id__in=user_ids).values_list("contest_id", flat=True))
+    contests = list(Contest.objects.filter(id__in=contest_ids))
+
+    def invalidate():
+        for contest in contests:
+            ContestScoreboard(contest).invalidate()
+            ContestRankSnapshot(contest).invalidate()
+
+    transaction.on_commit(invalidate)
@@ -1,11 +1,19 @@
 import copy
+import time
 from datetime import datetime, timedelta
+from unittest import mock
 
+from django.core import signing
 from django.utils import timezone
 
+from account.models import AdminType, ProblemPermission
+from judge.dispatcher import JudgeDispatcher
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.events import EVENT_TOKEN_SALT, get_channel
 
-from .models import ContestAnnouncement, ContestRuleType, Contest
+from .models import ContestAnnouncement, ContestRuleType, Contest, ACMContestRank
+from .scoreboard import ContestScoreboard, ContestRankSnapshot
 
 DEFAULT_CONTEST_DATA = {"title": "test title", "description": "test description",
                         "start_time": timezone.localtime(timezone.now()),
@@ -160,3 +168,140 @@ class ContestRankAPITest(APITestCase):
     def get_contest_rank(self):
         resp = self.client.get(self.url + "?contest_id=" + self.acm_contest.id)
         self.assertSuccess(resp)
+
+
+class ContestScoreboardTest(APITestCase):
+    def setUp(self):
+        admin = self.create_admin()
+        self.contest = Contest.objects.create(created_by=admin, **DEFAULT_CONTEST_DATA)
+        self.scoreboard = ContestScoreboard(self.contest)
+        cache.delete_many([self.scoreboard.board_key, self.scoreboard.rows_key,
+                           self.scoreboard.versions_key, self.scoreboard.built_key,
+                           self.scoreboard.sequence_key, self.scoreboard.sequences_key])
+        self.first = ACMContestRank.objects.create(user=self.create_user("first", "first", login=False),
+                                                   contest=self.contest, accepted_number=2, total_time=3000)
+        self.second = ACMContestRank.objects.create(user=self.create_user("second", "second", login=False),
+                                                    contest=self.contest, accepted_number=2, total_time=1000)
+        ACMContestRank.objects.create(user=admin, contest=self.contest, accepted_number=3)
+
+    def get_usernames(self):
+        return [item["user"]["username"] for item in self.scoreboard[0:10]]
+
+    def test_rebuild(self):
+        self.scoreboard.ensure_built()
+        self.assertEqual(self.scoreboard.count(), 2)
+        self.assertEqual(self.get_usernames(), ["second", "first"])
+
+    def test_incremental_update(self):
+        self.scoreboard.ensure_built()
+        self.first.accepted_number = 3
+        self.first.total_time = 5000
+        self.first.save()
+        self.scoreboard.update(self.first)
+        self.assertEqual(self.get_usernames(), ["first", "second"])
+        self.assertEqual(self.scoreboard[0:1][0]["accepted_number"], 3)
+
+    def test_rebuild_keeps_newer_update(self):
+        self.scoreboard.ensure_built()
+        self.first.accepted_number = 3
+        # 模拟重建开始之后才写入的判题结果，数据库中的修改对重建不可见
+        with mock.patch("contest.scoreboard.time.time", return_value=time.time() + 60):
+            self.scoreboard.update(self.first)
+        self.scoreboard.rebuild()
+        self.assertEqual(self.get_usernames(), ["first", "second"])
+
+    def test_stale_update_discarded(self):
+        self.scoreboard.ensure_built()
+        # 两次判题按顺序持有行锁，但较早的一次在提交之后才写入 redis
+        older, newer = self.scoreboard.next_sequence(), self.scoreboard.next_sequence()
+        self.first.accepted_number = 4
+        self.scoreboard.update(copy.deepcopy(self.first), newer)
+        self.first.accepted_number = 3
+        self.scoreboard.update(self.first, older)
+        self.assertEqual(self.scoreboard[0:1][0]["accepted_number"], 4)
+
+    def test_judge_updates_after_commit(self):
+        self.scoreboard.ensure_built()
+        dispatcher = JudgeDispatcher.__new__(JudgeDispatcher)
+        dispatcher.contest = self.contest
+        dispatcher.submission = mock.Mock(user_id=self.first.user_id)
+
+        def update(rank):
+            rank.accepted_number = 3
+            rank.save()
+
+        with mock.patch.object(JudgeDispatcher, "_update_acm_contest_rank", side_effect=update):
+            with self.captureOnCommitCallbacks() as callbacks:
+                dispatcher.update_contest_rank()
+        # 事务提交之前 redis 中的排名不变
+        self.assertEqual(self.get_usernames(), ["second", "first"])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get_usernames(), ["first", "second"])
+
+    def test_disabled_user_removed(self):
+        self.scoreboard.ensure_built()
+        self.create_super_admin()
+        data = {"id": self.first.user_id, "username": "first", "real_name": None, "email": "first@test.com",
+                "admin_type": AdminType.REGULAR_USER, "problem_permission": ProblemPermission.NONE,
+                "open_api": False, "two_factor_auth": False, "is_disabled": True, "is_approved": True}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertSuccess(self.client.put(self.reverse("user_admin_api"), data=data))
+        self.assertEqual(self.get_usernames(), ["second"])
+
+
+class ContestRankSnapshotTest(APITestCase):
+    def setUp(self):
+        self.admin = self.create_admin()
+        data = copy.deepcopy(DEFAULT_CONTEST_DATA)
+        data["real_time_rank"] = False
+        self.contest = Contest.objects.create(created_by=self.admin, **data)
+        self.snapshot = ContestRankSnapshot(self.contest)
+        self.snapshot.invalidate()
+        ContestScoreboard(self.contest).invalidate()
+        self.rank = ACMContestRank.objects.create(user=self.create_user("test", "test", login=False),
+                                                  contest=self.contest, accepted_number=1, total_time=100)
+        self.url = self.reverse("contest_rank_api")
+
+    def test_snapshot_is_frozen(self):
+        meta = self.snapshot.get()
+        self.rank.accepted_number = 2
+        self.rank.save()
+        ContestScoreboard(self.contest).update(self.rank)
+        self.assertEqual(self.snapshot.get(), meta)
+        self.assertEqual(self.snapshot.get_rows(meta["version"])[0:10][0]["accepted_number"], 1)
+
+        new_meta = self.snapshot.publish()
+        self.assertEqual(new_meta["version"], meta["version"] + 1)
+        self.assertEqual(self.snapshot.get_rows(new_meta["version"])[0:10][0]["accepted_number"], 2)
+
+    def test_superseded_versions_expire(self):
+        redis = cache.get_client(write=True)
+        first = self.snapshot.get()["version"]
+        second = self.snapshot.publish()["version"]
+        # 切换之后旧版本设置过期时间，当前版本一直保留
+        self.assertGreater(redis.ttl(self.snapshot._rows_key(first)), 0)
+        self.assertEqual(redis.ttl(self.snapshot._rows_key(second)), -1)
+        self.snapshot.invalidate()
+        self.assertGreater(redis.ttl(self.snapshot._rows_key(second)), 0)
+        self.assertFalse(redis.exists(self.snapshot.versions_key))
+
+    def test_refresh_interval(self):
+        meta = self.snapshot.get()
+        with self.settings(CONTEST_RANK_SNAPSHOT_INTERVAL=10):
+            self.assertEqual(self.snapshot.get(), meta)
+            with mock.patch("contest.scoreboard.time.time", return_value=time.time() + 20):
+                self.assertEqual(self.snapshot.get()["version"], meta["version"] + 1)
+
+    def test_etag(self):
+        resp = self.client.get(f"{self.url}?contest_id={self.contest.id}")
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["total"], 1)
+        resp = self.client.get(f"{self.url}?contest_id={self.contest.id}", HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_event_token(self):
+        resp = self.client.get(self.reverse("contest_rank_event_api"), data={"contest_id": self.contest.id})
+        self.assertSuccess(resp)
+        token = signing.loads(resp.data["data"]["token"], salt=EVENT_TOKEN_SALT)
+        self.assertEqual(token["channel"], get_channel("contest_rank", self.contest.id))
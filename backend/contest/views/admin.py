@@ -4,17 +4,18 @@ import zipfile
 from ipaddress import ip_network
 
 import dateutil.parser
+from django.db import transaction
 from django.http import FileResponse
 
 from account.decorators import check_contest_permission, ensure_created_by
 from account.models import User
+from judge.cache import invalidate_judge_contest
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
-from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from utils.tasks import delete_files
 from ..models import Contest, ContestAnnouncement, ACMContestRank
+from ..scoreboard import ContestScoreboard, ContestRankSnapshot
 from ..serializers import (ContestAnnouncementSerializer, ContestAdminSerializer,
                            CreateConetestSeriaizer, CreateContestAnnouncementSerializer,
                            EditConetestSeriaizer, EditContestAnnouncementSerializer,
@@ -59,13 +60,13 @@ class ContestAPI(APIView):
                 ip_network(ip_range, strict=False)
             except ValueError:
                 return self.error(f"{ip_range} is not a valid cidr network")
-        if not contest.real_time_rank and data.get("real_time_rank"):
-            cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-            cache.delete(cache_key)
+        if contest.real_time_rank != data.get("real_time_rank"):
+            ContestRankSnapshot(contest).invalidate()
 
         for k, v in data.items():
             setattr(contest, k, v)
         contest.save()
+        invalidate_judge_contest(contest.id)
         return self.success(ContestAdminSerializer(contest).data)
 
     def get(self, request):
@@ -183,15 +184,18 @@ class ACMContestHelper(APIView):
     @validate_serializer(ACMContesHelperSerializer)
     def put(self, request):
         data = request.data
-        try:
-            rank = ACMContestRank.objects.get(pk=data["rank_id"])
-        except ACMContestRank.DoesNotExist:
-            return self.error("Rank id does not exist")
-        problem_rank_status = rank.submission_info.get(data["problem_id"])
-        if not problem_rank_status:
-            return self.error("Problem id does not exist")
-        problem_rank_status["checked"] = data["checked"]
-        rank.save(update_fields=("submission_info",))
+        with transaction.atomic():
+            try:
+                rank = ACMContestRank.objects.select_for_update(of=("self",)) \
+                    .select_related("user", "user__userprofile").get(pk=data["rank_id"])
+            except ACMContestRank.DoesNotExist:
+                return self.error("Rank id does not exist")
+            problem_rank_status = rank.submission_info.get(data["problem_id"])
+            if not problem_rank_status:
+                return self.error("Problem id does not exist")
+            problem_rank_status["checked"] = data["checked"]
+            rank.save(update_fields=("submission_info",))
+            ContestScoreboard(self.contest).update_on_commit(rank)
         return self.success()
 
 
@@ -1,22 +1,22 @@
 import io
 
 import xlsxwriter
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.utils.timezone import now
-from django.core.cache import cache
 
 from problem.models import Problem
 from utils.api import APIView, validate_serializer
-from utils.constants import CacheKey, CONTEST_PASSWORD_SESSION_KEY
+from utils.constants import CONTEST_PASSWORD_SESSION_KEY
+from utils.events import STREAM_PATH, create_event_token, get_channel
+from utils.search import search
 from utils.shortcuts import datetime2str, check_is_id
-from account.models import AdminType
 from account.decorators import login_required, check_contest_permission, check_contest_password
 
 from utils.constants import ContestRuleType, ContestStatus
-from ..models import ContestAnnouncement, Contest, OIContestRank, ACMContestRank
+from ..models import ContestAnnouncement, Contest
+from ..scoreboard import ContestScoreboard, ContestRankSnapshot
 from ..serializers import ContestAnnouncementSerializer
 from ..serializers import ContestSerializer, ContestPasswordVerifySerializer
-from ..serializers import OIContestRankSerializer, ACMContestRankSerializer
 
 
 class ContestAnnouncementListAPI(APIView):
@@ -63,7 +63,7 @@ class ContestListAPI(APIView):
         rule_type = request.GET.get("rule_type")
         status = request.GET.get("status")
         if keyword:
-            contests = contests.filter(title__contains=keyword)
+            contests = search(contests, ("title",), keyword)
         if rule_type:
             contests = contests.filter(rule_type=rule_type)
         if status:
@@ -121,18 +121,6 @@ class ContestAccessAPI(APIView):
 
 
 class ContestRankAPI(APIView):
-    def get_rank(self):
-        if self.contest.rule_type == ContestRuleType.ACM:
-            return ACMContestRank.objects.filter(contest=self.contest,
-                                                 user__admin_type=AdminType.REGULAR_USER,
-                                                 user__is_disabled=False).\
-                select_related("user").order_by("-accepted_number", "total_time")
-        else:
-            return OIContestRank.objects.filter(contest=self.contest,
-                                                user__admin_type=AdminType.REGULAR_USER,
-                                                user__is_disabled=False). \
-                select_related("user").order_by("-total_score")
-
     def column_string(self, n):
         string = ""
         while n > 0:
@@ -145,22 +133,35 @@ class ContestRankAPI(APIView):
         download_csv = request.GET.get("download_csv")
         force_refresh = request.GET.get("force_refresh")
         is_contest_admin = request.user.is_authenticated and request.user.is_contest_admin(self.contest)
-        if self.contest.rule_type == ContestRuleType.OI:
-            serializer = OIContestRankSerializer
-        else:
-            serializer = ACMContestRankSerializer
-
-        if force_refresh == "1" and is_contest_admin:
-            qs = self.get_rank()
+        etag = None
+
+        # OI 和实时排名的比赛从 redis 中的排名读取，判题时增量更新，否则读取排名快照
+        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank or \
+                force_refresh == "1" and is_contest_admin:
+            scoreboard = ContestScoreboard(self.contest)
+            if force_refresh == "1" and is_contest_admin:
+                scoreboard.rebuild()
+            else:
+                scoreboard.ensure_built()
+            qs = scoreboard
         else:
-            cache_key = f"{CacheKey.contest_rank_cache}:{self.contest.id}"
-            qs = cache.get(cache_key)
-            if not qs:
-                qs = self.get_rank()
-                cache.set(cache_key, qs)
+            snapshot = ContestRankSnapshot(self.contest)
+            meta = snapshot.get()
+            etag = f'"{self.contest.id}-{meta["version"]}-{int(is_contest_admin)}"'
+            if not download_csv and request.META.get("HTTP_IF_NONE_MATCH") == etag:
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                return response
+            qs = snapshot.get_rows(meta["version"])
+
+        def serialize(items):
+            if not is_contest_admin:
+                for item in items:
+                    item["user"]["real_name"] = None
+            return items
 
         if download_csv:
-            data = serializer(qs, many=True, is_contest_admin=is_contest_admin).data
+            data = serialize(qs[0:qs.count()])
             contest_problems = Problem.objects.filter(contest=self.contest, visible=True).order_by("_id")
             problem_ids = [item.id for item in contest_problems]
 
@@ -206,5 +207,19 @@ class ContestRankAPI(APIView):
             return response
 
         page_qs = self.paginate_data(request, qs)
-        page_qs["results"] = serializer(page_qs["results"], many=True, is_contest_admin=is_contest_admin).data
-        return self.success(page_qs)
+        page_qs["results"] = serialize(page_qs["results"])
+        response = self.success(page_qs)
+        if etag:
+            response["ETag"] = etag
+            response["Cache-Control"] = "no-cache"
+        return response
+
+
+class ContestRankEventAPI(APIView):
+    @check_contest_permission(check_type="ranks")
+    def get(self, request):
+        """
+        获取订阅排名推送的 token，实时排名推送变化的排名行，非实时排名在生成新快照时推送版本号
+        """
+        token = create_event_token(get_channel("contest_rank", self.contest.id))
+        return self.success({"token": token, "url": f"{STREAM_PATH}?token={token}"})
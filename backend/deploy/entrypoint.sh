@@ -3,7 +3,7 @@
 APP=/app
 DATA=/data
 
-mkdir -p $DATA/log $DATA/config $DATA/ssl $DATA/test_case $DATA/public/upload $DATA/public/avatar $DATA/public/website
+mkdir -p $DATA/log $DATA/config $DATA/ssl $DATA/test_case $DATA/blob $DATA/public/upload $DATA/public/avatar $DATA/public/website
 
 if [ ! -f "$DATA/config/secret.key" ]; then
     echo $(cat /dev/urandom | head -1 | md5sum | head -c 32) > "$DATA/config/secret.key"
@@ -76,10 +76,11 @@ adduser -u 900 -S -G spj server
 
 # Only chown dist if it exists
 if [ -d "$APP/dist" ]; then
-    chown -R server:spj $DATA $APP/dist
-else
-    chown -R server:spj $DATA
+    chown -R server:spj $APP/dist
 fi
+# blob 中的文件随提交数量增长，都由 server 用户创建，只修改 blob 目录本身
+find $DATA -path $DATA/blob -prune -o -exec chown server:spj {} +
+chown server:spj $DATA/blob
 find $DATA/test_case -type d -exec chmod 710 {} \;
 find $DATA/test_case -type f -exec chmod 640 {} \;
 exec supervisord -c /app/deploy/supervisord.conf
@@ -0,0 +1,71 @@
+from django.db.models import OuterRef, Subquery
+
+from account.models import User
+from problem.models import Problem
+from submission.models import Submission
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 修改缓存内容的结构时增加版本号，避免读到旧结构的数据
+JUDGE_PROBLEM_CACHE_VERSION = 1
+JUDGE_PROBLEM_CACHE_TIMEOUT = 600
+
+# 判题时用不到的大字段，访问时才会从数据库读取
+_PROBLEM_DEFERRED_FIELDS = ("description", "input_description", "output_description", "samples", "hint", "source",
+                            "contest__description")
+
+
+def _problem_key(problem_id):
+    return f"{CacheKey.judge_problem}:v{JUDGE_PROBLEM_CACHE_VERSION}:{problem_id}"
+
+
+def get_judge_problems(problem_ids):
+    """
+    读取判题需要的题目和所属比赛，缓存中没有时从数据库读取并写入缓存
+    :return: {problem_id: Problem}
+    """
+    problem_ids = set(problem_ids)
+    keys = {_problem_key(problem_id): problem_id for problem_id in problem_ids}
+    problems = {keys[key]: problem for key, problem in cache.get_many(list(keys)).items()}
+    missing = problem_ids - set(problems)
+    if missing:
+        loaded = Problem.objects.select_related("contest").defer(*_PROBLEM_DEFERRED_FIELDS).in_bulk(missing)
+        cache.set_many({_problem_key(problem_id): problem for problem_id, problem in loaded.items()},
+                       timeout=JUDGE_PROBLEM_CACHE_TIMEOUT)
+        problems.update(loaded)
+    return problems
+
+
+def get_judge_problem(problem_id):
+    try:
+        return get_judge_problems([problem_id])[problem_id]
+    except KeyError:
+        raise Problem.DoesNotExist(f"Problem {problem_id} does not exist")
+
+
+def invalidate_judge_problems(problem_ids):
+    cache.delete_many([_problem_key(problem_id) for problem_id in problem_ids])
+
+
+def invalidate_judge_contest(contest_id):
+    # 比赛的字段缓存在所属题目中
+    invalidate_judge_problems(list(Problem.objects.filter(contest_id=contest_id).values_list("id", flat=True)))
+
+
+def get_judge_submissions():
+    """
+    在同一条查询中带出提交者的 is_disabled 和 admin_type
+    """
+    users = User.objects.filter(id=OuterRef("user_id"))
+    return Submission.objects.annotate(user_is_disabled=Subquery(users.values("is_disabled")[:1]),
+                                       user_admin_type=Subquery(users.values("admin_type")[:1]))
+
+
+def get_judge_user(submission):
+    """
+    get_judge_submissions() 查出的提交可以直接构造提交者，不再查询数据库
+    """
+    if hasattr(submission, "user_admin_type"):
+        return User(id=submission.user_id, admin_type=submission.user_admin_type,
+                    is_disabled=submission.user_is_disabled)
+    return User.objects.get(id=submission.user_id)
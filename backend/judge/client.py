@@ -0,0 +1,103 @@
+import logging
+import threading
+from urllib.parse import urljoin
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from judge.scheduler import mark_server_unhealthy
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(service_url):
+    """
+    每个判题服务器一个 session，复用 keep-alive 连接，避免每次判题都重新建立 TCP 连接
+    """
+    with _sessions_lock:
+        session = _sessions.get(service_url)
+        if session is None:
+            # 只重试连接阶段的错误，判题请求可能已经在判题服务器上执行，读超时后不能重放
+            # read=False 时直接抛出 ReadTimeout，read=0 会包装成 ConnectionError，判题服务器会被误认为不可用
+            retry = Retry(total=settings.JUDGE_SERVER_MAX_RETRIES, connect=settings.JUDGE_SERVER_MAX_RETRIES,
+                          read=False, status=0, allowed_methods=None, backoff_factor=0.5)
+            adapter = HTTPAdapter(pool_maxsize=settings.JUDGE_SERVER_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[service_url] = session
+        return session
+
+
+def create_async_client():
+    """
+    供协程判题使用，调用方负责关闭，一个 client 在同一个事件循环中复用连接池
+    """
+    return httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(retries=settings.JUDGE_SERVER_MAX_RETRIES),
+                             timeout=httpx.Timeout(settings.JUDGE_SERVER_READ_TIMEOUT,
+                                                   connect=settings.JUDGE_SERVER_CONNECT_TIMEOUT),
+                             limits=httpx.Limits(max_connections=None,
+                                                 max_keepalive_connections=settings.JUDGE_SERVER_POOL_SIZE))
+
+
+class JudgeServerClient(object):
+    def __init__(self, server, token):
+        self.server = server
+        self.headers = {"X-Judge-Server-Token": token}
+
+    def _url(self, path):
+        return urljoin(self.server.service_url, path)
+
+    def _on_error(self, e, unhealthy=False):
+        logger.exception(e)
+        if unhealthy:
+            # 在一段时间内不再向该判题服务器分配任务
+            mark_server_unhealthy(self.server.hostname)
+
+    def _parse(self, resp):
+        # 读超时只说明这次判题慢，只有连接失败和 5xx 才认为判题服务器不可用
+        if resp.status_code >= 500:
+            logger.error(f"Judge server {self.server.hostname} returned {resp.status_code}")
+            mark_server_unhealthy(self.server.hostname)
+            return None
+        try:
+            return resp.json()
+        except ValueError as e:
+            self._on_error(e)
+
+    def post(self, path, data=None):
+        kwargs = {"headers": self.headers,
+                  "timeout": (settings.JUDGE_SERVER_CONNECT_TIMEOUT, settings.JUDGE_SERVER_READ_TIMEOUT)}
+        if data:
+            kwargs["json"] = data
+        try:
+            resp = _get_session(self.server.service_url).post(self._url(path), **kwargs)
+        except requests.ConnectionError as e:
+            return self._on_error(e, unhealthy=True)
+        except requests.RequestException as e:
+            return self._on_error(e)
+        return self._parse(resp)
+
+
+class AsyncJudgeServerClient(JudgeServerClient):
+    def __init__(self, server, token, client):
+        super().__init__(server, token)
+        self.client = client
+
+    async def post(self, path, data=None):
+        kwargs = {"headers": self.headers}
+        if data:
+            kwargs["json"] = data
+        try:
+            resp = await self.client.post(self._url(path), **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            return self._on_error(e, unhealthy=True)
+        except httpx.HTTPError as e:
+            return self._on_error(e)
+        return self._parse(resp)
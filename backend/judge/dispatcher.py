@@ -1,76 +1,134 @@
+import functools
 import hashlib
 import json
 import logging
-from urllib.parse import urljoin
+import time
 
-import requests
-from django.db import transaction, IntegrityError
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction, IntegrityError
 from django.db.models import F
 
-from account.models import User
-from conf.models import JudgeServer
+from account.models import UserProfile
 from contest.models import ContestRuleType, ACMContestRank, OIContestRank, ContestStatus
+from contest.scoreboard import ContestScoreboard
 from options.options import SysOptions
-from problem.models import Problem, ProblemRuleType
+from problem.counters import add_problem_counters, is_first_accepted
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
 from problem.utils import parse_problem_template
 from submission.models import JudgeStatus, Submission
 from utils.cache import cache
 from utils.constants import CacheKey
+from utils.events import get_channel, publish_event
+from judge.cache import get_judge_problem, get_judge_submissions, get_judge_user
+from judge.client import JudgeServerClient, AsyncJudgeServerClient
+from judge.scheduler import JudgeServerSlot, acquire_slot, release_slot
 
 logger = logging.getLogger(__name__)
 
+# 这些结果不计入题目计数器，重判时也没有需要撤销的计数
+UNCOUNTED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING, JudgeStatus.SYSTEM_ERROR)
+
+
+def db_sync_to_async(func):
+    """
+    只访问数据库的同步函数在默认线程池中执行，同一批判题的数据库操作可以并发，不经过 asgiref 唯一的共享线程
+    线程池中的线程不处理请求，执行完后自己关闭数据库连接
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False)
+
 
 # 继续处理在队列中的问题
 def process_pending_task():
-    if cache.llen(CacheKey.waiting_queue):
-        # 防止循环引入
-        from judge.tasks import judge_task
+    # 防止循环引入
+    from judge.tasks import judge_task, judge_concurrent_task
+    # 只要集群中还有空闲槽位就持续从队列中取任务，先租用槽位再出队，槽位随任务一起交给判题任务
+    tasks = []
+    while cache.llen(CacheKey.waiting_queue):
+        slot = acquire_slot()
+        if not slot:
+            break
         tmp_data = cache.rpop(CacheKey.waiting_queue)
-        if tmp_data:
-            data = json.loads(tmp_data.decode("utf-8"))
-            judge_task.send(**data)
+        if not tmp_data:
+            release_slot(slot)
+            break
+        data = json.loads(tmp_data.decode("utf-8"))
+        enqueue_time = data.pop("enqueue_time", None)
+        if enqueue_time:
+            _record_wait_time(time.time() - enqueue_time)
+        data["slot"] = list(slot)
+        tasks.append(data)
+    # 一次取出多个任务时交给同一个 worker 线程并发判题
+    if len(tasks) == 1:
+        judge_task.send(**tasks[0])
+    elif tasks:
+        judge_concurrent_task.send(tasks)
+
+
+def _record_wait_time(wait_time):
+    pipe = cache.pipeline()
+    pipe.hincrby(CacheKey.waiting_queue_metrics, "dispatched", 1)
+    pipe.hincrbyfloat(CacheKey.waiting_queue_metrics, "total_wait", wait_time)
+    pipe.hset(CacheKey.waiting_queue_metrics, "last_wait", wait_time)
+    pipe.execute()
+
+
+def get_waiting_queue_metrics():
+    depth = cache.llen(CacheKey.waiting_queue)
+    oldest_wait = 0
+    oldest = cache.lindex(CacheKey.waiting_queue, -1)
+    if oldest:
+        enqueue_time = json.loads(oldest.decode("utf-8")).get("enqueue_time")
+        if enqueue_time:
+            oldest_wait = time.time() - enqueue_time
+    stats = cache.hgetall(CacheKey.waiting_queue_metrics)
+    dispatched = int(stats.get(b"dispatched", 0))
+    total_wait = float(stats.get(b"total_wait", 0))
+    return {"depth": depth,
+            "oldest_wait": oldest_wait,
+            "dispatched": dispatched,
+            "average_wait": total_wait / dispatched if dispatched else 0,
+            "last_wait": float(stats.get(b"last_wait", 0))}
 
 
 class ChooseJudgeServer:
-    def __init__(self):
-        self.server = None
+    def __init__(self, slot=None):
+        # slot 不为空时说明是 process_pending_task 已经为该任务租用好的槽位
+        self.slot = slot
 
-    def __enter__(self) -> [JudgeServer, None]:
-        with transaction.atomic():
-            servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
-            servers = [s for s in servers if s.status == "normal"]
-            for server in servers:
-                if server.task_number <= server.cpu_core * 2:
-                    server.task_number = F("task_number") + 1
-                    server.save(update_fields=["task_number"])
-                    self.server = server
-                    return server
-        return None
+    def __enter__(self) -> [JudgeServerSlot, None]:
+        # 在 redis 中原子地租用一个判题槽位，不再对 JudgeServer 表加行锁
+        if not self.slot:
+            self.slot = acquire_slot()
+        return self.slot
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.server:
-            JudgeServer.objects.filter(id=self.server.id).update(task_number=F("task_number") - 1)
+        if self.slot:
+            release_slot(self.slot)
+            # 槽位释放后立即尝试处理队列中剩余的任务
+            process_pending_task()
 
 
 class DispatcherBase(object):
     def __init__(self):
         self.token = hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest()
 
-    def _request(self, url, data=None):
-        kwargs = {"headers": {"X-Judge-Server-Token": self.token}}
-        if data:
-            kwargs["json"] = data
-        try:
-            return requests.post(url, **kwargs).json()
-        except Exception as e:
-            logger.exception(e)
+    def _request(self, server, path, data=None):
+        return JudgeServerClient(server, self.token).post(path, data=data)
+
+    async def _request_async(self, client, server, path, data=None):
+        return await AsyncJudgeServerClient(server, self.token, client).post(path, data=data)
 
 
 class SPJCompiler(DispatcherBase):
     def __init__(self, spj_code, spj_version, spj_language):
         super().__init__()
-        spj_compile_config = list(filter(lambda config: spj_language == config["name"], SysOptions.spj_languages))[0]["spj"][
-            "compile"]
+        spj_compile_config = SysOptions.language_registry.get_spj_config(spj_language)["compile"]
         self.data = {
             "src": spj_code,
             "spj_version": spj_version,
@@ -81,7 +139,7 @@ class SPJCompiler(DispatcherBase):
         with ChooseJudgeServer() as server:
             if not server:
                 return "No available judge_server"
-            result = self._request(urljoin(server.service_url, "compile_spj"), data=self.data)
+            result = self._request(server, "compile_spj", data=self.data)
             if not result:
                 return "Failed to call judge server"
             if result["err"]:
@@ -89,17 +147,26 @@ class SPJCompiler(DispatcherBase):
 
 
 class JudgeDispatcher(DispatcherBase):
-    def __init__(self, submission_id, problem_id):
+    def __init__(self, submission_id, problem_id, submission=None, problem=None, problem_data=None, rejudge=False):
+        """
+        批量判题时由调用方一次性查出 submission 和 problem 传入，同一题目的提交共享 problem 和 problem_data
+        rejudge 为 True 时只修正题目计数器，用户的题目状态和比赛排名由批量重判任务统一重建
+        """
         super().__init__()
-        self.submission = Submission.objects.get(id=submission_id)
+        self.rejudge = rejudge
+        self.submission = submission or get_judge_submissions().get(id=submission_id)
         self.contest_id = self.submission.contest_id
-        self.last_result = self.submission.result if self.submission.info else None
-
+        # 上次判题已经计入题目计数器的结果，编译错误的 info 为空，不能根据 info 判断
+        self.last_result = None if self.submission.result in UNCOUNTED_RESULTS else self.submission.result
+
+        if problem is None:
+            problem = get_judge_problem(problem_id)
+            if problem.contest_id != self.contest_id:
+                raise Problem.DoesNotExist(f"Problem {problem_id} is not in contest {self.contest_id}")
+        self.problem = problem
         if self.contest_id:
-            self.problem = Problem.objects.select_related("contest").get(id=problem_id, contest_id=self.contest_id)
             self.contest = self.problem.contest
-        else:
-            self.problem = Problem.objects.get(id=problem_id)
+        self.problem_data = problem_data or self.build_problem_data(self.problem)
 
     def _compute_statistic_info(self, resp_data):
         # 用时和内存占用保存为多个测试点中最长的那个
@@ -122,15 +189,29 @@ class JudgeDispatcher(DispatcherBase):
                 return
             self.submission.statistic_info["score"] = score
 
-    def judge(self):
-        language = self.submission.language
-        sub_config = list(filter(lambda item: language == item["name"], SysOptions.languages))[0]
+    @staticmethod
+    def build_problem_data(problem):
+        """
+        判题参数中只与题目有关的部分
+        """
         spj_config = {}
-        if self.problem.spj_code:
-            for lang in SysOptions.spj_languages:
-                if lang["name"] == self.problem.spj_language:
-                    spj_config = lang["spj"]
-                    break
+        if problem.spj_code:
+            spj_config = SysOptions.language_registry.spj_languages.get(problem.spj_language, {}).get("spj", {})
+        return {
+            "max_cpu_time": problem.time_limit,
+            "max_memory": 1024 * 1024 * problem.memory_limit,
+            "test_case_id": problem.test_case_id,
+            "output": False,
+            "spj_version": problem.spj_version,
+            "spj_config": spj_config.get("config"),
+            "spj_compile_config": spj_config.get("compile"),
+            "spj_src": problem.spj_code,
+            "io_mode": problem.io_mode
+        }
+
+    def _build_judge_data(self):
+        language = self.submission.language
+        language_config = SysOptions.language_registry.get_judge_config(language, self.problem.io_mode["io_mode"])
 
         if language in self.problem.template:
             template = parse_problem_template(self.problem.template[language])
@@ -138,30 +219,55 @@ class JudgeDispatcher(DispatcherBase):
         else:
             code = self.submission.code
 
-        data = {
-            "language_config": sub_config["config"],
-            "src": code,
-            "max_cpu_time": self.problem.time_limit,
-            "max_memory": 1024 * 1024 * self.problem.memory_limit,
-            "test_case_id": self.problem.test_case_id,
-            "output": False,
-            "spj_version": self.problem.spj_version,
-            "spj_config": spj_config.get("config"),
-            "spj_compile_config": spj_config.get("compile"),
-            "spj_src": self.problem.spj_code,
-            "io_mode": self.problem.io_mode
-        }
+        data = {"language_config": language_config, "src": code}
+        data.update(self.problem_data)
+        return data
 
-        with ChooseJudgeServer() as server:
+    def _publish_status(self, result):
+        publish_event(get_channel("submission", self.submission.id),
+                      {"type": "status", "submission_id": self.submission.id, "result": result}, keep_last=True)
+
+    def _enqueue(self):
+        data = {"submission_id": self.submission.id, "problem_id": self.problem.id, "enqueue_time": time.time()}
+        cache.lpush(CacheKey.waiting_queue, json.dumps(data))
+        self._publish_status(JudgeStatus.PENDING)
+
+    def _set_judging(self):
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
+        self._publish_status(JudgeStatus.JUDGING)
+
+    def judge(self, slot=None):
+        data = self._build_judge_data()
+        with ChooseJudgeServer(slot) as server:
             if not server:
-                data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
-                cache.lpush(CacheKey.waiting_queue, json.dumps(data))
+                self._enqueue()
                 return
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
-            resp = self._request(urljoin(server.service_url, "/judge"), data=data)
+            self._set_judging()
+            resp = self._request(server, "/judge", data=data)
+        self._handle_judge_response(resp)
+
+    async def judge_async(self, client, slot=None):
+        """
+        协程版本的 judge，等待判题服务器返回时不占用线程，数据库操作在 db_sync_to_async 的线程池中执行
+        :param client: create_async_client() 创建的 httpx.AsyncClient
+        """
+        data = await db_sync_to_async(self._build_judge_data)()
+        with ChooseJudgeServer(slot) as server:
+            if not server:
+                self._enqueue()
+                return
+            await db_sync_to_async(self._set_judging)()
+            resp = await self._request_async(client, server, "/judge", data=data)
+        await db_sync_to_async(self._handle_judge_response)(resp)
 
+    def _handle_judge_response(self, resp):
         if not resp:
             Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
+            self.submission.result = JudgeStatus.SYSTEM_ERROR
+            self._publish_status(JudgeStatus.SYSTEM_ERROR)
+            # 上次的结果已经计入题目计数器，改为系统错误后撤销
+            if self.last_result is not None:
+                self.update_problem_counters_rejudge()
             return
 
         if resp["err"]:
@@ -182,10 +288,15 @@ class JudgeDispatcher(DispatcherBase):
             else:
                 self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
         self.submission.save()
+        self._publish_status(self.submission.result)
+
+        if self.rejudge:
+            self.update_problem_counters_rejudge()
+            return
 
         if self.contest_id:
             if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
-                    User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
+                    get_judge_user(self.submission).is_contest_admin(self.contest):
                 logger.info(
                     "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
                 return
@@ -193,147 +304,120 @@ class JudgeDispatcher(DispatcherBase):
                 self.update_contest_problem_status()
                 self.update_contest_rank()
         else:
-            if self.last_result:
+            if self.last_result is not None:
                 self.update_problem_status_rejudge()
             else:
                 self.update_problem_status()
 
-        # 至此判题结束，尝试处理任务队列中剩余的任务
-        process_pending_task()
+    def _lock_problem_status(self):
+        """
+        锁定用户在该题目上的状态行，不存在时用本次判题结果创建
+        :return: (UserProblemStatus, created)
+        """
+        def get_status():
+            return UserProblemStatus.objects.select_for_update().get(user_id=self.submission.user_id,
+                                                                     problem_id=self.problem.id)
+
+        try:
+            return get_status(), False
+        except UserProblemStatus.DoesNotExist:
+            try:
+                with transaction.atomic():
+                    return UserProblemStatus.objects.create(user_id=self.submission.user_id,
+                                                            problem_id=self.problem.id,
+                                                            contest_id=self.contest_id,
+                                                            status=self.submission.result,
+                                                            score=self.submission.statistic_info.get("score", 0)), True
+            except IntegrityError:
+                return get_status(), False
+
+    def _update_user_problem_status(self, rule_type, count_submission):
+        """
+        更新用户的题目状态和 UserProfile 中的计数器，计数器使用 F 表达式更新，不再锁定用户
+        """
+        profile_update = {}
+        if count_submission:
+            profile_update["submission_number"] = F("submission_number") + 1
+        status, created = self._lock_problem_status()
+        # 已经 AC 的题目不再更新状态
+        if created or status.status != JudgeStatus.ACCEPTED:
+            if self.submission.result == JudgeStatus.ACCEPTED:
+                profile_update["accepted_number"] = F("accepted_number") + 1
+            if rule_type == ProblemRuleType.OI:
+                score = self.submission.statistic_info["score"]
+                # 计算总分时， 应先减掉上次该题所得分数， 然后再加上本次所得分数
+                last_score = 0 if created else status.score
+                profile_update["total_score"] = F("total_score") - last_score + score
+                status.score = score
+            if not created:
+                status.status = self.submission.result
+                status.save(update_fields=["status", "score"])
+        if profile_update:
+            UserProfile.objects.filter(user_id=self.submission.user_id).update(**profile_update)
+
+    def _add_problem_counters(self, submission_number, accepted_number, results):
+        # 题目的计数器在 redis 中累加，事务提交后再写入，定期写回数据库
+        transaction.on_commit(lambda: add_problem_counters(self.problem.id, submission_number=submission_number,
+                                                           accepted_number=accepted_number, results=results))
+
+    def _add_problem_counters_rejudge(self):
+        # 撤销上次判题结果的计数，再计入本次结果，没有计数的结果两边都跳过
+        last_counted = self.last_result is not None
+        counted = self.submission.result not in UNCOUNTED_RESULTS
+        results = {}
+        if last_counted:
+            results[str(self.last_result)] = -1
+        if counted:
+            key = str(self.submission.result)
+            results[key] = results.get(key, 0) + 1
+        results = {key: count for key, count in results.items() if count}
+        submission_number = int(counted) - int(last_counted)
+        accepted_number = int(self.submission.result == JudgeStatus.ACCEPTED) - \
+            int(self.last_result == JudgeStatus.ACCEPTED)
+        if submission_number or accepted_number or results:
+            self._add_problem_counters(submission_number, accepted_number, results)
 
     def update_problem_status_rejudge(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
         with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[self.last_result] = problem_info.get(self.last_result, 1) - 1
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "statistic_info"])
-
-            profile = User.objects.select_for_update().get(id=self.submission.user_id).userprofile
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get("problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(update_fields=["accepted_number", "acm_problems_status"])
+            self._update_user_problem_status(self.problem.rule_type, count_submission=False)
+            self._add_problem_counters_rejudge()
 
-            else:
-                oi_problems_status = profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this tim score
-                    profile.add_score(this_time_score=score,
-                                      last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(update_fields=["accepted_number", "oi_problems_status"])
+    def update_problem_counters_rejudge(self):
+        if self.contest_id:
+            # 比赛中只有比赛进行期间非管理员的提交计入题目计数器
+            if not self.contest.start_time <= self.submission.create_time < self.contest.end_time or \
+                    get_judge_user(self.submission).is_contest_admin(self.contest):
+                return
+        self._add_problem_counters_rejudge()
 
     def update_problem_status(self):
         result = str(self.submission.result)
-        problem_id = str(self.problem.id)
+        accepted_number = int(self.submission.result == JudgeStatus.ACCEPTED)
         with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "submission_number", "statistic_info"])
-
-            # update_userprofile
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get("problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {"status": self.submission.result,
-                                                      "_id": self.problem._id,
-                                                      "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this time score
-                    user_profile.add_score(this_time_score=score,
-                                           last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "oi_problems_status"])
+            self._update_user_problem_status(self.problem.rule_type, count_submission=True)
+            self._add_problem_counters(1, accepted_number, {result: 1})
 
     def update_contest_problem_status(self):
         with transaction.atomic():
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            problem_id = str(self.problem.id)
-            if self.contest.rule_type == ContestRuleType.ACM:
-                contest_problems_status = user_profile.acm_problems_status.get("contest_problems", {})
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                elif contest_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                else:
+            status, created = self._lock_problem_status()
+            if not created:
+                if self.contest.rule_type == ContestRuleType.ACM:
                     # 如果已AC， 直接跳过 不计入任何计数器
-                    return
-                user_profile.acm_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["acm_problems_status"])
-
-            elif self.contest.rule_type == ContestRuleType.OI:
-                contest_problems_status = user_profile.oi_problems_status.get("contest_problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result,
-                                                           "_id": self.problem._id,
-                                                           "score": score}
+                    if status.status == JudgeStatus.ACCEPTED:
+                        return
                 else:
-                    contest_problems_status[problem_id]["score"] = score
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                user_profile.oi_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["oi_problems_status"])
-
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            result = str(self.submission.result)
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem.save(update_fields=["submission_number", "accepted_number", "statistic_info"])
+                    status.score = self.submission.statistic_info["score"]
+                status.status = self.submission.result
+                status.save(update_fields=["status", "score"])
 
-    def update_contest_rank(self):
-        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest.id}")
+            accepted_number = int(self.submission.result == JudgeStatus.ACCEPTED)
+            self._add_problem_counters(1, accepted_number, {str(self.submission.result): 1})
 
+    def update_contest_rank(self):
         def get_rank(model):
-            return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
+            # 序列化排名行时需要用户信息，只锁定排名行
+            return model.objects.select_for_update(of=("self",)).select_related("user", "user__userprofile") \
+                .get(user_id=self.submission.user_id, contest=self.contest)
 
         if self.contest.rule_type == ContestRuleType.ACM:
             model = ACMContestRank
@@ -350,16 +434,15 @@ class JudgeDispatcher(DispatcherBase):
                 rank = get_rank(model)
             except IntegrityError:
                 rank = get_rank(model)
-        func(rank)
+        if func(rank) is not False:
+            ContestScoreboard(self.contest).update_on_commit(rank)
 
     def _update_acm_contest_rank(self, rank):
         info = rank.submission_info.get(str(self.submission.problem_id))
-        # 因前面更改过，这里需要重新获取
-        problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
         # 此题提交过
         if info:
             if info["is_ac"]:
-                return
+                return False
 
             rank.submission_number += 1
             if self.submission.result == JudgeStatus.ACCEPTED:
@@ -368,7 +451,7 @@ class JudgeDispatcher(DispatcherBase):
                 info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
                 rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
 
-                if problem.accepted_number == 1:
+                if is_first_accepted(self.problem.id):
                     info["is_first_ac"] = True
             elif self.submission.result != JudgeStatus.COMPILE_ERROR:
                 info["error_number"] += 1
@@ -383,7 +466,7 @@ class JudgeDispatcher(DispatcherBase):
                 info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
                 rank.total_time += info["ac_time"]
 
-                if problem.accepted_number == 1:
+                if is_first_accepted(self.problem.id):
                     info["is_first_ac"] = True
 
             elif self.submission.result != JudgeStatus.COMPILE_ERROR:
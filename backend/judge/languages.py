@@ -233,3 +233,39 @@ languages = [
     {"config": _go_lang_config, "name": "Golang", "description": "Golang 1.22", "content_type": "text/x-go"},
     {"config": _node_lang_config, "name": "JavaScript", "description": "Node.js 20", "content_type": "text/javascript"},
 ]
+
+
+class LanguageRegistry:
+    """
+    按名称索引的语言配置，在配置读取时构建并检查，判题时不再遍历语言列表
+    """
+    def __init__(self, languages):
+        self.languages = {}
+        self.spj_languages = {}
+        # (name, io_mode) -> 发送给判题服务器的 language_config，seccomp_rule 已经按 io_mode 确定
+        self.judge_configs = {}
+        for item in languages:
+            name = item.get("name")
+            if not name or name in self.languages:
+                raise ValueError(f"Invalid or duplicate language name: {name}")
+            config = item.get("config") or {}
+            run = config.get("run")
+            if not run or "command" not in run:
+                raise ValueError(f"Invalid run config for language {name}")
+            self.languages[name] = item
+            if "spj" in item:
+                if "compile" not in item["spj"] or "config" not in item["spj"]:
+                    raise ValueError(f"Invalid spj config for language {name}")
+                self.spj_languages[name] = item
+            seccomp_rule = run.get("seccomp_rule")
+            for io_mode in ProblemIOMode.choices():
+                rule = seccomp_rule.get(io_mode) if isinstance(seccomp_rule, dict) else seccomp_rule
+                self.judge_configs[(name, io_mode)] = dict(config, run=dict(run, seccomp_rule=rule))
+        self.language_names = list(self.languages)
+        self.spj_language_names = list(self.spj_languages)
+
+    def get_judge_config(self, name, io_mode):
+        return self.judge_configs[(name, io_mode)]
+
+    def get_spj_config(self, name):
+        return self.spj_languages[name]["spj"]
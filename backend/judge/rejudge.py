@@ -0,0 +1,335 @@
+import json
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from account.models import AdminType, User, UserProfile
+from contest.models import ACMContestRank, Contest, OIContestRank
+from contest.scoreboard import ContestRankSnapshot, ContestScoreboard
+from judge.cache import get_judge_problems
+from judge.scheduler import acquire_slot, release_slot
+from problem.counters import set_first_accepted
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
+from submission.models import JudgeStatus, Submission
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from utils.shortcuts import rand_str
+
+# 判题时不会更新题目状态和排名的结果
+_IGNORED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING, JudgeStatus.SYSTEM_ERROR)
+# 任务结束后进度保留的时间
+JOB_TTL = 7 * 24 * 3600
+
+
+class RejudgeJobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    FINISHED = "finished"
+    CANCELLED = "cancelled"
+
+
+def _job_key(job_id):
+    return f"{CacheKey.rejudge_job}:{job_id}"
+
+
+def _queue_key(job_id):
+    return f"{CacheKey.rejudge_job}:{job_id}:queue"
+
+
+def _processing_key(job_id):
+    return f"{CacheKey.rejudge_job}:{job_id}:processing"
+
+
+def select_submissions(problem_id=None, contest_id=None, result=None, start_time=None, end_time=None):
+    submissions = Submission.objects.exclude(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING])
+    if problem_id:
+        submissions = submissions.filter(problem_id=problem_id)
+    if contest_id:
+        submissions = submissions.filter(contest_id=contest_id)
+    if result is not None:
+        submissions = submissions.filter(result=result)
+    if start_time:
+        submissions = submissions.filter(create_time__gte=start_time)
+    if end_time:
+        submissions = submissions.filter(create_time__lt=end_time)
+    return submissions
+
+
+def create_rejudge_job(created_by, **filters):
+    """
+    选出要重判的提交，id 按提交时间保存在 redis list 中，由 rejudge_task 分批取出
+    """
+    from judge.tasks import rejudge_task
+
+    rows = list(select_submissions(**filters).order_by("create_time").values_list("id", "contest_id"))
+    job_id = rand_str(16)
+    contests = sorted({contest_id for _, contest_id in rows if contest_id})
+    pipe = cache.pipeline()
+    for index in range(0, len(rows), 1000):
+        pipe.rpush(_queue_key(job_id), *[submission_id for submission_id, _ in rows[index:index + 1000]])
+    pipe.hset(_job_key(job_id), mapping={"id": job_id,
+                                         "status": RejudgeJobStatus.PENDING,
+                                         "total": len(rows),
+                                         "done": 0,
+                                         "failed": 0,
+                                         "filters": json.dumps(filters, default=str),
+                                         "contests": json.dumps(contests),
+                                         "created_by": created_by.username,
+                                         "create_time": time.time()})
+    pipe.zadd(CacheKey.rejudge_jobs, {job_id: time.time()})
+    pipe.execute()
+    rejudge_task.send(job_id)
+    return get_rejudge_job(job_id)
+
+
+def get_rejudge_job(job_id):
+    job = {k.decode("utf-8"): v.decode("utf-8") for k, v in cache.hgetall(_job_key(job_id)).items()}
+    if not job:
+        return None
+    for field in ("total", "done", "failed"):
+        job[field] = int(job[field])
+    for field in ("create_time", "start_time", "finish_time"):
+        job[field] = float(job[field]) if field in job else None
+    job["filters"] = json.loads(job["filters"])
+    job["contests"] = json.loads(job["contests"])
+    # 取消标记单独保存，不会和 rejudge_task 更新状态互相覆盖
+    if job.pop("cancelled", None):
+        job["status"] = RejudgeJobStatus.CANCELLED
+    job["throughput"] = 0
+    if job["start_time"]:
+        elapsed = (job["finish_time"] or time.time()) - job["start_time"]
+        job["throughput"] = round(job["done"] / elapsed, 2) if elapsed > 0 else 0
+    return job
+
+
+def list_rejudge_jobs(limit=20):
+    cache.zremrangebyscore(CacheKey.rejudge_jobs, "-inf", time.time() - JOB_TTL)
+    job_ids = [job_id.decode("utf-8") for job_id in cache.zrevrange(CacheKey.rejudge_jobs, 0, limit - 1)]
+    return [job for job in map(get_rejudge_job, job_ids) if job]
+
+
+def cancel_rejudge_job(job_id):
+    """
+    已经开始判题的一批不会中断，比赛排名在 rejudge_task 下一次执行时重建
+    """
+    pipe = cache.pipeline()
+    pipe.hset(_job_key(job_id), "cancelled", 1)
+    pipe.delete(_queue_key(job_id), _processing_key(job_id))
+    pipe.execute()
+
+
+def _finish(job_id, job):
+    for contest in Contest.objects.filter(id__in=job["contests"]):
+        rebuild_contest_rank(contest)
+    pipe = cache.pipeline()
+    pipe.hset(_job_key(job_id), mapping={"status": RejudgeJobStatus.FINISHED, "finish_time": time.time()})
+    pipe.expire(_job_key(job_id), JOB_TTL)
+    pipe.delete(_queue_key(job_id), _processing_key(job_id))
+    pipe.execute()
+
+
+def _recover_processing(job_id):
+    """
+    上一批处理中途出错或者 worker 退出时，取出的提交还在 processing 中，放回队列头部重新判题
+    同一个任务同时只有一个 rejudge_task 在执行
+    """
+    submission_ids = cache.lrange(_processing_key(job_id), 0, -1)
+    if submission_ids:
+        pipe = cache.pipeline()
+        pipe.lpush(_queue_key(job_id), *reversed(submission_ids))
+        pipe.delete(_processing_key(job_id))
+        pipe.execute()
+
+
+def run_rejudge_batch(job_id, judge):
+    """
+    重判一批提交，每批最多占用 REJUDGE_BATCH_SIZE 个判题槽位，等待队列中有正常提交时让出判题服务器
+    :param judge: 接收 judge_concurrent_task 格式的任务列表，返回失败的数量
+    :return: 再次执行前等待的秒数，None 表示任务已经结束
+    """
+    job = get_rejudge_job(job_id)
+    if not job or job["finish_time"]:
+        return None
+    if job["status"] == RejudgeJobStatus.CANCELLED:
+        _finish(job_id, job)
+        return None
+    _recover_processing(job_id)
+    if cache.llen(CacheKey.waiting_queue):
+        return settings.REJUDGE_BACKOFF
+
+    slots = []
+    while len(slots) < settings.REJUDGE_BATCH_SIZE:
+        slot = acquire_slot()
+        if not slot:
+            break
+        slots.append(slot)
+    if not slots:
+        return settings.REJUDGE_BACKOFF
+
+    try:
+        # 取出的提交先放入 processing，这一批完成后才删除
+        pipe = cache.pipeline()
+        pipe.lrange(_queue_key(job_id), 0, len(slots) - 1)
+        pipe.ltrim(_queue_key(job_id), len(slots), -1)
+        submission_ids = pipe.execute()[0]
+        if not submission_ids:
+            _finish(job_id, job)
+            return None
+        pipe = cache.pipeline()
+        pipe.rpush(_processing_key(job_id), *submission_ids)
+        pipe.hset(_job_key(job_id), "status", RejudgeJobStatus.RUNNING)
+        pipe.hsetnx(_job_key(job_id), "start_time", time.time())
+        pipe.execute()
+
+        submission_ids = [submission_id.decode("utf-8") for submission_id in submission_ids]
+        submissions = list(Submission.objects.filter(id__in=submission_ids)
+                           .values_list("id", "problem_id", "contest_id", "user_id"))
+        Submission.objects.filter(id__in=submission_ids).update(statistic_info={})
+        tasks = [{"submission_id": submission_id, "problem_id": problem_id, "slot": list(slot)}
+                 for (submission_id, problem_id, _, _), slot in zip(submissions, slots)]
+        failed = judge(tasks) if tasks else 0
+        rebuild_user_problem_status({(user_id, problem_id, contest_id)
+                                     for _, problem_id, contest_id, user_id in submissions})
+        # 重判期间比赛排名也逐批更新，任务结束时再整体重建一次，修正其他用户的一血标记
+        contest_users = {}
+        for _, _, contest_id, user_id in submissions:
+            if contest_id:
+                contest_users.setdefault(contest_id, set()).add(user_id)
+        for contest in Contest.objects.filter(id__in=contest_users):
+            rebuild_contest_rank(contest, contest_users[contest.id])
+
+        pipe = cache.pipeline()
+        pipe.hincrby(_job_key(job_id), "done", len(submission_ids))
+        pipe.hincrby(_job_key(job_id), "failed", failed)
+        pipe.delete(_processing_key(job_id))
+        pipe.execute()
+        return 0
+    finally:
+        # 判题结束后槽位已经释放，这里释放没有用到的以及出错时没有释放的槽位
+        for slot in slots:
+            release_slot(slot)
+
+
+def rebuild_user_problem_status(pairs):
+    """
+    根据重判后的结果重新计算用户的题目状态，规则与判题时的增量更新一致：
+    OI 比赛中为最后一次提交的结果和分数，其他情况有过 AC 的题目为 AC，否则为最后一次提交的结果
+    比赛题目只计入比赛进行期间的提交，非比赛题目同时修正 UserProfile 中的通过数和总分
+    :param pairs: {(user_id, problem_id, contest_id)}
+    """
+    problems = get_judge_problems({problem_id for _, problem_id, _ in pairs})
+    contests = Contest.objects.in_bulk({contest_id for _, _, contest_id in pairs if contest_id})
+    for user_id, problem_id, contest_id in pairs:
+        submissions = Submission.objects.filter(user_id=user_id, problem_id=problem_id)
+        contest = contests.get(contest_id)
+        if contest:
+            submissions = submissions.filter(create_time__gte=contest.start_time, create_time__lt=contest.end_time)
+        results = list(submissions.exclude(result__in=_IGNORED_RESULTS)
+                       .order_by("create_time").values_list("result", "statistic_info"))
+        if not results:
+            continue
+        accepted = [item for item in results if item[0] == JudgeStatus.ACCEPTED]
+        if accepted and not (contest and contest.rule_type == ContestRuleType.OI):
+            result, statistic_info = accepted[0]
+        else:
+            result, statistic_info = results[-1]
+        score = statistic_info.get("score", 0)
+
+        with transaction.atomic():
+            status = UserProblemStatus.objects.select_for_update().filter(user_id=user_id,
+                                                                          problem_id=problem_id).first()
+            if status:
+                last_status, last_score = status.status, status.score
+                status.status, status.score = result, score
+                status.save(update_fields=["status", "score"])
+            elif contest_id:
+                # 比赛中没有状态说明提交时不计入排名
+                continue
+            else:
+                last_status, last_score = None, 0
+                UserProblemStatus.objects.create(user_id=user_id, problem_id=problem_id, status=result, score=score)
+            if contest_id:
+                continue
+            profile_update = {}
+            accepted_number = int(result == JudgeStatus.ACCEPTED) - int(last_status == JudgeStatus.ACCEPTED)
+            if accepted_number:
+                profile_update["accepted_number"] = F("accepted_number") + accepted_number
+            problem = problems.get(problem_id)
+            if problem and problem.rule_type == ProblemRuleType.OI and score != last_score:
+                profile_update["total_score"] = F("total_score") - last_score + score
+            if profile_update:
+                UserProfile.objects.filter(user_id=user_id).update(**profile_update)
+
+
+def rebuild_contest_rank(contest, user_ids=None):
+    """
+    按提交时间重放比赛进行期间的提交，重新生成比赛排名，逻辑与 JudgeDispatcher 中的增量更新一致
+    管理员在 ACM 排名中设置的 checked 标记保留
+    :param user_ids: 只重建这些用户的排名，每一批重判之后调用，为 None 时重建整个比赛
+    """
+    is_acm = contest.rule_type == ContestRuleType.ACM
+    model = ACMContestRank if is_acm else OIContestRank
+    submissions = Submission.objects.filter(contest=contest, create_time__gte=contest.start_time,
+                                            create_time__lt=contest.end_time) \
+        .exclude(result__in=_IGNORED_RESULTS).order_by("create_time")
+    # 比赛管理员的提交不计入排名
+    admins = set(User.objects.filter(Q(id=contest.created_by_id) | Q(admin_type=AdminType.SUPER_ADMIN),
+                                     id__in=submissions.values("user_id")).values_list("id", flat=True))
+    # 一血由整个比赛中最早的 AC 决定，只重建部分用户时也要看其他用户的提交
+    first_accepted = {}
+    if is_acm:
+        for user_id, problem_id in submissions.filter(result=JudgeStatus.ACCEPTED).values_list("user_id", "problem_id"):
+            if user_id not in admins:
+                first_accepted.setdefault(problem_id, user_id)
+    if user_ids is not None:
+        submissions = submissions.filter(user_id__in=user_ids)
+    rows = submissions.values_list("user_id", "problem_id", "result", "statistic_info", "create_time")
+
+    ranks = {}
+    for user_id, problem_id, result, statistic_info, create_time in rows:
+        if user_id in admins:
+            continue
+        rank = ranks.get(user_id)
+        if rank is None:
+            rank = ranks[user_id] = model(user_id=user_id, contest=contest, submission_info={})
+        key = str(problem_id)
+        if is_acm:
+            info = rank.submission_info.setdefault(key, {"is_ac": False, "ac_time": 0, "error_number": 0,
+                                                         "is_first_ac": False})
+            if info["is_ac"]:
+                continue
+            rank.submission_number += 1
+            if result == JudgeStatus.ACCEPTED:
+                rank.accepted_number += 1
+                info["is_ac"] = True
+                info["ac_time"] = (create_time - contest.start_time).total_seconds()
+                rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
+                info["is_first_ac"] = first_accepted.get(problem_id) == user_id
+            elif result != JudgeStatus.COMPILE_ERROR:
+                info["error_number"] += 1
+        else:
+            score = statistic_info.get("score", 0)
+            rank.total_score = rank.total_score - rank.submission_info.get(key, 0) + score
+            rank.submission_info[key] = score
+
+    with transaction.atomic():
+        old_ranks = model.objects.select_for_update().filter(contest=contest)
+        if user_ids is not None:
+            old_ranks = old_ranks.filter(user_id__in=user_ids)
+        if is_acm:
+            for user_id, submission_info in old_ranks.values_list("user_id", "submission_info"):
+                rank = ranks.get(user_id)
+                if rank is None:
+                    continue
+                for key, info in submission_info.items():
+                    if info.get("checked") and key in rank.submission_info:
+                        rank.submission_info[key]["checked"] = True
+        old_ranks.delete()
+        model.objects.bulk_create(ranks.values())
+    if is_acm:
+        set_first_accepted(Problem.objects.filter(contest=contest).values_list("id", flat=True),
+                           set(first_accepted))
+    ContestScoreboard(contest).invalidate()
+    ContestRankSnapshot(contest).invalidate()
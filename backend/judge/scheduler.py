@@ -0,0 +1,116 @@
+import json
+import time
+from collections import namedtuple
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+
+# 判题任务占用的槽位租约时长，worker 异常退出后槽位最多被占用这么久
+LEASE_TTL = 600
+# 与 JudgeServer.status 保持一致，超过该时间没有心跳的判题服务器视为异常
+HEARTBEAT_TIMEOUT = 6
+# 请求判题服务器失败后，在这段时间内不再向其分配任务
+UNHEALTHY_TIMEOUT = 30
+
+JudgeServerSlot = namedtuple("JudgeServerSlot", ["hostname", "service_url", "token"])
+
+# KEYS: 每个候选判题服务器的租约 sorted set, member 为租约 token, score 为过期时间
+# ARGV: now, expire_at, token, capacity_1, capacity_2, ...
+# 先清理过期租约，再选择空闲槽位最多的服务器写入租约，返回其下标(从 1 开始)，没有空闲槽位返回 0
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local chosen = 0
+local max_free = 0
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+    local free = tonumber(ARGV[i + 3]) - redis.call("ZCARD", key)
+    if free > max_free then
+        max_free = free
+        chosen = i
+    end
+end
+if chosen > 0 then
+    redis.call("ZADD", KEYS[chosen], ARGV[2], ARGV[3])
+end
+return chosen
+"""
+
+_acquire_script = None
+
+
+def _lease_key(hostname):
+    return f"{CacheKey.judge_server_lease}:{hostname}"
+
+
+def _get_acquire_script():
+    global _acquire_script
+    if _acquire_script is None:
+        _acquire_script = cache.register_script(_ACQUIRE_SCRIPT)
+    return _acquire_script
+
+
+def register_judge_server(server):
+    """
+    由心跳和管理接口调用，把判题服务器的调度信息同步到 redis，判题时不再访问 JudgeServer 表
+    """
+    data = {"hostname": server.hostname,
+            "service_url": server.service_url,
+            "capacity": server.cpu_core * 2,
+            "is_disabled": server.is_disabled,
+            "last_heartbeat": server.last_heartbeat.timestamp()}
+    cache.hset(CacheKey.judge_server_registry, server.hostname, json.dumps(data))
+
+
+def unregister_judge_server(hostname):
+    cache.hdel(CacheKey.judge_server_registry, hostname)
+    cache.hdel(CacheKey.judge_server_unhealthy, hostname)
+    cache.delete(_lease_key(hostname))
+
+
+def mark_server_unhealthy(hostname):
+    cache.hset(CacheKey.judge_server_unhealthy, hostname, time.time() + UNHEALTHY_TIMEOUT)
+
+
+def get_available_servers():
+    now = time.time()
+    pipe = cache.pipeline()
+    pipe.hvals(CacheKey.judge_server_registry)
+    pipe.hgetall(CacheKey.judge_server_unhealthy)
+    registry, unhealthy = pipe.execute()
+    servers = []
+    for item in registry:
+        server = json.loads(item.decode("utf-8"))
+        if server["is_disabled"] or now - server["last_heartbeat"] > HEARTBEAT_TIMEOUT:
+            continue
+        if float(unhealthy.get(server["hostname"].encode("utf-8"), 0)) > now:
+            continue
+        servers.append(server)
+    return servers
+
+
+def acquire_slot():
+    servers = get_available_servers()
+    if not servers:
+        return None
+    token = rand_str()
+    now = time.time()
+    index = _get_acquire_script()(keys=[_lease_key(s["hostname"]) for s in servers],
+                                  args=[now, now + LEASE_TTL, token] + [s["capacity"] for s in servers])
+    if not index:
+        return None
+    server = servers[index - 1]
+    return JudgeServerSlot(hostname=server["hostname"], service_url=server["service_url"], token=token)
+
+
+def release_slot(slot):
+    """
+    :return: 槽位是否还在租用中，重复释放时返回 False
+    """
+    return bool(cache.zrem(_lease_key(slot.hostname), slot.token))
+
+
+def get_task_number(hostname):
+    key = _lease_key(hostname)
+    cache.zremrangebyscore(key, "-inf", time.time())
+    return cache.zcard(key)
@@ -1,14 +1,113 @@
+import asyncio
+import logging
+
 import dramatiq
+from django.conf import settings
 
-from account.models import User
-from submission.models import Submission
-from judge.dispatcher import JudgeDispatcher
+from judge.cache import get_judge_problems, get_judge_submissions
+from judge.client import create_async_client
+from judge.dispatcher import JudgeDispatcher, db_sync_to_async, process_pending_task
+from judge.rejudge import run_rejudge_batch
+from judge.scheduler import JudgeServerSlot, release_slot
 from utils.shortcuts import DRAMATIQ_WORKER_ARGS
 
+logger = logging.getLogger(__name__)
+
+
+def _release_slots(slots):
+    """
+    判题结束时 ChooseJudgeServer 已经释放了槽位，这里只释放没有走到判题或者中途出错的任务的槽位
+    """
+    released = False
+    for slot in slots:
+        if slot and release_slot(slot):
+            released = True
+    if released:
+        process_pending_task()
+
+
+def _get_dispatcher(submission_id, problem_id):
+    submission = get_judge_submissions().get(id=submission_id)
+    if submission.user_is_disabled:
+        return None
+    return JudgeDispatcher(submission_id, problem_id, submission=submission)
+
 
 @dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
-def judge_task(submission_id, problem_id):
-    uid = Submission.objects.get(id=submission_id).user_id
-    if User.objects.get(id=uid).is_disabled:
-        return
-    JudgeDispatcher(submission_id, problem_id).judge()
+def judge_task(submission_id, problem_id, slot=None):
+    # slot 是从等待队列中取出任务时预先租用的判题槽位
+    slot = JudgeServerSlot(*slot) if slot else None
+    try:
+        dispatcher = _get_dispatcher(submission_id, problem_id)
+        if dispatcher:
+            dispatcher.judge(slot)
+    finally:
+        _release_slots([slot])
+
+
+def _get_dispatchers(tasks, rejudge=False):
+    """
+    一次性查出这批任务涉及的提交和提交者，题目从缓存中读取，同一题目的提交共享题目对象和判题参数
+    """
+    submissions = get_judge_submissions().in_bulk([task["submission_id"] for task in tasks])
+    problems = get_judge_problems([task["problem_id"] for task in tasks])
+    problem_data = {}
+    dispatchers = []
+    for task in tasks:
+        slot = JudgeServerSlot(*task["slot"]) if task.get("slot") else None
+        submission = submissions.get(task["submission_id"])
+        problem = problems.get(task["problem_id"])
+        if not submission or not problem or problem.contest_id != submission.contest_id or \
+                submission.user_is_disabled:
+            continue
+        if problem.id not in problem_data:
+            problem_data[problem.id] = JudgeDispatcher.build_problem_data(problem)
+        dispatcher = JudgeDispatcher(submission.id, problem.id, submission=submission, problem=problem,
+                                     problem_data=problem_data[problem.id], rejudge=rejudge)
+        dispatchers.append((dispatcher, slot))
+    return dispatchers
+
+
+async def _judge_concurrently(tasks, rejudge=False):
+    """
+    :return: 判题失败的提交数
+    """
+    try:
+        dispatchers = await db_sync_to_async(_get_dispatchers)(tasks, rejudge)
+        async with create_async_client() as client:
+            results = await asyncio.gather(*[dispatcher.judge_async(client, slot)
+                                             for dispatcher, slot in dispatchers],
+                                           return_exceptions=True)
+    finally:
+        await db_sync_to_async(_release_slots)([JudgeServerSlot(*task["slot"]) for task in tasks if task.get("slot")])
+    failed = 0
+    for (dispatcher, _), result in zip(dispatchers, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error(f"Failed to judge submission {dispatcher.submission.id}: {result}")
+    return failed
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def judge_concurrent_task(tasks):
+    """
+    并发判题，在一个 worker 线程中同时保持多个判题请求
+    判题服务器没有批量接口，每个提交仍然单独发送一次完整的 /judge 请求，
+    共享的只是连接池和同一题目的判题参数，每次请求本身的开销不变
+    :param tasks: [{"submission_id": "", "problem_id": 1, "slot": [...]}], slot 可以省略
+    """
+    asyncio.run(_judge_concurrently(tasks))
+
+
+@dramatiq.actor(queue_name="rejudge", priority=100, **DRAMATIQ_WORKER_ARGS())
+def rejudge_task(job_id):
+    """
+    批量重判，每次处理一批后重新发送自己，使用单独的队列，可以只分配少量 worker
+    """
+    # 出错时也要继续执行，没有完成的提交在下一次执行时从 processing 中恢复
+    delay = settings.REJUDGE_BACKOFF
+    try:
+        delay = run_rejudge_batch(job_id, lambda tasks: asyncio.run(_judge_concurrently(tasks, rejudge=True)))
+    finally:
+        if delay is not None:
+            rejudge_task.send_with_options(args=(job_id,), delay=delay * 1000)
@@ -0,0 +1,17 @@
+"""
+ASGI config for qduoj project.
+
+Serves the server-sent events stream (utils.events) and hands every other request to django.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+
+django_application = get_asgi_application()
+
+from utils.events import EventStreamApplication  # noqa: E402
+
+application = EventStreamApplication(django_application)
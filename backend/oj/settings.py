@@ -126,6 +126,10 @@ STATIC_URL = '/public/'
 AUTH_USER_MODEL = 'account.User'
 
 TEST_CASE_DIR = os.path.join(DATA_DIR, "test_case")
+# 上传后等待异步处理的测试用例压缩包
+TEST_CASE_UPLOAD_DIR = os.path.join(DATA_DIR, "test_case_upload")
+# 下载测试用例的压缩包缓存，不放在 TEST_CASE_DIR 中，不会同步到判题服务器
+TEST_CASE_ARCHIVE_DIR = os.path.join(DATA_DIR, "test_case_archive")
 LOG_PATH = os.path.join(DATA_DIR, "log")
 
 AVATAR_URI_PREFIX = "/public/avatar"
@@ -245,4 +249,40 @@ RAVEN_CONFIG = {
 
 IP_HEADER = "HTTP_X_REAL_IP"
 
+# 请求判题服务器的超时时间(秒)和连接失败时的重试次数
+JUDGE_SERVER_CONNECT_TIMEOUT = float(get_env("JUDGE_SERVER_CONNECT_TIMEOUT", "3"))
+JUDGE_SERVER_READ_TIMEOUT = float(get_env("JUDGE_SERVER_READ_TIMEOUT", "300"))
+JUDGE_SERVER_MAX_RETRIES = int(get_env("JUDGE_SERVER_MAX_RETRIES", "2"))
+JUDGE_SERVER_POOL_SIZE = int(get_env("JUDGE_SERVER_POOL_SIZE", "16"))
+
+# 非实时排名的比赛快照刷新间隔(秒)，0 表示只在第一次访问时生成快照，即封榜
+CONTEST_RANK_SNAPSHOT_INTERVAL = int(get_env("CONTEST_RANK_SNAPSHOT_INTERVAL", "0"))
+
+# 题目提交数、通过数等计数器先在 redis 中累加，每隔这么多秒写回数据库
+PROBLEM_COUNTER_FLUSH_INTERVAL = int(get_env("PROBLEM_COUNTER_FLUSH_INTERVAL", "10"))
+
+# 提交的代码和判题详情按内容保存在 blob store 中，filesystem 或 s3
+BLOB_STORE = get_env("BLOB_STORE", "filesystem")
+BLOB_STORE_DIR = os.path.join(DATA_DIR, "blob")
+BLOB_STORE_COMPRESS_LEVEL = 6
+BLOB_STORE_S3_BUCKET = get_env("BLOB_STORE_S3_BUCKET", "")
+BLOB_STORE_S3_PREFIX = get_env("BLOB_STORE_S3_PREFIX", "")
+BLOB_STORE_S3_ENDPOINT_URL = get_env("BLOB_STORE_S3_ENDPOINT_URL", "")
+BLOB_STORE_S3_ACCESS_KEY = get_env("BLOB_STORE_S3_ACCESS_KEY", "")
+BLOB_STORE_S3_SECRET_KEY = get_env("BLOB_STORE_S3_SECRET_KEY", "")
+
+# 上传测试用例时同时解压的文件数
+TEST_CASE_INGEST_WORKERS = int(get_env("TEST_CASE_INGEST_WORKERS", "4"))
+# 导出题目和下载测试用例时同时压缩的文件数
+ZIP_STREAM_WORKERS = int(get_env("ZIP_STREAM_WORKERS", "4"))
+
+# 批量重判每批最多占用的判题槽位数，以及判题服务器繁忙或有正常提交排队时等待的秒数
+REJUDGE_BATCH_SIZE = int(get_env("REJUDGE_BATCH_SIZE", "8"))
+REJUDGE_BACKOFF = int(get_env("REJUDGE_BACKOFF", "5"))
+
+# submission 按月分区，提前创建之后几个月的分区，早于 SUBMISSION_ARCHIVE_AFTER_MONTHS 个月的分区归档到压缩文件
+SUBMISSION_PARTITION_MONTHS_AHEAD = int(get_env("SUBMISSION_PARTITION_MONTHS_AHEAD", "3"))
+SUBMISSION_ARCHIVE_AFTER_MONTHS = int(get_env("SUBMISSION_ARCHIVE_AFTER_MONTHS", "24"))
+SUBMISSION_ARCHIVE_DIR = os.path.join(DATA_DIR, "archive", "submission")
+
 DEFAULT_AUTO_FIELD='django.db.models.AutoField'
\ No newline at end of file
@@ -3,89 +3,140 @@ import os
 import threading
 import time
 
-from django.db import transaction, IntegrityError
+from django.db import connection, transaction, IntegrityError
 
+from utils.cache import cache
+from utils.constants import CacheKey
 from utils.shortcuts import rand_str
-from judge.languages import languages
+from judge.languages import LanguageRegistry, languages
 from .models import SysOptions as SysOptionsModel
 
 
+class OptionsCache:
+    """
+    进程内所有线程共享的配置缓存，读取只是一次字典查找
+    返回的是缓存的对象本身，调用方需要修改时自己复制一份，例如 SMTPAPI
+    修改配置后增加 redis 中的版本号并通过 pub/sub 通知所有进程清空缓存
+    订阅线程断开期间，读取时最多每 VERSION_CHECK_INTERVAL 秒检查一次版本号
+    """
+    VERSION_CHECK_INTERVAL = 5
+
+    def __init__(self):
+        self.values = {}
+        self.version = None
+        self.checked_at = 0
+        # 每次清空缓存加一，读取数据库期间缓存被清空时不保存读到的旧值
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.listener_pid = None
+        self.listener_alive = False
+
+    def clear(self, version=None):
+        with self.lock:
+            self.generation += 1
+            self.values = {}
+            self.version = version
+
+    def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = cache.pubsub()
+                pubsub.subscribe(CacheKey.options_channel)
+                # 断开期间可能错过了通知
+                self.clear()
+                self.listener_alive = True
+                while True:
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=60)
+                    if message:
+                        self.clear(int(message["data"]))
+            except Exception:
+                self.listener_alive = False
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _start_listener(self):
+        # gunicorn fork 之后需要在子进程中重新启动订阅线程
+        pid = os.getpid()
+        if self.listener_pid == pid:
+            return
+        with self.lock:
+            if self.listener_pid == pid:
+                return
+            self.listener_pid = pid
+            self.listener_alive = False
+            threading.Thread(target=self._listen, name="options-cache-listener", daemon=True).start()
+
+    def _check_version(self):
+        now = time.monotonic()
+        if self.listener_alive and now - self.checked_at < self.VERSION_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        version = int(cache.get(CacheKey.options_version) or 0)
+        if version != self.version:
+            self.clear(version)
+
+    def get(self, name, func):
+        # 事务中可能读到还没有提交的修改，不使用缓存
+        if connection.in_atomic_block:
+            return func()
+        self._start_listener()
+        self._check_version()
+        values = self.values
+        if name in values:
+            return values[name]
+        generation = self.generation
+        value = func()
+        with self.lock:
+            if generation == self.generation:
+                self.values[name] = value
+        return value
+
+    def invalidate(self):
+        """
+        修改配置后调用，提交事务后通知所有进程
+        """
+        self.clear()
+
+        def publish():
+            version = cache.redis_incr(CacheKey.options_version)
+            cache.publish(CacheKey.options_channel, version)
+
+        transaction.on_commit(publish)
+
+
+options_cache = OptionsCache()
+
+
 class my_property:
     """
-    在 metaclass 中使用，以实现：
-    1. ttl = None，不缓存
-    2. ttl is callable，条件缓存
-    3. 缓存 ttl 秒
+    在 metaclass 中使用，读取的结果保存在 options_cache 中，直到配置被修改
     """
-    def __init__(self, func=None, fset=None, ttl=None):
+    def __init__(self, func=None, fset=None):
         self.fset = fset
-        self.local = threading.local()
-        self.ttl = ttl
-        self._check_ttl(ttl)
         self.func = func
-        functools.update_wrapper(self, func)
-
-    def _check_ttl(self, value):
-        if value is None or callable(value):
-            return
-        return self._check_timeout(value)
-
-    def _check_timeout(self, value):
-        if not isinstance(value, int):
-            raise ValueError(f"Invalid timeout type: {type(value)}")
-        if value < 0:
-            raise ValueError("Invalid timeout value, it must >= 0")
+        if func is not None:
+            functools.update_wrapper(self, func)
 
     def __get__(self, obj, cls):
         if obj is None:
             return self
-
-        now = time.time()
-        if self.ttl:
-            if hasattr(self.local, "value"):
-                value, expire_at = self.local.value
-                if now < expire_at:
-                    return value
-
-            value = self.func(obj)
-
-            # 如果定义了条件缓存, ttl 是一个函数，返回要缓存多久；返回 0 代表不要缓存
-            if callable(self.ttl):
-                # 而且条件缓存说不要缓存，那就直接返回，不要设置 local
-                timeout = self.ttl(value)
-                self._check_timeout(timeout)
-
-                if timeout == 0:
-                    return value
-                elif timeout > 0:
-                    self.local.value = (value, now + timeout)
-            else:
-                # ttl 是一个数字
-                self.local.value = (value, now + self.ttl)
-            return value
-        else:
-            return self.func(obj)
+        return options_cache.get(self.func.__name__, lambda: self.func(obj))
 
     def __set__(self, obj, value):
         if not self.fset:
             raise AttributeError("can't set attribute")
         self.fset(obj, value)
-        if hasattr(self.local, "value"):
-            del self.local.value
 
     def setter(self, func):
         self.fset = func
         return self
 
-    def __call__(self, func, *args, **kwargs) -> "my_property":
-        if self.func is None:
-            self.func = func
-            functools.update_wrapper(self, func)
-        return self
-
-
-DEFAULT_SHORT_TTL = 2
-
 
 def default_token():
     token = os.environ.get("JUDGE_SERVER_TOKEN")
@@ -114,8 +165,10 @@ class OptionDefaultValue:
     submission_list_show_all = True
     smtp_config = {}
     judge_server_token = default_token
-    throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
-                  "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10}}
+    # 机房中的用户共用一个出口 ip，ip 的限制默认关闭
+    throttling = {"ip": {"enabled": False, "capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
+                  "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10},
+                  "contest": {"capacity": 10, "fill_rate": 0.05, "default_capacity": 10}}
     languages = languages
 
 
@@ -153,6 +206,7 @@ class _SysOptionsMeta(type):
                 option = SysOptionsModel.objects.select_for_update().get(key=option_key)
                 option.value = option_value
                 option.save()
+            options_cache.invalidate()
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             mcs._set_option(option_key, option_value)
@@ -165,6 +219,7 @@ class _SysOptionsMeta(type):
                 value = option.value + 1
                 option.value = value
                 option.save()
+            options_cache.invalidate()
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             return mcs._increment(option_key)
@@ -181,7 +236,7 @@ class _SysOptionsMeta(type):
             result[key] = mcs._get_option(key)
         return result
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_base_url(cls):
         return cls._get_option(OptionKeys.website_base_url)
 
@@ -189,7 +244,7 @@ class _SysOptionsMeta(type):
     def website_base_url(cls, value):
         cls._set_option(OptionKeys.website_base_url, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name(cls):
         return cls._get_option(OptionKeys.website_name)
 
@@ -197,7 +252,7 @@ class _SysOptionsMeta(type):
     def website_name(cls, value):
         cls._set_option(OptionKeys.website_name, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name_shortcut(cls):
         return cls._get_option(OptionKeys.website_name_shortcut)
 
@@ -205,7 +260,7 @@ class _SysOptionsMeta(type):
     def website_name_shortcut(cls, value):
         cls._set_option(OptionKeys.website_name_shortcut, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_footer(cls):
         return cls._get_option(OptionKeys.website_footer)
 
@@ -221,7 +276,7 @@ class _SysOptionsMeta(type):
     def allow_register(cls, value):
         cls._set_option(OptionKeys.allow_register, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def submission_list_show_all(cls):
         return cls._get_option(OptionKeys.submission_list_show_all)
 
@@ -253,25 +308,31 @@ class _SysOptionsMeta(type):
     def throttling(cls, value):
         cls._set_option(OptionKeys.throttling, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def languages(cls):
         return cls._get_option(OptionKeys.languages)
 
     @languages.setter
     def languages(cls, value):
+        # 保存之前检查配置
+        LanguageRegistry(value)
         cls._set_option(OptionKeys.languages, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
+    def language_registry(cls):
+        return LanguageRegistry(cls.languages)
+
+    @my_property
     def spj_languages(cls):
-        return [item for item in cls.languages if "spj" in item]
+        return list(cls.language_registry.spj_languages.values())
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def language_names(cls):
-        return [item["name"] for item in cls.languages]
+        return cls.language_registry.language_names
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def spj_language_names(cls):
-        return [item["name"] for item in cls.languages if "spj" in item]
+        return cls.language_registry.spj_language_names
 
     def reset_languages(cls):
         cls.languages = languages
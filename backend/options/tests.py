@@ -1 +1,61 @@
-# Create your tests here.
+from unittest import mock
+
+from judge.languages import LanguageRegistry, languages
+from problem.models import ProblemIOMode
+from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
+
+from .options import OptionsCache, SysOptions
+
+
+@mock.patch.object(OptionsCache, "_start_listener")
+class OptionsCacheTest(APITestCase):
+    def setUp(self):
+        self.options_cache = OptionsCache()
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.loads
+
+    @mock.patch("options.options.connection")
+    def test_cache_until_version_changes(self, connection, _):
+        connection.in_atomic_block = False
+        self.assertEqual(self.options_cache.get("website_name", self.load), 1)
+        self.assertEqual(self.options_cache.get("website_name", self.load), 1)
+        cache.redis_incr(CacheKey.options_version)
+        # 订阅线程不可用时通过版本号失效
+        self.assertEqual(self.options_cache.get("website_name", self.load), 2)
+
+    @mock.patch("options.options.connection")
+    def test_cached_value_shared(self, connection, _):
+        connection.in_atomic_block = False
+        value = self.options_cache.get("smtp_config", lambda: {"password": "test"})
+        self.assertIs(self.options_cache.get("smtp_config", self.load), value)
+
+    def test_no_cache_in_transaction(self, _):
+        self.options_cache.get("website_name", self.load)
+        self.assertEqual(self.options_cache.get("website_name", self.load), 2)
+
+    def test_set_option(self, _):
+        version = int(cache.get(CacheKey.options_version) or 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            SysOptions.website_name = "test"
+        self.assertEqual(SysOptions.website_name, "test")
+        self.assertEqual(int(cache.get(CacheKey.options_version)), version + 1)
+
+
+class LanguageRegistryTest(APITestCase):
+    def test_build(self):
+        registry = LanguageRegistry(languages)
+        self.assertEqual(registry.language_names, [item["name"] for item in languages])
+        self.assertEqual(registry.spj_language_names, ["C", "C++"])
+        self.assertEqual(registry.get_judge_config("C", ProblemIOMode.file)["run"]["seccomp_rule"], "c_cpp_file_io")
+        self.assertEqual(registry.get_judge_config("Python3", ProblemIOMode.standard)["run"]["seccomp_rule"], "general")
+
+    def test_invalid_languages(self):
+        with self.assertRaises(ValueError):
+            LanguageRegistry(languages + [languages[0]])
+        with self.assertRaises(ValueError):
+            SysOptions.languages = [{"name": "C", "config": {}}]
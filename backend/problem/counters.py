@@ -0,0 +1,186 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+from .models import Problem
+
+# 把计数器移动到 flushing key 中，每一批带一个 token，写回数据库时和 token 一起提交
+# 上次写回留下的 flushing key 原样返回，不合并新的增量，否则已经提交过的一批会因为 token 相同被跳过
+_TAKE_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 0 then
+    if redis.call("EXISTS", KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call("RENAME", KEYS[1], KEYS[2])
+    redis.call("HSET", KEYS[2], "token", ARGV[1])
+end
+return redis.call("HGETALL", KEYS[2])
+"""
+_TOKEN_FIELD = b"token"
+# 比赛中是否已经有人通过该题的标记的保存时间
+FIRST_ACCEPTED_TTL = 30 * 24 * 3600
+
+_take_script = None
+
+
+def _counter_key(problem_id):
+    return f"{CacheKey.problem_counter}:{problem_id}"
+
+
+def _flushing_key(problem_id):
+    return f"{CacheKey.problem_counter}:{problem_id}:flushing"
+
+
+def _get_take_script():
+    global _take_script
+    if _take_script is None:
+        _take_script = cache.register_script(_TAKE_SCRIPT)
+    return _take_script
+
+
+def _parse_counters(values):
+    """
+    :return: {"submission_number": 1, "accepted_number": 0, "statistic_info": {"-1": 1}}
+    """
+    ret = {"submission_number": 0, "accepted_number": 0, "statistic_info": defaultdict(int)}
+    for field, value in values.items():
+        if field == _TOKEN_FIELD:
+            continue
+        field = field.decode("utf-8")
+        if field.startswith("result:"):
+            ret["statistic_info"][field[len("result:"):]] += int(value)
+        else:
+            ret[field] += int(value)
+    return ret
+
+
+def add_problem_counters(problem_id, submission_number=0, accepted_number=0, results=None):
+    """
+    判题结果只在 redis 中累加，不再锁定 problem 行，由 flush_problem_counters 定期写回数据库
+    :param results: {JudgeStatus: 增量}
+    """
+    interval = settings.PROBLEM_COUNTER_FLUSH_INTERVAL
+    key = _counter_key(problem_id)
+    pipe = cache.pipeline()
+    if submission_number:
+        pipe.hincrby(key, "submission_number", submission_number)
+    if accepted_number:
+        pipe.hincrby(key, "accepted_number", accepted_number)
+    for result, count in (results or {}).items():
+        pipe.hincrby(key, f"result:{result}", count)
+    pipe.sadd(CacheKey.problem_counter_dirty, problem_id)
+    # 没有待执行的写回任务时才发送，过期时间防止任务丢失后不再写回
+    pipe.set(CacheKey.problem_counter_flush_scheduled, 1, nx=True, ex=max(interval * 6, 60))
+    if pipe.execute()[-1]:
+        from .tasks import flush_problem_counters
+        flush_problem_counters.send_with_options(delay=interval * 1000)
+
+
+def get_problem_counters(problem_ids):
+    """
+    返回还没有写回数据库的增量，包括正在写回的部分
+    :return: {problem_id: {"submission_number": 1, "accepted_number": 0, "statistic_info": {"-1": 1}}}
+    """
+    if not problem_ids:
+        return {}
+    pipe = cache.pipeline()
+    for problem_id in problem_ids:
+        pipe.hgetall(_counter_key(problem_id))
+        pipe.hgetall(_flushing_key(problem_id))
+    values = pipe.execute()
+    ret = {}
+    for index, problem_id in enumerate(problem_ids):
+        merged = values[index * 2]
+        for field, value in values[index * 2 + 1].items():
+            if field != _TOKEN_FIELD:
+                merged[field] = int(merged.get(field, 0)) + int(value)
+        if merged:
+            ret[problem_id] = _parse_counters(merged)
+    return ret
+
+
+def merge_problem_counters(data, counters):
+    """
+    把增量合并到序列化后的题目数据中
+    """
+    if not counters:
+        return data
+    data["submission_number"] += counters["submission_number"]
+    data["accepted_number"] += counters["accepted_number"]
+    statistic_info = dict(data["statistic_info"])
+    for result, count in counters["statistic_info"].items():
+        statistic_info[result] = max(statistic_info.get(result, 0) + count, 0)
+    data["statistic_info"] = statistic_info
+    return data
+
+
+def _flush_problem(problem_id):
+    # 第一次写回上次中途退出时留下的一批，第二次写回新的增量
+    for _ in range(2):
+        values = _get_take_script()(keys=[_counter_key(problem_id), _flushing_key(problem_id)], args=[rand_str()])
+        if not values:
+            return
+        values = dict(zip(values[::2], values[1::2]))
+        token = values[_TOKEN_FIELD].decode("utf-8")
+        counters = _parse_counters(values)
+        with transaction.atomic():
+            problem = Problem.objects.select_for_update().filter(id=problem_id).first()
+            # 题目可能已经被删除，token 相同说明这一批已经提交，只是没有删除 flushing key
+            if problem and problem.counter_flush_token != token:
+                problem.submission_number += counters["submission_number"]
+                problem.accepted_number += counters["accepted_number"]
+                for result, count in counters["statistic_info"].items():
+                    problem.statistic_info[result] = max(problem.statistic_info.get(result, 0) + count, 0)
+                problem.counter_flush_token = token
+                problem.save(update_fields=["submission_number", "accepted_number", "statistic_info",
+                                            "counter_flush_token"])
+        cache.delete(_flushing_key(problem_id))
+
+
+def flush_problem_counters():
+    # 先删除标记，写回期间新的增量会安排下一次写回
+    cache.delete(CacheKey.problem_counter_flush_scheduled)
+    while True:
+        problem_ids = cache.spop(CacheKey.problem_counter_dirty, 100)
+        if not problem_ids:
+            break
+        for index, problem_id in enumerate(problem_ids):
+            try:
+                _flush_problem(int(problem_id))
+            except Exception:
+                # 没有写回的题目留给下一次
+                cache.sadd(CacheKey.problem_counter_dirty, *problem_ids[index:])
+                raise
+
+
+def _first_accepted_key(problem_id):
+    return f"{CacheKey.problem_first_ac}:{problem_id}"
+
+
+def is_first_accepted(problem_id):
+    """
+    比赛中第一个通过该题的提交，代替加锁读取 problem.accepted_number
+    标记为 0 表示重判后还没有人通过，没有标记时以数据库中的通过数为准
+    """
+    key = _first_accepted_key(problem_id)
+    pipe = cache.pipeline()
+    pipe.getset(key, 1)
+    pipe.expire(key, FIRST_ACCEPTED_TTL)
+    last = pipe.execute()[0]
+    if last is not None:
+        return last == b"0"
+    return not Problem.objects.filter(id=problem_id, accepted_number__gt=0).exists()
+
+
+def set_first_accepted(problem_ids, accepted):
+    """
+    重判后重新设置标记，accepted 中的题目已经有人通过
+    """
+    pipe = cache.pipeline()
+    for problem_id in problem_ids:
+        pipe.set(_first_accepted_key(problem_id), int(problem_id in accepted), ex=FIRST_ACCEPTED_TTL)
+    pipe.execute()
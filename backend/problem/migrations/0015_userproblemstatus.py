@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_problems_status(apps, schema_editor):
+    """
+    把 UserProfile.acm_problems_status 和 oi_problems_status 中的数据拆分到 user_problem_status 表
+    """
+    UserProfile = apps.get_model("account", "UserProfile")
+    Problem = apps.get_model("problem", "Problem")
+    UserProblemStatus = apps.get_model("problem", "UserProblemStatus")
+    problem_contest = dict(Problem.objects.values_list("id", "contest_id"))
+
+    items = []
+    profiles = UserProfile.objects.values_list("user_id", "acm_problems_status", "oi_problems_status")
+    for user_id, acm_problems_status, oi_problems_status in profiles.iterator():
+        for problems_status in (acm_problems_status, oi_problems_status):
+            for key in ("problems", "contest_problems"):
+                for problem_id, info in problems_status.get(key, {}).items():
+                    problem_id = int(problem_id)
+                    # 题目可能已经被删除
+                    if problem_id not in problem_contest:
+                        continue
+                    items.append(UserProblemStatus(user_id=user_id, problem_id=problem_id,
+                                                   contest_id=problem_contest[problem_id],
+                                                   status=info["status"], score=info.get("score", 0)))
+        if len(items) >= 1000:
+            UserProblemStatus.objects.bulk_create(items, ignore_conflicts=True)
+            items = []
+    UserProblemStatus.objects.bulk_create(items, ignore_conflicts=True)
+
+
+def restore_problems_status(apps, schema_editor):
+    UserProfile = apps.get_model("account", "UserProfile")
+    UserProblemStatus = apps.get_model("problem", "UserProblemStatus")
+
+    profiles = {}
+    for item in UserProblemStatus.objects.select_related("problem").iterator():
+        acm_problems_status, oi_problems_status = profiles.setdefault(item.user_id, ({}, {}))
+        key = "contest_problems" if item.contest_id else "problems"
+        info = {"status": item.status, "_id": item.problem._id}
+        if item.problem.rule_type == "ACM":
+            acm_problems_status.setdefault(key, {})[str(item.problem_id)] = info
+        else:
+            info["score"] = item.score
+            oi_problems_status.setdefault(key, {})[str(item.problem_id)] = info
+    for user_id, (acm_problems_status, oi_problems_status) in profiles.items():
+        UserProfile.objects.filter(user_id=user_id).update(acm_problems_status=acm_problems_status,
+                                                           oi_problems_status=oi_problems_status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('account', '0014_approve_existing_admins'),
+        ('contest', '0010_auto_20190326_0201'),
+        ('problem', '0014_problem_share_submission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProblemStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField()),
+                ('score', models.IntegerField(default=0)),
+                ('contest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_problem_status',
+                'unique_together': {('user', 'problem')},
+            },
+        ),
+        migrations.RunPython(copy_problems_status, reverse_code=restore_problems_status),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+from utils.search import AddTrigramIndex
+
+
+class Migration(migrations.Migration):
+    # AddTrigramIndex 并发创建索引，不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('problem', '0015_userproblemstatus'),
+    ]
+
+    operations = [
+        AddTrigramIndex(table='problem', column='title', name='problem_title_trgm'),
+        AddTrigramIndex(table='problem', column='_id', name='problem_display_id_trgm'),
+    ]
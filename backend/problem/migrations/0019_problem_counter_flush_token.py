@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0016_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='counter_flush_token',
+            field=models.TextField(null=True),
+        ),
+    ]
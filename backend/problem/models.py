@@ -81,6 +81,8 @@ class Problem(models.Model):
     # {JudgeStatus.ACCEPTED: 3, JudgeStaus.WRONG_ANSWER: 11}, the number means count
     statistic_info = JSONField(default=dict)
     share_submission = models.BooleanField(default=False)
+    # 最近一次写回的 redis 计数器批次，重复写回同一批时跳过
+    counter_flush_token = models.TextField(null=True)
 
     class Meta:
         db_table = "problem"
@@ -94,3 +96,21 @@ class Problem(models.Model):
     def add_ac_number(self):
         self.accepted_number = models.F("accepted_number") + 1
         self.save(update_fields=["accepted_number"])
+
+
+class UserProblemStatus(models.Model):
+    """
+    用户在每道题目上的最新状态，判题时只锁定和更新这一行
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    # 比赛题目才有，和 problem.contest 相同
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
+    # JudgeStatus
+    status = models.IntegerField()
+    # for OI mode
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "user_problem_status"
+        unique_together = (("user", "problem"),)
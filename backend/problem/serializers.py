@@ -1,12 +1,14 @@
 import re
 
 from django import forms
+from django.db import models
 
 from options.options import SysOptions
 from utils.api import UsernameSerializer, serializers
 from utils.constants import Difficulty
 from utils.serializers import LanguageNameMultiChoiceField, SPJLanguageNameChoiceField, LanguageNameChoiceField
 
+from .counters import get_problem_counters, merge_problem_counters
 from .models import Problem, ProblemRuleType, ProblemTag, ProblemIOMode
 from .utils import parse_problem_template
 
@@ -100,10 +102,27 @@ class CompileSPJSerializer(serializers.Serializer):
     spj_code = serializers.CharField()
 
 
+class ProblemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        problems = list(data.all() if isinstance(data, models.Manager) else data)
+        # 一次取出这一页所有题目还没有写回数据库的计数器
+        self.child.problem_counters = get_problem_counters([problem.id for problem in problems])
+        return [self.child.to_representation(problem) for problem in problems]
+
+
 class BaseProblemSerializer(serializers.ModelSerializer):
     tags = serializers.SlugRelatedField(many=True, slug_field="name", read_only=True)
     created_by = UsernameSerializer()
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if "submission_number" in data:
+            counters = getattr(self, "problem_counters", None)
+            if counters is None:
+                counters = get_problem_counters([instance.id])
+            merge_problem_counters(data, counters.get(instance.id))
+        return data
+
     def get_public_template(self, obj):
         ret = {}
         for lang, code in obj.template.items():
@@ -114,7 +133,8 @@ class BaseProblemSerializer(serializers.ModelSerializer):
 class ProblemAdminSerializer(BaseProblemSerializer):
     class Meta:
         model = Problem
-        fields = "__all__"
+        exclude = ("counter_flush_token",)
+        list_serializer_class = ProblemListSerializer
 
 
 class ProblemSerializer(BaseProblemSerializer):
@@ -123,7 +143,8 @@ class ProblemSerializer(BaseProblemSerializer):
     class Meta:
         model = Problem
         exclude = ("test_case_score", "test_case_id", "visible", "is_public",
-                   "spj_code", "spj_version", "spj_compile_ok")
+                   "spj_code", "spj_version", "spj_compile_ok", "counter_flush_token")
+        list_serializer_class = ProblemListSerializer
 
 
 class ProblemSafeSerializer(BaseProblemSerializer):
@@ -133,7 +154,7 @@ class ProblemSafeSerializer(BaseProblemSerializer):
         model = Problem
         exclude = ("test_case_score", "test_case_id", "visible", "is_public",
                    "spj_code", "spj_version", "spj_compile_ok",
-                   "difficulty", "submission_number", "accepted_number", "statistic_info")
+                   "difficulty", "submission_number", "accepted_number", "statistic_info", "counter_flush_token")
 
 
 class ContestProblemMakePublicSerializer(serializers.Serializer):
@@ -0,0 +1,35 @@
+import logging
+import os
+
+import dramatiq
+
+from utils.api import APIError
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+from .counters import flush_problem_counters as _flush_problem_counters
+from .test_case import TestCaseJob, TestCaseJobStatus, TestCaseZipProcessor
+
+logger = logging.getLogger(__name__)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def flush_problem_counters():
+    _flush_problem_counters()
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def process_test_case_task(job_id):
+    job = TestCaseJob(job_id)
+    data = job.get()
+    if not data or data["status"] != TestCaseJobStatus.PENDING:
+        return
+    try:
+        info, test_case_id = TestCaseZipProcessor().process_zip(job.archive_path, spj=data["spj"], job=job)
+    except APIError as e:
+        job.fail(e.msg)
+    except Exception as e:
+        logger.exception(e)
+        job.fail("Failed to process test cases")
+    else:
+        job.finish({"id": test_case_id, "info": info, "spj": data["spj"]})
+    finally:
+        os.remove(job.archive_path)
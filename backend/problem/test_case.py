@@ -0,0 +1,426 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from utils.api import APIError
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str, natural_sort_key
+from utils.zip_stream import iter_zip
+
+logger = logging.getLogger(__name__)
+
+# 解压和写入测试用例时每次处理的数据量，每个线程同时只持有一块
+CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = b" \t\n\r\x0b\x0c"
+# TEST_CASE_DIR 下保存去重后测试用例文件的目录，测试用例目录的名字都是 32 位的随机字符串
+OBJECT_DIR_NAME = "objects"
+
+
+def normalize_line_endings(chunks):
+    """
+    把 \r\n 替换为 \n，和对整个文件 replace(b"\r\n", b"\n") 的结果相同
+    块末尾的 \r 留到下一块，跨块的 \r\n 也能被替换
+    """
+    pending = b""
+    for chunk in chunks:
+        chunk = pending + chunk
+        if chunk.endswith(b"\r"):
+            chunk, pending = chunk[:-1], b"\r"
+        else:
+            pending = b""
+        if chunk:
+            yield chunk.replace(b"\r\n", b"\n")
+    if pending:
+        yield pending
+
+
+class StrippedMD5(object):
+    """
+    增量计算 md5(content.rstrip())，末尾的空白字符在后面出现非空白字符时才计入
+    连续的空白字符暂存在 SpooledTemporaryFile 中，超过一块后写入磁盘，内存占用不会随文件增长
+    """
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.whitespace = None
+
+    def update(self, data):
+        body = data.rstrip(_WHITESPACE)
+        if body:
+            if self.whitespace:
+                self.whitespace.seek(0)
+                for chunk in iter(lambda: self.whitespace.read(CHUNK_SIZE), b""):
+                    self.md5.update(chunk)
+                self.whitespace.close()
+                self.whitespace = None
+            self.md5.update(body)
+        tail = data[len(body):]
+        if tail:
+            if self.whitespace is None:
+                self.whitespace = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+            self.whitespace.write(tail)
+
+    def hexdigest(self):
+        if self.whitespace:
+            self.whitespace.close()
+            self.whitespace = None
+        return self.md5.hexdigest()
+
+
+def copy_test_case_file(src, dst, is_output, progress=None):
+    """
+    从 src 分块读取，统一换行符后写入 dst
+    :param progress: 每读取一块调用一次，参数为读取的字节数
+    :return: (换行符统一后的大小, 输出文件去掉末尾空白后的 md5，输入文件为 None)
+    """
+    def read():
+        chunk = src.read(CHUNK_SIZE)
+        if chunk and progress:
+            progress(len(chunk))
+        return chunk
+
+    size = 0
+    md5 = StrippedMD5() if is_output else None
+    for chunk in normalize_line_endings(iter(read, b"")):
+        size += len(chunk)
+        if md5:
+            md5.update(chunk)
+        dst.write(chunk)
+    return size, md5.hexdigest() if md5 else None
+
+
+def _object_root():
+    return os.path.join(settings.TEST_CASE_DIR, OBJECT_DIR_NAME)
+
+
+def _object_path(digest):
+    return os.path.join(_object_root(), digest[:2], digest)
+
+
+def _file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _link_object(path, digest):
+    """
+    用硬链接把 path 替换为内容相同的对象，对象不存在时 path 本身成为对象
+    """
+    object_path = _object_path(digest)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    while True:
+        try:
+            os.link(path, object_path)
+            return
+        except FileExistsError:
+            pass
+        tmp_path = f"{path}.{rand_str(8)}"
+        try:
+            os.link(object_path, tmp_path)
+        except FileNotFoundError:
+            # 对象刚好被 prune_test_case_objects 删除
+            continue
+        os.replace(tmp_path, path)
+        return
+
+
+class _HashingWriter(object):
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.f.write(data)
+
+
+def store_test_case_file(src, path, is_output, progress=None):
+    """
+    测试用例文件按内容的 sha256 保存在 TEST_CASE_DIR/objects 中，path 是指向它的硬链接
+    相同的文件只占用一份磁盘空间，rsync -H 同步到判题服务器时也只传输一次
+    :return: 同 copy_test_case_file
+    """
+    with open(path, "wb") as f:
+        writer = _HashingWriter(f)
+        ret = copy_test_case_file(src, writer, is_output, progress)
+    _link_object(path, writer.sha256.hexdigest())
+    return ret
+
+
+def dedup_test_case_dir(test_case_dir):
+    """
+    把已有目录中的测试用例文件替换为对象的硬链接
+    """
+    for entry in os.scandir(test_case_dir):
+        if entry.is_file() and entry.name.endswith((".in", ".out")) and entry.stat().st_nlink == 1:
+            _link_object(entry.path, _file_digest(entry.path))
+
+
+def dedup_test_cases():
+    if not os.path.isdir(settings.TEST_CASE_DIR):
+        return
+    for entry in os.scandir(settings.TEST_CASE_DIR):
+        if entry.is_dir() and entry.name != OBJECT_DIR_NAME:
+            dedup_test_case_dir(entry.path)
+
+
+def remove_legacy_test_case_zips():
+    """
+    删除之前下载测试用例时生成在测试用例目录中的 <test_case_id>.zip，现在缓存在 TEST_CASE_ARCHIVE_DIR 中
+    """
+    if not os.path.isdir(settings.TEST_CASE_DIR):
+        return
+    for entry in os.scandir(settings.TEST_CASE_DIR):
+        path = os.path.join(entry.path, f"{entry.name}.zip")
+        if entry.is_dir() and os.path.isfile(path):
+            os.remove(path)
+
+
+def prune_test_case_objects():
+    """
+    删除已经没有测试用例目录引用的对象
+    """
+    root = _object_root()
+    if not os.path.isdir(root):
+        return
+    for sub_dir in os.scandir(root):
+        for entry in os.scandir(sub_dir.path):
+            if entry.stat().st_nlink == 1:
+                os.remove(entry.path)
+
+
+def _archive_path(test_case_id, version):
+    return os.path.join(settings.TEST_CASE_ARCHIVE_DIR, f"{test_case_id}-{version}.zip")
+
+
+def _archive_version(test_case_dir, name_list):
+    # 测试用例文件内容变化时大小或修改时间也会变化
+    sha1 = hashlib.sha1()
+    for name in name_list:
+        stat = os.stat(os.path.join(test_case_dir, name))
+        sha1.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return sha1.hexdigest()[:16]
+
+
+def _iter_archive(test_case_dir, name_list, archive_path):
+    """
+    边生成 zip 边返回，同时写入缓存文件，完整生成后才重命名为 archive_path，中途断开时删除
+    """
+    os.makedirs(settings.TEST_CASE_ARCHIVE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.TEST_CASE_ARCHIVE_DIR, suffix=".tmp")
+    completed = False
+    try:
+        with os.fdopen(fd, "wb") as cache_file:
+            for data in iter_zip([(name, os.path.join(test_case_dir, name)) for name in name_list],
+                                 workers=settings.ZIP_STREAM_WORKERS):
+                cache_file.write(data)
+                yield data
+        os.replace(tmp_path, archive_path)
+        completed = True
+    finally:
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def delete_test_case_archives(test_case_id, keep=None):
+    if not os.path.isdir(settings.TEST_CASE_ARCHIVE_DIR):
+        return
+    for entry in os.scandir(settings.TEST_CASE_ARCHIVE_DIR):
+        if entry.name.startswith(f"{test_case_id}-") and entry.path != keep:
+            os.remove(entry.path)
+
+
+def get_test_case_archive(test_case_id, name_list):
+    """
+    下载测试用例的压缩包按测试用例的版本缓存在 TEST_CASE_ARCHIVE_DIR 中，不放在判题服务器同步的目录里
+    :return: (缓存的压缩包路径, None)，没有缓存时返回 (None, 边生成边缓存的迭代器)
+    """
+    test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+    archive_path = _archive_path(test_case_id, _archive_version(test_case_dir, name_list))
+    if os.path.exists(archive_path):
+        return archive_path, None
+    # 内容变化后旧版本的缓存不会再被使用
+    delete_test_case_archives(test_case_id)
+    return None, _iter_archive(test_case_dir, name_list, archive_path)
+
+
+class TestCaseJobStatus:
+    PENDING = "pending"
+    PROCESSING = "processing"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
+class TestCaseJob(object):
+    """
+    上传的测试用例压缩包由 dramatiq 任务处理，状态和进度保存在 redis hash 中
+    """
+    TTL = 24 * 3600
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.key = f"{CacheKey.test_case_job}:{job_id}"
+
+    @property
+    def archive_path(self):
+        return os.path.join(settings.TEST_CASE_UPLOAD_DIR, f"{self.id}.zip")
+
+    @classmethod
+    def create(cls, uploaded_file, spj, created_by):
+        """
+        保存上传的压缩包，web 和 dramatiq worker 都能访问 DATA_DIR
+        """
+        job = cls(rand_str())
+        os.makedirs(settings.TEST_CASE_UPLOAD_DIR, exist_ok=True)
+        with open(job.archive_path, "wb") as f:
+            for chunk in uploaded_file.chunks():
+                f.write(chunk)
+        pipe = cache.pipeline()
+        pipe.hset(job.key, mapping={"status": TestCaseJobStatus.PENDING, "spj": int(spj), "created_by": created_by.id,
+                                    "files_total": 0, "files_done": 0, "bytes_total": 0, "bytes_done": 0})
+        pipe.expire(job.key, cls.TTL)
+        pipe.execute()
+        return job
+
+    def get(self):
+        data = {k.decode("utf-8"): v.decode("utf-8") for k, v in cache.hgetall(self.key).items()}
+        if not data:
+            return None
+        for field in ("created_by", "files_total", "files_done", "bytes_total", "bytes_done"):
+            data[field] = int(data[field])
+        data["id"] = self.id
+        data["spj"] = data["spj"] == "1"
+        data["result"] = json.loads(data["result"]) if "result" in data else None
+        data.setdefault("error", None)
+        return data
+
+    def start(self, files, size):
+        cache.hset(self.key, mapping={"status": TestCaseJobStatus.PROCESSING, "files_total": files, "bytes_total": size})
+
+    def advance(self, files=0, size=0):
+        pipe = cache.pipeline()
+        if files:
+            pipe.hincrby(self.key, "files_done", files)
+        if size:
+            pipe.hincrby(self.key, "bytes_done", size)
+        pipe.execute()
+
+    def finish(self, result):
+        cache.hset(self.key, mapping={"status": TestCaseJobStatus.FINISHED, "result": json.dumps(result)})
+
+    def fail(self, error):
+        cache.hset(self.key, mapping={"status": TestCaseJobStatus.FAILED, "error": error})
+
+
+class TestCaseZipProcessor(object):
+    def process_zip(self, uploaded_zip_file, spj, dir="", job=None):
+        """
+        :param job: TestCaseJob，不为空时报告处理进度
+        """
+        try:
+            zip_file = zipfile.ZipFile(uploaded_zip_file, "r")
+        except zipfile.BadZipFile as e:
+            logger.error(f"Bad zip file: {e}")
+            raise APIError("Bad zip file")
+        except Exception as e:
+            logger.error(f"Error opening zip file: {e}")
+            raise APIError(f"Error opening zip file: {str(e)}")
+
+        name_list = zip_file.namelist()
+        logger.info(f"Zip file contains: {name_list}")
+        test_case_list = self.filter_name_list(name_list, spj=spj, dir=dir)
+        if not test_case_list:
+            logger.error(f"No test cases found in zip. Looking in dir='{dir}', spj={spj}")
+            raise APIError(f"No test case files found. Expected files like {dir}1.in, {dir}1.out")
+
+        test_case_id = rand_str()
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+
+        # Ensure parent directory exists
+        os.makedirs(settings.TEST_CASE_DIR, exist_ok=True)
+
+        try:
+            os.mkdir(test_case_dir)
+            os.chmod(test_case_dir, 0o710)
+        except Exception as e:
+            logger.error(f"Failed to create test case directory {test_case_dir}: {e}")
+            raise APIError(f"Failed to create test case directory: {str(e)}")
+
+        if job:
+            job.start(len(test_case_list), sum(zip_file.getinfo(f"{dir}{item}").file_size for item in test_case_list))
+
+        def copy(item):
+            with zip_file.open(f"{dir}{item}") as src:
+                ret = store_test_case_file(src, os.path.join(test_case_dir, item), is_output=item.endswith(".out"),
+                                           progress=(lambda size: job.advance(size=size)) if job else None)
+            if job:
+                job.advance(files=1)
+            return ret
+
+        # 分块解压，多个文件在线程池中同时处理，zlib 和 md5 计算时会释放 GIL
+        with ThreadPoolExecutor(max_workers=settings.TEST_CASE_INGEST_WORKERS) as executor:
+            results = dict(zip(test_case_list, executor.map(copy, test_case_list)))
+        size_cache = {item: size for item, (size, _) in results.items()}
+        md5_cache = {item: md5 for item, (_, md5) in results.items()}
+        test_case_info = {"spj": spj, "test_cases": {}}
+
+        info = []
+
+        if spj:
+            for index, item in enumerate(test_case_list):
+                data = {"input_name": item, "input_size": size_cache[item]}
+                info.append(data)
+                test_case_info["test_cases"][str(index + 1)] = data
+        else:
+            # ["1.in", "1.out", "2.in", "2.out"] => [("1.in", "1.out"), ("2.in", "2.out")]
+            test_case_list = zip(*[test_case_list[i::2] for i in range(2)])
+            for index, item in enumerate(test_case_list):
+                data = {"stripped_output_md5": md5_cache[item[1]],
+                        "input_size": size_cache[item[0]],
+                        "output_size": size_cache[item[1]],
+                        "input_name": item[0],
+                        "output_name": item[1]}
+                info.append(data)
+                test_case_info["test_cases"][str(index + 1)] = data
+
+        with open(os.path.join(test_case_dir, "info"), "w", encoding="utf-8") as f:
+            f.write(json.dumps(test_case_info, indent=4))
+
+        for item in os.listdir(test_case_dir):
+            os.chmod(os.path.join(test_case_dir, item), 0o640)
+
+        return info, test_case_id
+
+    def filter_name_list(self, name_list, spj, dir=""):
+        name_list = set(name_list)
+        ret = []
+        prefix = 1
+        if spj:
+            while True:
+                in_name = f"{prefix}.in"
+                if f"{dir}{in_name}" in name_list:
+                    ret.append(in_name)
+                    prefix += 1
+                    continue
+                else:
+                    return sorted(ret, key=natural_sort_key)
+        else:
+            while True:
+                in_name = f"{prefix}.in"
+                out_name = f"{prefix}.out"
+                if f"{dir}{in_name}" in name_list and f"{dir}{out_name}" in name_list:
+                    ret.append(in_name)
+                    ret.append(out_name)
+                    prefix += 1
+                    continue
+                else:
+                    return sorted(ret, key=natural_sort_key)
@@ -1,19 +1,32 @@
 import copy
 import hashlib
+import io
 import os
 import shutil
 from datetime import timedelta
-from zipfile import ZipFile
+from unittest import mock
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 from django.conf import settings
+from django.core.management import call_command
 
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.search import search
+from utils.shortcuts import rand_str
+from utils.zip_stream import iter_zip
 
 from .models import ProblemTag, ProblemIOMode
 from .models import Problem, ProblemRuleType
 from contest.models import Contest
 from contest.tests import DEFAULT_CONTEST_DATA
 
+from .counters import (add_problem_counters, flush_problem_counters, get_problem_counters, is_first_accepted,
+                       set_first_accepted)
+from .tasks import process_test_case_task
+from .test_case import (TestCaseJobStatus, copy_test_case_file, dedup_test_case_dir,
+                        get_test_case_archive, prune_test_case_objects)
 from .views.admin import TestCaseAPI
 from .utils import parse_problem_template
 
@@ -102,33 +115,131 @@ class TestCaseUploadAPITest(APITestCase):
                 f.write(os.path.join(base_dir, item), item)
         return zip_file
 
-    def test_upload_spj_test_case_zip(self):
+    @mock.patch("problem.views.admin.process_test_case_task.send")
+    def upload(self, spj, send):
         with open(self.make_test_case_zip(), "rb") as f:
-            resp = self.client.post(self.url,
-                                    data={"spj": "true", "file": f}, format="multipart")
-            self.assertSuccess(resp)
-            data = resp.data["data"]
-            self.assertEqual(data["spj"], True)
-            test_case_dir = os.path.join(settings.TEST_CASE_DIR, data["id"])
-            self.assertTrue(os.path.exists(test_case_dir))
-            for item in data["info"]:
-                name = item["input_name"]
-                with open(os.path.join(test_case_dir, name), "r", encoding="utf-8") as f:
-                    self.assertEqual(f.read(), name + "\n" + name + "\n" + "end")
+            resp = self.client.post(self.url, data={"spj": spj, "file": f}, format="multipart")
+        self.assertSuccess(resp)
+        job = resp.data["data"]
+        self.assertEqual(job["status"], TestCaseJobStatus.PENDING)
+        send.assert_called_once_with(job["id"])
+        process_test_case_task.fn(job["id"])
+        resp = self.client.get(self.reverse("test_case_job_api"), data={"id": job["id"]})
+        self.assertSuccess(resp)
+        job = resp.data["data"]
+        self.assertEqual(job["status"], TestCaseJobStatus.FINISHED)
+        self.assertEqual(job["files_done"], job["files_total"])
+        self.assertEqual(job["bytes_done"], job["bytes_total"])
+        return job["result"]
+
+    def test_upload_spj_test_case_zip(self):
+        data = self.upload("true")
+        self.assertEqual(data["spj"], True)
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, data["id"])
+        self.assertTrue(os.path.exists(test_case_dir))
+        for item in data["info"]:
+            name = item["input_name"]
+            with open(os.path.join(test_case_dir, name), "r", encoding="utf-8") as f:
+                self.assertEqual(f.read(), name + "\n" + name + "\n" + "end")
 
     def test_upload_test_case_zip(self):
-        with open(self.make_test_case_zip(), "rb") as f:
-            resp = self.client.post(self.url,
-                                    data={"spj": "false", "file": f}, format="multipart")
-            self.assertSuccess(resp)
-            data = resp.data["data"]
-            self.assertEqual(data["spj"], False)
-            test_case_dir = os.path.join(settings.TEST_CASE_DIR, data["id"])
-            self.assertTrue(os.path.exists(test_case_dir))
-            for item in data["info"]:
-                name = item["input_name"]
-                with open(os.path.join(test_case_dir, name), "r", encoding="utf-8") as f:
-                    self.assertEqual(f.read(), name + "\n" + name + "\n" + "end")
+        data = self.upload("false")
+        self.assertEqual(data["spj"], False)
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, data["id"])
+        self.assertTrue(os.path.exists(test_case_dir))
+        for item in data["info"]:
+            name = item["input_name"]
+            with open(os.path.join(test_case_dir, name), "r", encoding="utf-8") as f:
+                self.assertEqual(f.read(), name + "\n" + name + "\n" + "end")
+
+    def test_dedup_test_case_files(self):
+        first, second = self.upload("false"), self.upload("false")
+        first_file = os.path.join(settings.TEST_CASE_DIR, first["id"], "1.in")
+        second_file = os.path.join(settings.TEST_CASE_DIR, second["id"], "1.in")
+        self.assertTrue(os.path.samefile(first_file, second_file))
+
+        # 已有的目录去重后和上传的文件指向同一个对象
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, rand_str())
+        os.mkdir(test_case_dir)
+        shutil.copy(first_file, os.path.join(test_case_dir, "1.in"))
+        content = rand_str().encode("utf-8")
+        with open(os.path.join(test_case_dir, "2.in"), "wb") as f:
+            f.write(content)
+        dedup_test_case_dir(test_case_dir)
+        self.assertTrue(os.path.samefile(first_file, os.path.join(test_case_dir, "1.in")))
+
+        # 没有目录引用的对象被删除
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = os.path.join(settings.TEST_CASE_DIR, "objects", digest[:2], digest)
+        self.assertTrue(os.path.samefile(object_path, os.path.join(test_case_dir, "2.in")))
+        shutil.rmtree(test_case_dir)
+        prune_test_case_objects()
+        self.assertFalse(os.path.exists(object_path))
+
+    def test_dedup_test_cases_command(self):
+        test_case_id = rand_str()
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+        os.mkdir(test_case_dir)
+        with open(os.path.join(test_case_dir, "1.in"), "w") as f:
+            f.write(rand_str())
+        legacy_zip = os.path.join(test_case_dir, f"{test_case_id}.zip")
+        open(legacy_zip, "wb").close()
+        call_command("dedup_test_cases", stdout=io.StringIO())
+        self.assertEqual(os.stat(os.path.join(test_case_dir, "1.in")).st_nlink, 2)
+        self.assertFalse(os.path.exists(legacy_zip))
+        shutil.rmtree(test_case_dir)
+        prune_test_case_objects()
+
+    def test_test_case_archive(self):
+        data = self.upload("false")
+        name_list = ["1.in", "1.out", "info"]
+        archive_path, stream = get_test_case_archive(data["id"], name_list)
+        self.assertIsNone(archive_path)
+        content = b"".join(stream)
+        with ZipFile(io.BytesIO(content)) as f:
+            self.assertEqual(f.namelist(), name_list)
+            self.assertEqual(f.read("1.in"), b"1.in\n1.in\nend")
+
+        archive_path, stream = get_test_case_archive(data["id"], name_list)
+        self.assertIsNone(stream)
+        with open(archive_path, "rb") as f:
+            self.assertEqual(f.read(), content)
+
+        # 测试用例变化后重新生成，旧版本的缓存被删除
+        os.utime(os.path.join(settings.TEST_CASE_DIR, data["id"], "info"), ns=(0, 0))
+        self.assertIsNone(get_test_case_archive(data["id"], name_list)[0])
+        self.assertFalse(os.path.exists(archive_path))
+
+
+class TestCaseStreamTest(APITestCase):
+    @mock.patch("problem.test_case.CHUNK_SIZE", 3)
+    def test_copy_test_case_file(self):
+        # 分块边界落在 \r\n 中间和末尾的空白字符中，结果应和整体处理相同
+        for content in [b"1 2\r\n3 4\r\n\r\n  \t", b"\r\r\nab\r", b"a  \r\n  b \n\n", b"", b"  \n"]:
+            dst = io.BytesIO()
+            size, md5 = copy_test_case_file(io.BytesIO(content), dst, is_output=True)
+            expected = content.replace(b"\r\n", b"\n")
+            self.assertEqual(dst.getvalue(), expected)
+            self.assertEqual(size, len(expected))
+            self.assertEqual(md5, hashlib.md5(expected.rstrip()).hexdigest())
+        self.assertEqual(copy_test_case_file(io.BytesIO(b"1\r\n"), io.BytesIO(), is_output=False), (2, None))
+
+    @mock.patch("utils.zip_stream.PARALLEL_MAX_SIZE", 1024)
+    def test_iter_zip(self):
+        large = os.path.join(settings.TEST_CASE_DIR, "large.in")
+        with open(large, "wb") as f:
+            f.write(b"1 2\n" * 1000)
+        entries = [("1/problem.json", b"{}" * 100), ("1/testcase/1.gz", b"\x1f\x8b" * 100),
+                   ("1/testcase/large.in", large), ("1/testcase/\u6d4b\u8bd5.out", os.urandom(100))]
+        with ZipFile(io.BytesIO(b"".join(iter_zip(entries, workers=2)))) as f:
+            self.assertIsNone(f.testzip())
+            self.assertEqual(f.namelist(), [name for name, _ in entries])
+            # 已经压缩过的和随机数据直接存储
+            self.assertEqual([item.compress_type for item in f.infolist()],
+                             [ZIP_DEFLATED, ZIP_STORED, ZIP_DEFLATED, ZIP_STORED])
+            with open(large, "rb") as large_file:
+                self.assertEqual(f.read("1/testcase/large.in"), large_file.read())
+        os.remove(large)
 
 
 class ProblemAdminAPITest(APITestCase):
@@ -168,6 +279,7 @@ class ProblemAdminAPITest(APITestCase):
         problem_id = self.test_create_problem().data["data"]["id"]
         resp = self.client.get(self.url + "?id=" + str(problem_id))
         self.assertSuccess(resp)
+        self.assertNotIn("counter_flush_token", resp.data["data"])
 
     def test_edit_problem(self):
         problem_id = self.test_create_problem().data["data"]["id"]
@@ -187,6 +299,8 @@ class ProblemAPITest(ProblemCreateTestBase):
     def test_get_problem_list(self):
         resp = self.client.get(f"{self.url}?limit=10")
         self.assertSuccess(resp)
+        for item in resp.data["data"]["results"]:
+            self.assertNotIn("counter_flush_token", item)
 
     def get_one_problem(self):
         resp = self.client.get(self.url + "?id=" + self.problem._id)
@@ -322,3 +436,72 @@ ddd
         self.assertEqual(ret["prepend"], "aaa\n")
         self.assertEqual(ret["template"], "")
         self.assertEqual(ret["append"], "ccc\n")
+
+
+class ProblemCounterTest(ProblemCreateTestBase):
+    def setUp(self):
+        self.url = self.reverse("problem_api")
+        admin = self.create_admin(login=False)
+        self.problem = self.add_problem(DEFAULT_PROBLEM_DATA, admin)
+        user = self.create_user("test", "test123")
+        user.is_approved = True
+        user.save()
+        cache.delete_many([f"{CacheKey.problem_counter}:{self.problem.id}",
+                           f"{CacheKey.problem_counter}:{self.problem.id}:flushing",
+                           CacheKey.problem_counter_dirty, CacheKey.problem_counter_flush_scheduled])
+
+    @mock.patch("problem.tasks.flush_problem_counters.send_with_options")
+    def test_add_and_flush(self, send):
+        add_problem_counters(self.problem.id, submission_number=1, accepted_number=1, results={"0": 1})
+        add_problem_counters(self.problem.id, submission_number=1, results={"-1": 1})
+        # 只安排一次写回
+        self.assertEqual(send.call_count, 1)
+
+        resp = self.client.get(f"{self.url}?limit=10")
+        self.assertSuccess(resp)
+        data = resp.data["data"]["results"][0]
+        self.assertEqual(data["submission_number"], 2)
+        self.assertEqual(data["accepted_number"], 1)
+        self.assertEqual(data["statistic_info"], {"0": 1, "-1": 1})
+
+        flush_problem_counters()
+        problem = Problem.objects.get(id=self.problem.id)
+        self.assertEqual(problem.submission_number, 2)
+        self.assertEqual(problem.statistic_info, {"0": 1, "-1": 1})
+        self.assertEqual(get_problem_counters([self.problem.id]), {})
+
+        resp = self.client.get(f"{self.url}?problem_id={self.problem._id}")
+        self.assertEqual(resp.data["data"]["submission_number"], 2)
+
+    @mock.patch("problem.tasks.flush_problem_counters.send_with_options")
+    def test_flush_after_crash(self, send):
+        add_problem_counters(self.problem.id, submission_number=1)
+        # 提交之后、删除 flushing key 之前退出
+        with mock.patch("problem.counters.cache.delete"):
+            flush_problem_counters()
+        add_problem_counters(self.problem.id, submission_number=2)
+        cache.sadd(CacheKey.problem_counter_dirty, self.problem.id)
+        flush_problem_counters()
+        self.assertEqual(Problem.objects.get(id=self.problem.id).submission_number, 3)
+        self.assertEqual(get_problem_counters([self.problem.id]), {})
+
+    def test_first_accepted(self):
+        cache.delete(f"{CacheKey.problem_first_ac}:{self.problem.id}")
+        self.assertTrue(is_first_accepted(self.problem.id))
+        self.assertFalse(is_first_accepted(self.problem.id))
+        # 重判后没有人通过
+        set_first_accepted([self.problem.id], set())
+        self.assertTrue(is_first_accepted(self.problem.id))
+
+
+class ProblemSearchTest(ProblemCreateTestBase):
+    def setUp(self):
+        admin = self.create_admin(login=False)
+        for _id, title in (("A-1", "x sum"), ("A-2", "Sum of two"), ("A-3", "sum"), ("A-4", "product")):
+            data = copy.deepcopy(DEFAULT_PROBLEM_DATA)
+            data.update({"_id": _id, "title": title})
+            self.add_problem(data, admin)
+
+    def test_ranked_search(self):
+        problems = search(Problem.objects.all(), ("title", "_id"), "SUM")
+        self.assertEqual([problem._id for problem in problems], ["A-3", "A-2", "A-1"])
@@ -1,6 +1,8 @@
 import re
 from functools import lru_cache
 
+from .models import ProblemRuleType, UserProblemStatus
+
 
 TEMPLATE_BASE = """//PREPEND BEGIN
 {}
@@ -28,3 +30,29 @@ def parse_problem_template(template_str):
 @lru_cache(maxsize=100)
 def build_problem_template(prepend, template, append):
     return TEMPLATE_BASE.format(prepend, template, append)
+
+
+def get_problems_status(user, problem_ids):
+    """
+    :return: {problem_id: JudgeStatus}
+    """
+    return dict(UserProblemStatus.objects.filter(user=user, problem_id__in=problem_ids)
+                .values_list("problem_id", "status"))
+
+
+def get_user_problems_status(user_id):
+    """
+    按照原来 UserProfile 中 acm_problems_status 和 oi_problems_status 的格式返回用户的全部题目状态
+    """
+    acm_problems_status, oi_problems_status = {}, {}
+    items = UserProblemStatus.objects.filter(user_id=user_id) \
+        .values_list("problem_id", "contest_id", "status", "score", "problem___id", "problem__rule_type")
+    for problem_id, contest_id, status, score, _id, rule_type in items:
+        key = "contest_problems" if contest_id else "problems"
+        info = {"status": status, "_id": _id}
+        if rule_type == ProblemRuleType.ACM:
+            acm_problems_status.setdefault(key, {})[str(problem_id)] = info
+        else:
+            info["score"] = score
+            oi_problems_status.setdefault(key, {})[str(problem_id)] = info
+    return acm_problems_status, oi_problems_status
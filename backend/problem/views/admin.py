@@ -6,23 +6,23 @@ import logging
 import tempfile
 import zipfile
 import xml.etree.ElementTree as ET
-from wsgiref.util import FileWrapper
 
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Q
 from django.http import StreamingHttpResponse, FileResponse
 
 from account.decorators import problem_permission_required, ensure_created_by
 from contest.models import Contest, ContestStatus
 from fps.parser import FPSHelper, FPSParser
+from judge.cache import invalidate_judge_problems
 from judge.dispatcher import SPJCompiler
 from options.options import SysOptions
 from submission.models import Submission, JudgeStatus
-from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
+from utils.api import APIView, CSRFExemptAPIView, validate_serializer
 from utils.constants import Difficulty
-from utils.shortcuts import rand_str, natural_sort_key
-from utils.tasks import delete_files
+from utils.search import search
+from utils.shortcuts import rand_str
+from utils.zip_stream import iter_zip
 from ..models import Problem, ProblemRuleType, ProblemTag
 from ..serializers import (CreateContestProblemSerializer, CompileSPJSerializer,
                            CreateProblemSerializer, EditProblemSerializer, EditContestProblemSerializer,
@@ -30,106 +30,13 @@ from ..serializers import (CreateContestProblemSerializer, CompileSPJSerializer,
                            AddContestProblemSerializer, ExportProblemSerializer,
                            ExportProblemRequestSerialzier, UploadProblemForm, ImportProblemSerializer,
                            FPSProblemSerializer)
+from ..tasks import process_test_case_task
+from ..test_case import TestCaseJob, TestCaseZipProcessor, dedup_test_case_dir, get_test_case_archive
 from ..utils import TEMPLATE_BASE, build_problem_template
 
 logger = logging.getLogger(__name__)
 
 
-class TestCaseZipProcessor(object):
-    def process_zip(self, uploaded_zip_file, spj, dir=""):
-        try:
-            zip_file = zipfile.ZipFile(uploaded_zip_file, "r")
-        except zipfile.BadZipFile as e:
-            logger.error(f"Bad zip file: {e}")
-            raise APIError("Bad zip file")
-        except Exception as e:
-            logger.error(f"Error opening zip file: {e}")
-            raise APIError(f"Error opening zip file: {str(e)}")
-        
-        name_list = zip_file.namelist()
-        logger.info(f"Zip file contains: {name_list}")
-        test_case_list = self.filter_name_list(name_list, spj=spj, dir=dir)
-        if not test_case_list:
-            logger.error(f"No test cases found in zip. Looking in dir='{dir}', spj={spj}")
-            raise APIError(f"No test case files found. Expected files like {dir}1.in, {dir}1.out")
-
-        test_case_id = rand_str()
-        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
-        
-        # Ensure parent directory exists
-        os.makedirs(settings.TEST_CASE_DIR, exist_ok=True)
-        
-        try:
-            os.mkdir(test_case_dir)
-            os.chmod(test_case_dir, 0o710)
-        except Exception as e:
-            logger.error(f"Failed to create test case directory {test_case_dir}: {e}")
-            raise APIError(f"Failed to create test case directory: {str(e)}")
-
-        size_cache = {}
-        md5_cache = {}
-
-        for item in test_case_list:
-            with open(os.path.join(test_case_dir, item), "wb") as f:
-                content = zip_file.read(f"{dir}{item}").replace(b"\r\n", b"\n")
-                size_cache[item] = len(content)
-                if item.endswith(".out"):
-                    md5_cache[item] = hashlib.md5(content.rstrip()).hexdigest()
-                f.write(content)
-        test_case_info = {"spj": spj, "test_cases": {}}
-
-        info = []
-
-        if spj:
-            for index, item in enumerate(test_case_list):
-                data = {"input_name": item, "input_size": size_cache[item]}
-                info.append(data)
-                test_case_info["test_cases"][str(index + 1)] = data
-        else:
-            # ["1.in", "1.out", "2.in", "2.out"] => [("1.in", "1.out"), ("2.in", "2.out")]
-            test_case_list = zip(*[test_case_list[i::2] for i in range(2)])
-            for index, item in enumerate(test_case_list):
-                data = {"stripped_output_md5": md5_cache[item[1]],
-                        "input_size": size_cache[item[0]],
-                        "output_size": size_cache[item[1]],
-                        "input_name": item[0],
-                        "output_name": item[1]}
-                info.append(data)
-                test_case_info["test_cases"][str(index + 1)] = data
-
-        with open(os.path.join(test_case_dir, "info"), "w", encoding="utf-8") as f:
-            f.write(json.dumps(test_case_info, indent=4))
-
-        for item in os.listdir(test_case_dir):
-            os.chmod(os.path.join(test_case_dir, item), 0o640)
-
-        return info, test_case_id
-
-    def filter_name_list(self, name_list, spj, dir=""):
-        ret = []
-        prefix = 1
-        if spj:
-            while True:
-                in_name = f"{prefix}.in"
-                if f"{dir}{in_name}" in name_list:
-                    ret.append(in_name)
-                    prefix += 1
-                    continue
-                else:
-                    return sorted(ret, key=natural_sort_key)
-        else:
-            while True:
-                in_name = f"{prefix}.in"
-                out_name = f"{prefix}.out"
-                if f"{dir}{in_name}" in name_list and f"{dir}{out_name}" in name_list:
-                    ret.append(in_name)
-                    ret.append(out_name)
-                    prefix += 1
-                    continue
-                else:
-                    return sorted(ret, key=natural_sort_key)
-
-
 class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
     request_parsers = ()
 
@@ -152,15 +59,15 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
             return self.error("Test case does not exists")
         name_list = self.filter_name_list(os.listdir(test_case_dir), problem.spj)
         name_list.append("info")
-        file_name = os.path.join(test_case_dir, problem.test_case_id + ".zip")
-        with zipfile.ZipFile(file_name, "w") as file:
-            for test_case in name_list:
-                file.write(f"{test_case_dir}/{test_case}", test_case)
-        response = StreamingHttpResponse(FileWrapper(open(file_name, "rb")),
-                                         content_type="application/octet-stream")
+        archive_path, stream = get_test_case_archive(problem.test_case_id, name_list)
+        if archive_path:
+            response = FileResponse(open(archive_path, "rb"), content_type="application/octet-stream")
+            response["Content-Length"] = os.path.getsize(archive_path)
+        else:
+            # 第一次下载时边压缩边返回，同时生成缓存
+            response = StreamingHttpResponse(stream, content_type="application/octet-stream")
 
         response["Content-Disposition"] = f"attachment; filename=problem_{problem.id}_test_cases.zip"
-        response["Content-Length"] = os.path.getsize(file_name)
         return response
 
     def post(self, request):
@@ -170,13 +77,19 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
             file = form.cleaned_data["file"]
         else:
             return self.error("Upload failed")
-        zip_file = f"/tmp/{rand_str()}.zip"
-        with open(zip_file, "wb") as f:
-            for chunk in file:
-                f.write(chunk)
-        info, test_case_id = self.process_zip(zip_file, spj=spj)
-        os.remove(zip_file)
-        return self.success({"id": test_case_id, "info": info, "spj": spj})
+        # 保存压缩包后立即返回，解压和计算 md5 在 dramatiq 任务中完成，通过 TestCaseJobAPI 查询进度
+        job = TestCaseJob.create(file, spj, request.user)
+        process_test_case_task.send(job.id)
+        return self.success(job.get())
+
+
+class TestCaseJobAPI(APIView):
+    @problem_permission_required
+    def get(self, request):
+        job = TestCaseJob(request.GET.get("id", "")).get()
+        if not job or (job["created_by"] != request.user.id and not request.user.is_super_admin()):
+            return self.error("Test case job does not exist")
+        return self.success(job)
 
 
 class CompileSPJAPI(APIView):
@@ -265,7 +178,7 @@ class ProblemAPI(ProblemBase):
 
         keyword = request.GET.get("keyword", "").strip()
         if keyword:
-            problems = problems.filter(Q(title__icontains=keyword) | Q(_id__icontains=keyword))
+            problems = search(problems, ("title", "_id"), keyword)
         if not user.can_mgmt_all_problem():
             problems = problems.filter(created_by=user)
         return self.success(self.paginate_data(request, problems, ProblemAdminSerializer))
@@ -298,6 +211,7 @@ class ProblemAPI(ProblemBase):
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        invalidate_judge_problems([problem.id])
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
@@ -323,6 +237,7 @@ class ProblemAPI(ProblemBase):
         # if os.path.isdir(d):
         #     shutil.rmtree(d, ignore_errors=True)
         problem.delete()
+        invalidate_judge_problems([id])
         return self.success()
 
 
@@ -388,7 +303,7 @@ class ContestProblemAPI(ProblemBase):
             problems = problems.filter(contest__created_by=user)
         keyword = request.GET.get("keyword")
         if keyword:
-            problems = problems.filter(title__contains=keyword)
+            problems = search(problems, ("title",), keyword)
         return self.success(self.paginate_data(request, problems, ProblemAdminSerializer))
 
     @validate_serializer(EditContestProblemSerializer)
@@ -428,6 +343,7 @@ class ContestProblemAPI(ProblemBase):
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        invalidate_judge_problems([problem.id])
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
@@ -453,6 +369,7 @@ class ContestProblemAPI(ProblemBase):
         # if os.path.isdir(d):
         #    shutil.rmtree(d, ignore_errors=True)
         problem.delete()
+        invalidate_judge_problems([id])
         return self.success()
 
 
@@ -527,24 +444,20 @@ class ExportProblemAPI(APIView):
                 ret.append({"language": submission.language, "code": submission.code})
         return ret
 
-    def process_one_problem(self, zip_file, user, problem, index):
+    def problem_entries(self, user, problem, index):
+        """
+        :return: 一道题目在压缩包中的 (文件名, 内容或文件路径)
+        """
         info = ExportProblemSerializer(problem).data
         info["answers"] = self.choose_answers(user, problem=problem)
-        compression = zipfile.ZIP_DEFLATED
-        zip_file.writestr(zinfo_or_arcname=f"{index}/problem.json",
-                          data=json.dumps(info, indent=4),
-                          compress_type=compression)
+        yield f"{index}/problem.json", json.dumps(info, indent=4).encode("utf-8")
         problem_test_case_dir = os.path.join(settings.TEST_CASE_DIR, problem.test_case_id)
         with open(os.path.join(problem_test_case_dir, "info")) as f:
             info = json.load(f)
         for k, v in info["test_cases"].items():
-            zip_file.write(filename=os.path.join(problem_test_case_dir, v["input_name"]),
-                           arcname=f"{index}/testcase/{v['input_name']}",
-                           compress_type=compression)
+            yield f"{index}/testcase/{v['input_name']}", os.path.join(problem_test_case_dir, v["input_name"])
             if not info["spj"]:
-                zip_file.write(filename=os.path.join(problem_test_case_dir, v["output_name"]),
-                               arcname=f"{index}/testcase/{v['output_name']}",
-                               compress_type=compression)
+                yield f"{index}/testcase/{v['output_name']}", os.path.join(problem_test_case_dir, v["output_name"])
 
     @validate_serializer(ExportProblemRequestSerialzier)
     def get(self, request):
@@ -554,13 +467,14 @@ class ExportProblemAPI(APIView):
                 ensure_created_by(problem.contest, request.user)
             else:
                 ensure_created_by(problem, request.user)
-        path = f"/tmp/{rand_str()}.zip"
-        with zipfile.ZipFile(path, "w") as zip_file:
+
+        def entries():
             for index, problem in enumerate(problems):
-                self.process_one_problem(zip_file=zip_file, user=request.user, problem=problem, index=index + 1)
-        delete_files.send_with_options(args=(path,), delay=300_000)
-        resp = FileResponse(open(path, "rb"))
-        resp["Content-Type"] = "application/zip"
+                yield from self.problem_entries(request.user, problem, index + 1)
+
+        # 边读取边压缩边返回，不再先写入临时文件
+        resp = StreamingHttpResponse(iter_zip(entries(), workers=settings.ZIP_STREAM_WORKERS),
+                                     content_type="application/zip")
         resp["Content-Disposition"] = "attachment;filename=problem-export.zip"
         return resp
 
@@ -827,6 +741,7 @@ class FPSProblemImport(CSRFExemptAPIView):
                 for item in helper.save_test_case(_problem, test_case_dir)["test_cases"].values():
                     score.append({"score": 0, "input_name": item["input_name"],
                                   "output_name": item.get("output_name")})
+                dedup_test_case_dir(test_case_dir)
                 problem_data = helper.save_image(_problem, settings.UPLOAD_DIR, settings.UPLOAD_PREFIX)
                 s = FPSProblemSerializer(data=problem_data)
                 if not s.is_valid():
@@ -1,10 +1,11 @@
 import random
-from django.db.models import Q, Count
+from django.db.models import Count
 from utils.api import APIView
+from utils.search import search
 from account.decorators import check_contest_permission, login_required
-from ..models import ProblemTag, Problem, ProblemRuleType
+from ..models import ProblemTag, Problem
 from ..serializers import ProblemSerializer, TagSerializer, ProblemSafeSerializer
-from contest.models import ContestRuleType
+from ..utils import get_problems_status
 
 
 class ProblemTagAPI(APIView):
@@ -40,20 +41,16 @@ class ProblemAPI(APIView):
     @staticmethod
     def _add_problem_status(request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            acm_problems_status = profile.acm_problems_status.get("problems", {})
-            oi_problems_status = profile.oi_problems_status.get("problems", {})
             # paginate data
             results = queryset_values.get("results")
             if results is not None:
                 problems = results
             else:
                 problems = [queryset_values, ]
+            # 只查询当前页的题目状态
+            problems_status = get_problems_status(request.user, [problem["id"] for problem in problems])
             for problem in problems:
-                if problem["rule_type"] == ProblemRuleType.ACM:
-                    problem["my_status"] = acm_problems_status.get(str(problem["id"]), {}).get("status")
-                else:
-                    problem["my_status"] = oi_problems_status.get(str(problem["id"]), {}).get("status")
+                problem["my_status"] = problems_status.get(problem["id"])
 
     @login_required
     def get(self, request):
@@ -86,7 +83,7 @@ class ProblemAPI(APIView):
         # 搜索的情况
         keyword = request.GET.get("keyword", "").strip()
         if keyword:
-            problems = problems.filter(Q(title__icontains=keyword) | Q(_id__icontains=keyword))
+            problems = search(problems, ("title", "_id"), keyword)
 
         # 难度筛选
         difficulty = request.GET.get("difficulty")
@@ -101,13 +98,9 @@ class ProblemAPI(APIView):
 class ContestProblemAPI(APIView):
     def _add_problem_status(self, request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            if self.contest.rule_type == ContestRuleType.ACM:
-                problems_status = profile.acm_problems_status.get("contest_problems", {})
-            else:
-                problems_status = profile.oi_problems_status.get("contest_problems", {})
+            problems_status = get_problems_status(request.user, [problem["id"] for problem in queryset_values])
             for problem in queryset_values:
-                problem["my_status"] = problems_status.get(str(problem["id"]), {}).get("status")
+                problem["my_status"] = problems_status.get(problem["id"])
 
     @check_contest_permission(check_type="problems")
     def get(self, request):
@@ -0,0 +1,78 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:22
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+# 被联合索引代替的单列索引
+REPLACED_INDEX_COLUMNS = ("contest_id", "problem_id", "user_id")
+
+
+def drop_single_column_indexes(apps, schema_editor):
+    model = apps.get_model("submission", "Submission")
+    for column in REPLACED_INDEX_COLUMNS:
+        for name in schema_editor._constraint_names(model, [column], index=True):
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def create_single_column_indexes(apps, schema_editor):
+    model = apps.get_model("submission", "Submission")
+    table = model._meta.db_table
+    for column in REPLACED_INDEX_COLUMNS:
+        name = schema_editor._create_index_name(table, [column])
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ("{column}")')
+
+
+class Migration(migrations.Migration):
+    # submission 表很大，索引都在事务外并发创建和删除，不阻塞写入
+    atomic = False
+
+    dependencies = [
+        ('submission', '0012_auto_20180501_0436'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(condition=models.Q(('contest__isnull', True)), fields=['-create_time', '-id'], name='submission_public_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', '-create_time', '-id'], name='submission_contest_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['problem', '-create_time'], name='submission_problem_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['user_id', '-create_time'], name='submission_user_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['problem', 'user_id'], name='submission_problem_user_idx'),
+        ),
+        # 新索引建好之后再删除旧的单列索引
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_single_column_indexes, create_single_column_indexes),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='submission',
+                    name='contest',
+                    field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest'),
+                ),
+                migrations.AlterField(
+                    model_name='submission',
+                    name='problem',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='problem.problem'),
+                ),
+                migrations.AlterField(
+                    model_name='submission',
+                    name='user_id',
+                    field=models.IntegerField(),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+from utils.search import AddTrigramIndex
+
+
+class Migration(migrations.Migration):
+    # AddTrigramIndex 并发创建索引，不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('submission', '0013_submission_indexes'),
+    ]
+
+    operations = [
+        AddTrigramIndex(table='submission', column='username', name='submission_username_trgm'),
+    ]
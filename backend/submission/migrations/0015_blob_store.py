@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:27
+
+from django.db import migrations, models
+import utils.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0014_trigram_indexes'),
+    ]
+
+    operations = [
+        # 已有的行是旧数据，新建的提交默认保存在 blob store 中
+        # PostgreSQL 11 以上添加带常量默认值的列不需要重写表
+        migrations.AddField(
+            model_name='submission',
+            name='blob_stored',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='blob_stored',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='code',
+            field=utils.models.BlobTextField(),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='info',
+            field=utils.models.BlobJSONField(default=dict),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 
 from utils.constants import ContestStatus
-from utils.models import JSONField
+from utils.models import BlobJSONField, BlobTextField, JSONField
 from problem.models import Problem
 from contest.models import Contest
 
@@ -24,15 +24,19 @@ class JudgeStatus:
 
 class Submission(models.Model):
     id = models.TextField(default=rand_str, primary_key=True, db_index=True)
-    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
-    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    # 单列索引被 Meta.indexes 中以该列开头的联合索引代替
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE, db_index=False)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE, db_index=False)
     create_time = models.DateTimeField(auto_now_add=True)
-    user_id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField()
     username = models.TextField()
-    code = models.TextField()
+    # 代码和判题详情保存在 blob store 中，相同的内容只保存一份
+    # blob_stored 为 False 的是还没有迁移到 blob store 的旧数据，code 和 info 列中直接保存内容
+    blob_stored = models.BooleanField(default=True)
+    code = BlobTextField()
     result = models.IntegerField(db_index=True, default=JudgeStatus.PENDING)
     # 从JudgeServer返回的判题详情
-    info = JSONField(default=dict)
+    info = BlobJSONField(default=dict)
     language = models.TextField()
     shared = models.BooleanField(default=False)
     # 存储该提交所用时间和内存值，方便提交列表显示
@@ -40,6 +44,34 @@ class Submission(models.Model):
     statistic_info = JSONField(default=dict)
     ip = models.TextField(null=True)
 
+    BLOB_FIELDS = ("code", "info")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = [name for name in cls.BLOB_FIELDS if name in instance.__dict__]
+        # blob_stored 没有查出时访问它会单独查询一次
+        if loaded and instance.blob_stored:
+            for name in loaded:
+                instance.__dict__[name] = cls._meta.get_field(name).from_blob_ref(instance.__dict__[name])
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is not None and set(fields) & set(self.BLOB_FIELDS):
+            fields = set(fields) | {"blob_stored"}
+        super().refresh_from_db(using=using, fields=fields)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if not self.blob_stored and (update_fields is None or set(update_fields) & set(self.BLOB_FIELDS)):
+            # 旧数据写回时 code 和 info 要一起保存到 blob store
+            for name in self.BLOB_FIELDS:
+                getattr(self, name)
+            self.blob_stored = True
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | set(self.BLOB_FIELDS) | {"blob_stored"}
+        super().save(*args, **kwargs)
+
     def check_user_permission(self, user, check_share=True):
         if self.user_id == user.id or user.is_super_admin() or user.can_mgmt_all_problem() or self.problem.created_by_id == user.id:
             return True
@@ -54,6 +86,16 @@ class Submission(models.Model):
     class Meta:
         db_table = "submission"
         ordering = ("-create_time",)
+        # 提交列表都按时间倒序，keyset 分页时再按 id 排序
+        indexes = [
+            models.Index(fields=["-create_time", "-id"], name="submission_public_time_idx",
+                         condition=models.Q(contest__isnull=True)),
+            models.Index(fields=["contest", "-create_time", "-id"], name="submission_contest_time_idx"),
+            models.Index(fields=["problem", "-create_time"], name="submission_problem_time_idx"),
+            models.Index(fields=["user_id", "-create_time"], name="submission_user_time_idx"),
+            # SubmissionExistsAPI
+            models.Index(fields=["problem", "user_id"], name="submission_problem_user_idx"),
+        ]
 
     def __str__(self):
         return self.id
@@ -0,0 +1,263 @@
+"""
+submission 表按 create_time 每月一个分区，只支持 postgres
+按 id 读取时仍然通过 submission 表，由 postgres 在各个分区的索引中查找
+"""
+import datetime
+import gzip
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.utils import timezone
+
+TABLE = "submission"
+DEFAULT_PARTITION = "submission_default"
+_PARTITION_NAME_RE = re.compile(r"^submission_y(\d{4})m(\d{2})$")
+# 转换期间新建的分区表，以及把原表的修改同步到新表的触发器
+NEW_TABLE = "submission_partitioned"
+SYNC_TRIGGER = "submission_partition_sync"
+# pg_get_indexdef 的输出，例如 CREATE INDEX "name" ON public.submission USING btree (...)
+_INDEX_DEF_RE = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )(?:"[^"]+"|\S+)( ON )(?:ONLY )?(?:\S+\.)?(?:"submission"|submission) ')
+
+
+def _new_index_name(name):
+    return f"{name[:59]}_p"
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(value):
+    return (value.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(start):
+    return f"submission_y{start.year}m{start.month:02d}"
+
+
+def partition_start(name):
+    """
+    :return: 分区对应月份的第一天 (UTC)，不是按月分区的表返回 None
+    """
+    match = _PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    return datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=datetime.timezone.utc)
+
+
+def _check_vendor():
+    if connection.vendor != "postgresql":
+        raise ImproperlyConfigured("Submission partitioning requires PostgreSQL")
+
+
+def is_partitioned():
+    _check_vendor()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN ('r', 'p')", [TABLE])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def list_partitions():
+    """
+    :return: 按月份排序的分区名，不包括默认分区
+    """
+    _check_vendor()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT child.relname FROM pg_inherits "
+                       "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                       "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                       "WHERE parent.relname = %s", [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(name for name in names if partition_start(name))
+
+
+def create_partition(cursor, start, table=TABLE):
+    start = month_start(start)
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{partition_name(start)}" PARTITION OF "{table}" '
+                   f"FOR VALUES FROM (%s) TO (%s)", [start, next_month(start)])
+
+
+def ensure_partitions(months_ahead):
+    """
+    提前创建之后几个月的分区，没有对应分区的数据会写入默认分区
+    """
+    start = month_start(timezone.now().astimezone(datetime.timezone.utc))
+    with connection.cursor() as cursor:
+        for _ in range(months_ahead + 1):
+            create_partition(cursor, start)
+            start = next_month(start)
+
+
+def _index_definitions(cursor):
+    """
+    :return: 主键以外的索引 [(name, definition)]
+    """
+    cursor.execute("SELECT index.relname, pg_get_indexdef(pg_index.indexrelid) FROM pg_index "
+                   "JOIN pg_class index ON pg_index.indexrelid = index.oid "
+                   "JOIN pg_class tbl ON pg_index.indrelid = tbl.oid "
+                   "WHERE tbl.relname = %s AND NOT pg_index.indisprimary", [TABLE])
+    return cursor.fetchall()
+
+
+def _foreign_keys(cursor):
+    """
+    :return: [(name, definition)]，CREATE TABLE ... LIKE 不会复制外键
+    """
+    cursor.execute("SELECT conname, pg_get_constraintdef(pg_constraint.oid) FROM pg_constraint "
+                   "JOIN pg_class tbl ON pg_constraint.conrelid = tbl.oid "
+                   "WHERE tbl.relname = %s AND contype = 'f'", [TABLE])
+    return cursor.fetchall()
+
+
+def _create_partitioned_table(cursor, months_ahead):
+    # 上次转换中途失败留下的表和触发器
+    cursor.execute(f'DROP TRIGGER IF EXISTS "{SYNC_TRIGGER}" ON "{TABLE}"')
+    cursor.execute(f'DROP TABLE IF EXISTS "{NEW_TABLE}" CASCADE')
+    cursor.execute(f'CREATE TABLE "{NEW_TABLE}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                   f"PARTITION BY RANGE (create_time)")
+    # 分区表的主键必须包含分区键
+    cursor.execute(f'ALTER TABLE "{NEW_TABLE}" ADD CONSTRAINT "{NEW_TABLE}_pkey" PRIMARY KEY (id, create_time)')
+    cursor.execute(f'SELECT min(create_time) FROM "{TABLE}"')
+    first = cursor.fetchone()[0] or timezone.now()
+    start = month_start(first.astimezone(datetime.timezone.utc))
+    end = next_month(month_start(timezone.now().astimezone(datetime.timezone.utc)))
+    for _ in range(months_ahead):
+        end = next_month(end)
+    while start < end:
+        create_partition(cursor, start, table=NEW_TABLE)
+        start = next_month(start)
+    cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{NEW_TABLE}" DEFAULT')
+    # 索引和外键在复制数据之前创建，切换时不需要在锁表期间建索引和检查外键
+    for name, definition in _index_definitions(cursor):
+        definition, count = _INDEX_DEF_RE.subn(
+            lambda m: f'{m.group(1)}"{_new_index_name(name)}"{m.group(2)}"{NEW_TABLE}" ', definition, count=1)
+        if not count:
+            raise ValueError(f"Unexpected index definition: {definition}")
+        cursor.execute(definition)
+    for name, definition in _foreign_keys(cursor):
+        cursor.execute(f'ALTER TABLE "{NEW_TABLE}" ADD CONSTRAINT "{name}" {definition}')
+    # 已经复制的行被修改或者删除时同步到新表
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION "{SYNC_TRIGGER}"() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM "{NEW_TABLE}" WHERE id = OLD.id AND create_time = OLD.create_time;
+            IF TG_OP = 'UPDATE' AND FOUND THEN
+                INSERT INTO "{NEW_TABLE}" SELECT NEW.*;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""")
+    cursor.execute(f'CREATE TRIGGER "{SYNC_TRIGGER}" AFTER UPDATE OR DELETE ON "{TABLE}" '
+                   f'FOR EACH ROW EXECUTE PROCEDURE "{SYNC_TRIGGER}"()')
+
+
+def _copy_batch(cursor, after, batch_size):
+    """
+    按 (create_time, id) 的顺序复制一批，FOR SHARE 使这一批提交前对这些行的修改等待，提交后再由触发器同步
+    :return: (这一批最后一行的 (create_time, id), 这一批的行数)，没有更多数据时返回 (None, 0)
+    """
+    cursor.execute(f'WITH copied AS (INSERT INTO "{NEW_TABLE}" SELECT * FROM "{TABLE}" '
+                   f"WHERE (create_time, id) > (%s, %s) ORDER BY create_time, id LIMIT %s FOR SHARE "
+                   f"RETURNING create_time, id) "
+                   f"SELECT create_time, id, count(*) OVER () FROM copied ORDER BY create_time DESC, id DESC LIMIT 1",
+                   [after[0], after[1], batch_size])
+    row = cursor.fetchone()
+    if not row:
+        return None, 0
+    return (row[0], row[1]), row[2]
+
+
+def convert(months_ahead, batch_size=10000, progress=None):
+    """
+    把普通的 submission 表转换为分区表，原表重命名为 submission_legacy，确认无误后可以手动删除
+    数据分批复制到新表，期间 submission 表可以正常读写，最后锁表复制剩余的行并切换，只在这一步阻塞读写
+    中途失败时重新执行即可，会删除上次没有完成的新表
+    """
+    _check_vendor()
+    with connection.cursor() as cursor:
+        with transaction.atomic():
+            _create_partitioned_table(cursor, months_ahead)
+        try:
+            last = (datetime.datetime.min.replace(tzinfo=datetime.timezone.utc), "")
+            copied = 0
+            while True:
+                with transaction.atomic():
+                    row, count = _copy_batch(cursor, last, batch_size)
+                if not row:
+                    break
+                last = row
+                copied += count
+                if progress:
+                    progress(copied)
+
+            with transaction.atomic():
+                # 一开始就取得最终需要的锁，避免从较弱的锁升级时和正在读写的请求死锁
+                cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+                # 外键是 DEFERRABLE 的，插入后还有待检查的外键时不能再 ALTER TABLE
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                # 复制期间新插入的行，提交较晚的事务中 create_time 可能略早于最后复制的行
+                cursor.execute(f'INSERT INTO "{NEW_TABLE}" SELECT * FROM "{TABLE}" s '
+                               f"WHERE s.create_time > %s - interval '1 hour' AND NOT EXISTS "
+                               f'(SELECT 1 FROM "{NEW_TABLE}" p WHERE p.id = s.id AND p.create_time = s.create_time)',
+                               [last[0]])
+                cursor.execute(f'DROP TRIGGER "{SYNC_TRIGGER}" ON "{TABLE}"')
+                cursor.execute(f'DROP FUNCTION "{SYNC_TRIGGER}"()')
+                indexes = _index_definitions(cursor)
+                cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{TABLE}_legacy"')
+                cursor.execute(f'ALTER TABLE "{TABLE}_legacy" RENAME CONSTRAINT "{TABLE}_pkey" TO "{TABLE}_legacy_pkey"')
+                for name, _ in indexes:
+                    cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"')
+                    cursor.execute(f'ALTER INDEX "{_new_index_name(name)}" RENAME TO "{name}"')
+                cursor.execute(f'ALTER TABLE "{NEW_TABLE}" RENAME TO "{TABLE}"')
+                cursor.execute(f'ALTER TABLE "{TABLE}" RENAME CONSTRAINT "{NEW_TABLE}_pkey" TO "{TABLE}_pkey"')
+        except Exception:
+            with transaction.atomic():
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{SYNC_TRIGGER}" ON "{TABLE}"')
+            raise
+
+
+def archive_path(name):
+    return os.path.join(settings.SUBMISSION_ARCHIVE_DIR, f"{name}.csv.gz")
+
+
+def archive_partition(name):
+    """
+    把一个月的分区导出为 gzip 压缩的 csv 后从数据库中删除
+    先 detach 分区再导出，导出期间不会再有写入落到这个分区，导出失败时重新 attach
+    code 和 info 本身在 blob store 中，导出的只是引用
+    """
+    _check_vendor()
+    start = partition_start(name)
+    os.makedirs(settings.SUBMISSION_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(name)
+    tmp_path = path + ".tmp"
+    with connection.cursor() as cursor:
+        with transaction.atomic():
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+        try:
+            with gzip.open(tmp_path, "wb") as f:
+                cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', f)
+            os.replace(tmp_path, path)
+        except Exception:
+            with transaction.atomic():
+                cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+                               [start, next_month(start)])
+            raise
+        with transaction.atomic():
+            cursor.execute(f'DROP TABLE "{name}"')
+    return path
+
+
+def restore_partition(name):
+    """
+    从归档文件中恢复一个月的分区
+    """
+    _check_vendor()
+    with transaction.atomic(), connection.cursor() as cursor:
+        create_partition(cursor, partition_start(name))
+        with gzip.open(archive_path(name), "rb") as f:
+            cursor.copy_expert(f'COPY "{name}" FROM STDIN WITH (FORMAT csv, HEADER)', f)
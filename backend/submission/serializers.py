@@ -16,11 +16,19 @@ class ShareSubmissionSerializer(serializers.Serializer):
     shared = serializers.BooleanField()
 
 
+class CreateRejudgeJobSerializer(serializers.Serializer):
+    problem_id = serializers.IntegerField(required=False)
+    contest_id = serializers.IntegerField(required=False)
+    result = serializers.IntegerField(required=False)
+    start_time = serializers.DateTimeField(required=False)
+    end_time = serializers.DateTimeField(required=False)
+
+
 class SubmissionModelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Submission
-        fields = "__all__"
+        exclude = ("blob_stored",)
 
 
 # 不显示submission info的serializer, 用于ACM rule_type
@@ -29,23 +37,33 @@ class SubmissionSafeModelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Submission
-        exclude = ("info", "contest", "ip")
+        exclude = ("info", "contest", "ip", "blob_stored")
 
 
 class SubmissionListSerializer(serializers.ModelSerializer):
     problem = serializers.SlugRelatedField(read_only=True, slug_field="_id")
     show_link = serializers.SerializerMethodField()
 
+    # 序列化和 check_user_permission 用到的字段，查询时使用 only(*projection)
+    projection = ("id", "create_time", "user_id", "username", "result", "language", "shared", "statistic_info",
+                  "problem", "problem___id", "problem__created_by", "problem__share_submission",
+                  "contest", "contest__start_time", "contest__end_time")
+
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop("user", None)
         super().__init__(*args, **kwargs)
+        # 与提交无关的权限对整页只判断一次
+        if self.user is None or not self.user.is_authenticated:
+            self.show_all_links = None
+        else:
+            self.show_all_links = self.user.is_super_admin() or self.user.can_mgmt_all_problem()
 
     class Meta:
         model = Submission
-        exclude = ("info", "contest", "code", "ip")
+        exclude = ("info", "contest", "code", "ip", "blob_stored")
 
     def get_show_link(self, obj):
         # 没传user或为匿名user
-        if self.user is None or not self.user.is_authenticated:
+        if self.show_all_links is None:
             return False
-        return obj.check_user_permission(self.user)
+        return self.show_all_links or obj.check_user_permission(self.user)
@@ -1,9 +1,40 @@
+import asyncio
+import base64
+import datetime
+import hashlib
+import io
+import json
+import tempfile
 from copy import deepcopy
-from unittest import mock
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-from problem.models import Problem, ProblemTag
+from django.conf import settings
+from django.core import signing
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from account.models import AdminType, User
+from contest.models import ACMContestRank, Contest
+from judge.cache import get_judge_problem, get_judge_user, invalidate_judge_problems
+from judge.dispatcher import JudgeDispatcher
+from judge.rejudge import RejudgeJobStatus, rebuild_contest_rank, rebuild_user_problem_status, run_rejudge_batch
+from judge.tasks import _get_dispatcher, _get_dispatchers
+from problem.models import Problem, ProblemTag, UserProblemStatus
+from problem.utils import get_user_problems_status
 from utils.api.tests import APITestCase
-from .models import Submission
+from utils.blob_store import get_blob
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from utils import throttling
+from utils.events import EVENT_TOKEN_SALT, EventStreamApplication, get_channel, publish_event
+from utils.throttling import TokenBucket, consume_buckets
+from . import partitions
+from .models import JudgeStatus, Submission
+from .serializers import SubmissionListSerializer
+from .views.oj import get_list_queryset
 
 DEFAULT_PROBLEM_DATA = {"_id": "A-110", "title": "test", "description": "<p>test</p>", "input_description": "test",
                         "output_description": "test", "time_limit": 1000, "memory_limit": 256, "difficulty": "Low",
@@ -56,6 +87,43 @@ class SubmissionListTest(SubmissionPrepare):
         resp = self.client.get(self.url, data={"limit": "10"})
         self.assertSuccess(resp)
 
+    def test_list_projection(self):
+        user = User.objects.get(username="123")
+        with self.assertNumQueries(1):
+            submissions = list(get_list_queryset())
+            data = SubmissionListSerializer(submissions, many=True, user=user).data
+        self.assertEqual(data[0]["problem"], self.problem._id)
+        self.assertFalse(data[0]["show_link"])
+        self.assertTrue({"code", "info"} <= submissions[0].get_deferred_fields())
+
+    def test_cursor_pagination(self):
+        User.objects.filter(username="123").update(is_approved=True)
+        for _ in range(2):
+            Submission.objects.create(**self.submission_data)
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": ""})
+        self.assertSuccess(resp)
+        first_page = resp.data["data"]
+        self.assertEqual(len(first_page["results"]), 2)
+        self.assertEqual(first_page["total"], 3)
+
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": first_page["next_cursor"]})
+        second_page = resp.data["data"]
+        self.assertEqual(len(second_page["results"]), 1)
+        self.assertIsNone(second_page["next_cursor"])
+        ids = [item["id"] for item in first_page["results"] + second_page["results"]]
+        self.assertEqual(sorted(ids), sorted(Submission.objects.values_list("id", flat=True)))
+
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": "invalid"})
+        self.assertFailed(resp, "Invalid cursor")
+        for values in [[{"a": 1}, 1], [None, 1], [[], "id"]]:
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("utf-8")
+            resp = self.client.get(self.url, data={"limit": "2", "cursor": cursor})
+            self.assertFailed(resp, "Invalid cursor")
+
+        # limit 不合法时使用默认值
+        resp = self.client.get(self.url, data={"limit": "0", "cursor": ""})
+        self.assertEqual(len(resp.data["data"]["results"]), 3)
+
 
 @mock.patch("submission.views.oj.judge_task.send")
 class SubmissionAPITest(SubmissionPrepare):
@@ -76,3 +144,395 @@ class SubmissionAPITest(SubmissionPrepare):
         self.assertDictEqual(resp.data, {"error": "error",
                                          "data": "Python3 is now allowed in the problem"})
         judge_task.assert_not_called()
+
+    def test_throttling_buckets(self, judge_task):
+        config = {"capacity": 1, "fill_rate": 0.01, "default_capacity": 1}
+        cache.delete(f"{CacheKey.throttling}:ip:127.0.0.1")
+        throttling._denied.clear()
+        options = mock.Mock(throttling={"user": config, "ip": dict(config, enabled=True)})
+        with mock.patch("submission.views.oj.SysOptions", options):
+            self.assertSuccess(self.client.post(self.url, self.submission_data))
+            resp = self.client.post(self.url, self.submission_data)
+        self.assertFailed(resp)
+        self.assertTrue(resp.data["data"].startswith("Please wait"))
+        # 用户和 ip 的 bucket 都不足，都记录在本进程的拒绝缓存中
+        self.assertIn(f"{CacheKey.throttling}:user:{self.user.id}", throttling._denied)
+        self.assertIn(f"{CacheKey.throttling}:ip:127.0.0.1", throttling._denied)
+        judge_task.assert_called_once()
+
+
+class ThrottlingTest(APITestCase):
+    def setUp(self):
+        self.user_bucket = TokenBucket(key="throttling:test:user", capacity=2, fill_rate=0.01,
+                                       default_capacity=2, redis_conn=cache)
+        self.ip_bucket = TokenBucket(key="throttling:test:ip", capacity=10, fill_rate=0.01,
+                                     default_capacity=10, redis_conn=cache)
+        cache.delete_many([self.user_bucket.key, self.ip_bucket.key])
+        throttling._denied.clear()
+
+    def test_consume_all_or_nothing(self):
+        self.assertTrue(consume_buckets([self.user_bucket, self.ip_bucket])[0])
+        self.assertTrue(consume_buckets([self.user_bucket, self.ip_bucket])[0])
+        can_consume, wait = consume_buckets([self.user_bucket, self.ip_bucket], local_check=False)
+        self.assertFalse(can_consume)
+        self.assertGreater(wait, 0)
+        # 用户的 bucket 不足时不消耗共用的 ip bucket
+        self.assertAlmostEqual(float(cache.hget(self.ip_bucket.key, "last_capacity")), 8, places=2)
+
+    def test_local_check(self):
+        self.user_bucket.consume(2)
+        self.assertFalse(self.user_bucket.consume()[0])
+        self.assertIn(self.user_bucket.key, throttling._denied)
+        self.assertNotIn(self.ip_bucket.key, throttling._denied)
+        with mock.patch.object(cache, "register_script") as register_script:
+            throttling._scripts.clear()
+            self.assertFalse(self.user_bucket.consume()[0])
+            register_script.return_value.assert_not_called()
+        throttling._scripts.clear()
+
+
+class JudgeBatchTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.other = Submission.objects.create(**self.submission_data)
+
+    def test_share_problem_data(self):
+        dispatchers = _get_dispatchers([{"submission_id": self.submission.id, "problem_id": self.problem.id},
+                                        {"submission_id": self.other.id, "problem_id": self.problem.id}])
+        self.assertEqual(len(dispatchers), 2)
+        self.assertIs(dispatchers[0][0].problem, dispatchers[1][0].problem)
+        self.assertIs(dispatchers[0][0].problem_data, dispatchers[1][0].problem_data)
+
+    def test_skip_missing_submission(self):
+        dispatchers = _get_dispatchers([{"submission_id": "not_exist", "problem_id": self.problem.id}])
+        self.assertEqual(dispatchers, [])
+
+
+class JudgeCacheTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        Submission.objects.filter(id=self.submission.id).update(user_id=User.objects.get(username="test").id)
+        invalidate_judge_problems([self.problem.id])
+
+    def test_problem_cache(self):
+        get_judge_problem(self.problem.id)
+        with self.assertNumQueries(0):
+            problem = get_judge_problem(self.problem.id)
+        self.assertEqual(problem.test_case_id, self.problem.test_case_id)
+        invalidate_judge_problems([self.problem.id])
+        with self.assertNumQueries(1):
+            get_judge_problem(self.problem.id)
+
+    @mock.patch("judge.dispatcher.SysOptions")
+    def test_get_dispatcher(self, options):
+        options.judge_server_token = "token"
+        get_judge_problem(self.problem.id)
+        # 提交和提交者在同一条查询中取出，题目来自缓存
+        with self.assertNumQueries(1):
+            dispatcher = _get_dispatcher(self.submission.id, self.problem.id)
+        self.assertEqual(get_judge_user(dispatcher.submission).admin_type, AdminType.ADMIN)
+
+
+class BlobStoreTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+
+    def get_raw(self, submission_id):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT code, CAST(info AS text) FROM submission WHERE id = %s", [submission_id])
+            code, info = cursor.fetchone()
+            return code, json.loads(info)
+
+    def test_dedup(self):
+        other = Submission.objects.create(**self.submission_data)
+        code_ref, info_ref = self.get_raw(self.submission.id)
+        self.assertEqual(self.get_raw(other.id), (code_ref, info_ref))
+        self.assertEqual(code_ref, "sha256:" + hashlib.sha256(self.submission_data["code"].encode("utf-8")).hexdigest())
+        submission = Submission.objects.get(id=other.id)
+        self.assertEqual(submission.code, self.submission_data["code"])
+        self.assertEqual(submission.info, {})
+
+    def test_migrate_inline_data(self):
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE submission SET code = %s, info = %s, blob_stored = false WHERE id = %s",
+                           ["inline code", json.dumps({"err": None}), self.submission.id])
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.code, submission.info), ("inline code", {"err": None}))
+        call_command("migrate_submission_blobs", stdout=io.StringIO())
+        self.assertTrue(all(value.startswith("sha256:") for value in self.get_raw(self.submission.id)))
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.code, submission.info), ("inline code", {"err": None}))
+
+    def test_code_looks_like_blob_ref(self):
+        code = "sha256:" + "0" * 64
+        submission = Submission.objects.create(**dict(self.submission_data, code=code))
+        self.assertNotEqual(self.get_raw(submission.id)[0], code)
+        self.assertEqual(Submission.objects.get(id=submission.id).code, code)
+
+    def test_update_inline_data(self):
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE submission SET code = %s, blob_stored = false WHERE id = %s",
+                           ["inline code", self.submission.id])
+        submission = Submission.objects.get(id=self.submission.id)
+        submission.info = {"err": None}
+        submission.save(update_fields=["info"])
+        self.assertTrue(all(value.startswith("sha256:") for value in self.get_raw(self.submission.id)))
+        submission = Submission.objects.only("id").get(id=self.submission.id)
+        self.assertEqual((submission.code, submission.info), ("inline code", {"err": None}))
+
+    def test_invalid_digest(self):
+        with self.assertRaises(ValueError):
+            get_blob("sha256:/" + "0" * 63)
+
+
+class PartitionTest(SubmissionPrepare):
+    def test_month_range(self):
+        start = partitions.month_start(datetime.datetime(2023, 12, 31, 23, 59, tzinfo=datetime.timezone.utc))
+        self.assertEqual(start, datetime.datetime(2023, 12, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(partitions.next_month(start), datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+
+    def test_partition_name(self):
+        start = datetime.datetime(2024, 3, 1, tzinfo=datetime.timezone.utc)
+        self.assertEqual(partitions.partition_name(start), "submission_y2024m03")
+        self.assertEqual(partitions.partition_start("submission_y2024m03"), start)
+        self.assertIsNone(partitions.partition_start(partitions.DEFAULT_PARTITION))
+
+    @skipUnless(connection.vendor == "postgresql", "Submission partitioning requires PostgreSQL")
+    def test_convert_and_archive(self):
+        self._create_problem_and_submission()
+        old = Submission.objects.create(**self.submission_data)
+        Submission.objects.filter(id=old.id).update(create_time=datetime.datetime(2023, 5, 10, tzinfo=datetime.timezone.utc))
+        # 测试在一个事务中执行，先检查掉 setUp 中插入的行的外键
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        copied_counts = []
+
+        def progress(copied):
+            copied_counts.append(copied)
+            # 已经复制的行在转换期间被修改
+            Submission.objects.filter(id=old.id).update(result=JudgeStatus.ACCEPTED)
+
+        partitions.convert(1, batch_size=3, progress=progress)
+        self.assertEqual(copied_counts, [2])
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(Submission.objects.count(), 2)
+        self.assertEqual(Submission.objects.get(id=old.id).result, JudgeStatus.ACCEPTED)
+
+        name = "submission_y2023m05"
+        self.assertIn(name, partitions.list_partitions())
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(SUBMISSION_ARCHIVE_DIR=archive_dir):
+            partitions.archive_partition(name)
+            self.assertNotIn(name, partitions.list_partitions())
+            self.assertFalse(Submission.objects.filter(id=old.id).exists())
+            partitions.restore_partition(name)
+        self.assertEqual(Submission.objects.get(id=old.id).code, old.code)
+        self.assertEqual(Submission.objects.count(), 2)
+
+
+class RejudgeJobTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.user = User.objects.get(username="test")
+        self.user.admin_type = AdminType.SUPER_ADMIN
+        self.user.save()
+        self.client.login(username="test", password="test123")
+        Submission.objects.filter(id=self.submission.id).update(user_id=self.user.id, result=JudgeStatus.ACCEPTED,
+                                                                info={"err": None, "data": []})
+        UserProblemStatus.objects.create(user=self.user, problem=self.problem, status=JudgeStatus.ACCEPTED)
+        self.user.userprofile.accepted_number = 1
+        self.user.userprofile.save()
+        self.url = self.reverse("rejudge_job_api")
+        cache.delete(CacheKey.waiting_queue)
+
+    def judge(self, tasks):
+        Submission.objects.filter(id__in=[task["submission_id"] for task in tasks]) \
+            .update(result=JudgeStatus.WRONG_ANSWER)
+        return 0
+
+    @mock.patch("judge.tasks.rejudge_task.send")
+    def create_job(self, send):
+        resp = self.client.post(self.url, {"problem_id": self.problem.id})
+        self.assertSuccess(resp)
+        send.assert_called_once()
+        return resp.data["data"]
+
+    @mock.patch("judge.rejudge.release_slot")
+    @mock.patch("judge.rejudge.acquire_slot")
+    def test_rejudge(self, acquire_slot, release_slot):
+        job = self.create_job()
+        self.assertEqual(job["total"], 1)
+
+        acquire_slot.side_effect = [("judge", "http://judge", "token"), None]
+        self.assertEqual(run_rejudge_batch(job["id"], self.judge), 0)
+        status = UserProblemStatus.objects.get(user=self.user, problem=self.problem)
+        self.assertEqual(status.status, JudgeStatus.WRONG_ANSWER)
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual(self.user.userprofile.accepted_number, 0)
+
+        acquire_slot.side_effect = [("judge", "http://judge", "token"), None]
+        self.assertIsNone(run_rejudge_batch(job["id"], self.judge))
+        # 每一批结束后都会释放租用的槽位
+        self.assertEqual(release_slot.call_count, 2)
+        job = self.client.get(self.url, {"id": job["id"]}).data["data"]
+        self.assertEqual((job["status"], job["done"]), (RejudgeJobStatus.FINISHED, 1))
+
+    @mock.patch("judge.rejudge.release_slot")
+    @mock.patch("judge.rejudge.acquire_slot")
+    def test_recover_after_error(self, acquire_slot, release_slot):
+        job = self.create_job()
+        acquire_slot.side_effect = [("judge", "http://judge", "token"), None]
+        with self.assertRaises(RuntimeError):
+            run_rejudge_batch(job["id"], mock.Mock(side_effect=RuntimeError))
+        release_slot.assert_called_once()
+
+        acquire_slot.side_effect = [("judge", "http://judge", "token"), None]
+        self.assertEqual(run_rejudge_batch(job["id"], self.judge), 0)
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.WRONG_ANSWER)
+        self.assertEqual(self.client.get(self.url, {"id": job["id"]}).data["data"]["done"], 1)
+
+    def test_backoff_and_cancel(self):
+        job = self.create_job()
+        cache.lpush(CacheKey.waiting_queue, "{}")
+        self.assertEqual(run_rejudge_batch(job["id"], self.judge), settings.REJUDGE_BACKOFF)
+
+        resp = self.client.delete(self.url + "?id=" + job["id"])
+        self.assertEqual(resp.data["data"]["status"], RejudgeJobStatus.CANCELLED)
+        self.assertIsNone(run_rejudge_batch(job["id"], self.judge))
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.ACCEPTED)
+
+    def test_rebuild_contest_rank(self):
+        now = timezone.now()
+        contest = Contest.objects.create(created_by=self.user, title="test", description="test", real_time_rank=True,
+                                         rule_type=ContestRuleType.ACM, start_time=now - timedelta(hours=1),
+                                         end_time=now + timedelta(hours=1))
+        user = self.create_user("contest", "test123", login=False)
+        Submission.objects.filter(id=self.submission.id).update(contest=contest, user_id=user.id,
+                                                                result=JudgeStatus.ACCEPTED)
+        key = str(self.problem.id)
+        ACMContestRank.objects.create(user=user, contest=contest, accepted_number=1, submission_number=1,
+                                      submission_info={key: {"is_ac": True, "ac_time": 0, "error_number": 0,
+                                                             "is_first_ac": True, "checked": True}})
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.WRONG_ANSWER)
+        Submission.objects.create(**dict(self.submission_data, user_id=user.id, contest=contest,
+                                         result=JudgeStatus.ACCEPTED))
+        rebuild_contest_rank(contest, {user.id})
+        rank = ACMContestRank.objects.get(user=user, contest=contest)
+        self.assertEqual((rank.submission_number, rank.accepted_number), (2, 1))
+        # 重建排名时保留管理员设置的 checked 标记
+        self.assertEqual(rank.submission_info[key]["error_number"], 1)
+        self.assertTrue(rank.submission_info[key]["checked"])
+
+    def test_oi_contest_status_uses_last_score(self):
+        now = timezone.now()
+        contest = Contest.objects.create(created_by=self.user, title="test", description="test", real_time_rank=True,
+                                         rule_type=ContestRuleType.OI, start_time=now - timedelta(hours=1),
+                                         end_time=now + timedelta(hours=1))
+        user = self.create_user("contest", "test123", login=False)
+        Submission.objects.filter(id=self.submission.id).update(contest=contest, user_id=user.id,
+                                                                statistic_info={"score": 100})
+        Submission.objects.create(**dict(self.submission_data, user_id=user.id, contest=contest,
+                                         result=JudgeStatus.WRONG_ANSWER, statistic_info={"score": 40}))
+        UserProblemStatus.objects.create(user=user, problem=self.problem, contest=contest, status=JudgeStatus.ACCEPTED,
+                                         score=100)
+        rebuild_user_problem_status({(user.id, self.problem.id, contest.id)})
+        # 与判题时一致，OI 比赛中的状态和分数取最后一次提交
+        status = UserProblemStatus.objects.get(user=user, problem=self.problem, contest=contest)
+        self.assertEqual((status.status, status.score), (JudgeStatus.WRONG_ANSWER, 40))
+
+    @mock.patch("judge.dispatcher.add_problem_counters")
+    def test_rejudge_compile_error_counters(self, add_problem_counters):
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.COMPILE_ERROR, info={})
+        dispatcher = JudgeDispatcher(self.submission.id, self.problem.id, rejudge=True)
+        resp = {"err": None, "data": [{"test_case": "1", "result": JudgeStatus.ACCEPTED, "cpu_time": 1, "memory": 1}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatcher._handle_judge_response(resp)
+        # 编译错误在第一次判题时已经计数，重判只把计数从编译错误移到新的结果
+        add_problem_counters.assert_called_once_with(self.problem.id, submission_number=0, accepted_number=1,
+                                                     results={str(JudgeStatus.COMPILE_ERROR): -1,
+                                                              str(JudgeStatus.ACCEPTED): 1})
+
+    @mock.patch("judge.dispatcher.add_problem_counters")
+    def test_rejudge_same_result_counters(self, add_problem_counters):
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.COMPILE_ERROR, info={})
+        dispatcher = JudgeDispatcher(self.submission.id, self.problem.id, rejudge=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatcher._handle_judge_response({"err": "CompileError", "data": "error"})
+        add_problem_counters.assert_not_called()
+
+
+class SubmissionEventAPITest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.url = self.reverse("submission_event_api")
+
+    def test_get_token(self):
+        self.client.login(username="test", password="test123")
+        resp = self.client.get(self.url, data={"id": self.submission.id})
+        self.assertSuccess(resp)
+        token = signing.loads(resp.data["data"]["token"], salt=EVENT_TOKEN_SALT)
+        self.assertEqual(token["channel"], get_channel("submission", self.submission.id))
+
+    def test_no_permission(self):
+        self.create_user("123", "345")
+        resp = self.client.get(self.url, data={"id": self.submission.id})
+        self.assertFailed(resp)
+
+    def test_publish_last_status(self):
+        JudgeDispatcher(self.submission.id, self.problem.id)._set_judging()
+        last = cache.getrange(get_channel("submission", self.submission.id) + ":last", 0, -1)
+        self.assertEqual(json.loads(last)["result"], JudgeStatus.JUDGING)
+
+    def test_shared_subscriber(self):
+        channel = get_channel("submission", self.submission.id)
+
+        async def run():
+            app = EventStreamApplication(None)
+            subscriber = app.get_subscriber()
+            first, second = await subscriber.subscribe(channel), await subscriber.subscribe(channel)
+            # 同一个进程中的客户端共用一个订阅
+            self.assertIs(app.get_subscriber(), subscriber)
+            self.assertEqual(len(subscriber.pubsub.channels), 1)
+            while (await app.get_redis().pubsub_numsub(channel))[0][1] != 1:
+                await asyncio.sleep(0.01)
+            publish_event(channel, {"result": JudgeStatus.JUDGING})
+            for queue in (first, second):
+                self.assertEqual(json.loads(await asyncio.wait_for(queue.get(), timeout=5))["result"],
+                                 JudgeStatus.JUDGING)
+            await subscriber.unsubscribe(channel, first)
+            await subscriber.unsubscribe(channel, second)
+            self.assertEqual(subscriber.queues, {})
+            await subscriber.task
+            await subscriber.pubsub.aclose()
+            await app.get_redis().aclose()
+
+        asyncio.run(run())
+
+
+class UserProblemStatusTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        # postgres 中测试之间不会重置自增 id，不能假设用户的 id 是 1
+        self.user = User.objects.get(username="test")
+        self.submission_data["user_id"] = self.user.id
+
+    def judge(self, result):
+        submission = Submission.objects.create(**self.submission_data)
+        submission.result = result
+        submission.save()
+        JudgeDispatcher(submission.id, self.problem.id).update_problem_status()
+
+    def test_update_problem_status(self):
+        self.judge(JudgeStatus.WRONG_ANSWER)
+        self.judge(JudgeStatus.ACCEPTED)
+        # AC 之后的提交不再改变题目状态
+        self.judge(JudgeStatus.WRONG_ANSWER)
+        status = UserProblemStatus.objects.get(user=self.user, problem=self.problem)
+        self.assertEqual(status.status, JudgeStatus.ACCEPTED)
+        profile = status.user.userprofile
+        self.assertEqual(profile.submission_number, 3)
+        self.assertEqual(profile.accepted_number, 1)
+
+        acm_problems_status, _ = get_user_problems_status(self.user.id)
+        self.assertEqual(acm_problems_status["problems"][str(self.problem.id)],
+                         {"status": JudgeStatus.ACCEPTED, "_id": self.problem._id})
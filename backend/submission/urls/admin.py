@@ -1,7 +1,8 @@
 from django.conf.urls import url
 
-from ..views.admin import SubmissionRejudgeAPI
+from ..views.admin import RejudgeJobAPI, SubmissionRejudgeAPI
 
 urlpatterns = [
     url(r"^submission/rejudge?$", SubmissionRejudgeAPI.as_view(), name="submission_rejudge_api"),
+    url(r"^submission/rejudge/job/?$", RejudgeJobAPI.as_view(), name="rejudge_job_api"),
 ]
@@ -1,8 +1,12 @@
+import dateutil.parser
+
 from account.decorators import super_admin_required
+from judge.rejudge import cancel_rejudge_job, create_rejudge_job, get_rejudge_job, list_rejudge_jobs
 from judge.tasks import judge_task
 # from judge.dispatcher import JudgeDispatcher
-from utils.api import APIView
+from utils.api import APIView, validate_serializer
 from ..models import Submission
+from ..serializers import CreateRejudgeJobSerializer
 
 
 class SubmissionRejudgeAPI(APIView):
@@ -20,3 +24,37 @@ class SubmissionRejudgeAPI(APIView):
 
         judge_task.send(submission.id, submission.problem.id)
         return self.success()
+
+
+class RejudgeJobAPI(APIView):
+    @super_admin_required
+    @validate_serializer(CreateRejudgeJobSerializer)
+    def post(self, request):
+        """
+        按题目、比赛、结果和提交时间批量重判
+        """
+        data = request.data
+        if not data.get("problem_id") and not data.get("contest_id"):
+            return self.error("Parameter error, problem_id or contest_id is required")
+        for field in ("start_time", "end_time"):
+            if data.get(field):
+                data[field] = dateutil.parser.parse(data[field])
+        return self.success(create_rejudge_job(request.user, **data))
+
+    @super_admin_required
+    def get(self, request):
+        job_id = request.GET.get("id")
+        if not job_id:
+            return self.success(list_rejudge_jobs())
+        job = get_rejudge_job(job_id)
+        if not job:
+            return self.error("Rejudge job does not exist")
+        return self.success(job)
+
+    @super_admin_required
+    def delete(self, request):
+        job_id = request.GET.get("id")
+        if not job_id or not get_rejudge_job(job_id):
+            return self.error("Rejudge job does not exist")
+        cancel_rejudge_job(job_id)
+        return self.success(get_rejudge_job(job_id))
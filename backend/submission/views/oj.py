@@ -9,31 +9,44 @@ from problem.models import Problem, ProblemRuleType
 from utils.api import APIView, validate_serializer
 from utils.cache import cache
 from utils.captcha import Captcha
-from utils.throttling import TokenBucket
+from utils.events import STREAM_PATH, create_event_token, get_channel
+from utils.constants import CacheKey
+from utils.throttling import TokenBucket, consume_buckets
 from ..models import Submission
 from ..serializers import (CreateSubmissionSerializer, SubmissionModelSerializer,
                            ShareSubmissionSerializer)
 from ..serializers import SubmissionSafeModelSerializer, SubmissionListSerializer
 
 
+def get_list_queryset():
+    """
+    提交列表只读取列表和权限检查需要的列，不读取 code 和 info
+    """
+    return Submission.objects.select_related("problem", "contest").only(*SubmissionListSerializer.projection)
+
+
 class SubmissionAPI(APIView):
     def throttling(self, request):
         # 使用 open_api 的请求暂不做限制
         auth_method = getattr(request, "auth_method", "")
         if auth_method == "api_key":
             return
-        user_bucket = TokenBucket(key=str(request.user.id),
-                                  redis_conn=cache, **SysOptions.throttling["user"])
-        can_consume, wait = user_bucket.consume()
+        config = SysOptions.throttling
+        buckets = [TokenBucket(key=f"{CacheKey.throttling}:user:{request.user.id}",
+                               redis_conn=cache, **config["user"])]
+        # 比赛中的限制单独配置，同一个用户在不同比赛中互不影响
+        contest_id = request.data.get("contest_id")
+        if contest_id and config.get("contest"):
+            buckets.append(TokenBucket(key=f"{CacheKey.throttling}:contest:{contest_id}:{request.user.id}",
+                                       redis_conn=cache, **config["contest"]))
+        ip_config = dict(config.get("ip", {}))
+        if ip_config.pop("enabled", False):
+            buckets.append(TokenBucket(key=f"{CacheKey.throttling}:ip:{request.session['ip']}",
+                                       redis_conn=cache, **ip_config))
+        can_consume, wait = consume_buckets(buckets)
         if not can_consume:
             return "Please wait %d seconds" % (int(wait))
 
-        # ip_bucket = TokenBucket(key=request.session["ip"],
-        #                         redis_conn=cache, **SysOptions.throttling["ip"])
-        # can_consume, wait = ip_bucket.consume()
-        # if not can_consume:
-        #     return "Captcha is required"
-
     @check_contest_permission(check_type="problems")
     def check_contest_permission(self, request):
         contest = self.contest
@@ -137,6 +150,29 @@ class SubmissionAPI(APIView):
         return self.success()
 
 
+class SubmissionEventAPI(APIView):
+    @login_required
+    def get(self, request):
+        """
+        获取订阅提交状态推送的 token，判题状态变化时推送，代替轮询 SubmissionAPI
+        """
+        user = request.user
+        if not user.is_approved and not user.is_admin_role():
+            return self.error("Your account is not approved yet. Please wait for admin approval.")
+
+        submission_id = request.GET.get("id")
+        if not submission_id:
+            return self.error("Parameter id doesn't exist")
+        try:
+            submission = Submission.objects.select_related("problem").get(id=submission_id)
+        except Submission.DoesNotExist:
+            return self.error("Submission doesn't exist")
+        if not submission.check_user_permission(request.user):
+            return self.error("No permission for this submission")
+        token = create_event_token(get_channel("submission", submission.id))
+        return self.success({"token": token, "url": f"{STREAM_PATH}?token={token}"})
+
+
 class SubmissionListAPI(APIView):
     @login_required
     def get(self, request):
@@ -149,7 +185,7 @@ class SubmissionListAPI(APIView):
         if request.GET.get("contest_id"):
             return self.error("Parameter error")
 
-        submissions = Submission.objects.filter(contest_id__isnull=True).select_related("problem__created_by")
+        submissions = get_list_queryset().filter(contest_id__isnull=True)
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -166,7 +202,11 @@ class SubmissionListAPI(APIView):
             submissions = submissions.filter(username__icontains=username)
         if result:
             submissions = submissions.filter(result=result)
-        data = self.paginate_data(request, submissions)
+        # 传 cursor 参数时使用 keyset 分页，不传时保持原来的 offset 分页
+        if "cursor" in request.GET:
+            data = self.paginate_data_by_cursor(request, submissions, ("-create_time", "-id"))
+        else:
+            data = self.paginate_data(request, submissions)
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
         return self.success(data)
 
@@ -178,7 +218,7 @@ class ContestSubmissionListAPI(APIView):
             return self.error("Limit is needed")
 
         contest = self.contest
-        submissions = Submission.objects.filter(contest_id=contest.id).select_related("problem__created_by")
+        submissions = get_list_queryset().filter(contest_id=contest.id)
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -206,7 +246,11 @@ class ContestSubmissionListAPI(APIView):
             if not contest.real_time_rank and not request.user.is_contest_admin(contest):
                 submissions = submissions.filter(user_id=request.user.id)
 
-        data = self.paginate_data(request, submissions)
+        # 传 cursor 参数时使用 keyset 分页，不传时保持原来的 offset 分页
+        if "cursor" in request.GET:
+            data = self.paginate_data_by_cursor(request, submissions, ("-create_time", "-id"))
+        else:
+            data = self.paginate_data(request, submissions)
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
         return self.success(data)
 
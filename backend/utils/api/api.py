@@ -1,14 +1,24 @@
+import base64
+import datetime
 import functools
+import hashlib
 import json
 import logging
 
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db.models import Q
 from django.http import HttpResponse, QueryDict
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+from utils.cache import cache
+from utils.constants import CacheKey
+
 logger = logging.getLogger("")
 
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+
 
 class APIError(Exception):
     def __init__(self, msg, err=None):
@@ -50,6 +60,59 @@ class JSONResponse(object):
         return resp
 
 
+def _encode_cursor(obj, ordering):
+    values = [getattr(obj, field.lstrip("-")) for field in ordering]
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("utf-8")
+
+
+def _decode_cursor(cursor, ordering):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except (ValueError, TypeError):
+        raise APIError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise APIError("Invalid cursor")
+    # 只接受 _encode_cursor 生成的标量值，null 和嵌套的 list/dict 都不能用于比较
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values):
+        raise APIError("Invalid cursor")
+    return values
+
+
+def _cursor_filter(model, ordering, values):
+    """
+    (a, b) 在 (x, y) 之后等价于 a > x or (a = x and b > y)，降序字段使用 <
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        try:
+            value = model._meta.get_field(name).to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise APIError("Invalid cursor")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= Q(**equal, **{f"{name}__{lookup}": value})
+        equal[name] = value
+    return condition
+
+
+def _get_cached_count(query_set):
+    """
+    翻页时总数不需要精确，同一个查询的 count 缓存一小段时间
+    """
+    try:
+        sql = str(query_set.order_by().query)
+    except EmptyResultSet:
+        return 0
+    key = f"{CacheKey.pagination_count}:{hashlib.md5(sql.encode('utf-8')).hexdigest()}"
+    count = cache.get(key)
+    if count is None:
+        count = query_set.count()
+        cache.set(key, count, timeout=PAGINATION_COUNT_CACHE_TIMEOUT)
+    return count
+
+
 class APIView(View):
     """
     Django view的父类, 和django-rest-framework的用法基本一致
@@ -110,6 +173,16 @@ class APIView(View):
     def server_error(self):
         return self.error(err="server-error", msg="server error")
 
+    @staticmethod
+    def _get_limit(request, minimum=0):
+        try:
+            limit = int(request.GET.get("limit", "10"))
+        except ValueError:
+            limit = 10
+        if limit < minimum or limit > 250:
+            limit = 10
+        return limit
+
     def paginate_data(self, request, query_set, object_serializer=None):
         """
         :param request: django的request
@@ -117,12 +190,7 @@ class APIView(View):
         :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
         :return:
         """
-        try:
-            limit = int(request.GET.get("limit", "10"))
-        except ValueError:
-            limit = 10
-        if limit < 0 or limit > 250:
-            limit = 10
+        limit = self._get_limit(request)
         try:
             offset = int(request.GET.get("offset", "0"))
         except ValueError:
@@ -139,6 +207,30 @@ class APIView(View):
                 "total": count}
         return data
 
+    def paginate_data_by_cursor(self, request, query_set, ordering, object_serializer=None):
+        """
+        按 ordering 中的字段做 keyset 分页，每一页只需要一次索引范围扫描
+        第一页传空的 cursor，之后传上一页返回的 next_cursor，没有下一页时 next_cursor 为 None
+        total 是缓存的近似值，传 count=0 时不计算
+        :param ordering: 唯一确定顺序的字段，例如 ("-create_time", "-id")
+        """
+        # 空的一页无法生成 next_cursor，limit=0 时使用默认值
+        limit = self._get_limit(request, minimum=1)
+        cursor = request.GET.get("cursor")
+        page = query_set.order_by(*ordering)
+        if cursor:
+            page = page.filter(_cursor_filter(query_set.model, ordering, _decode_cursor(cursor, ordering)))
+        results = list(page[:limit + 1])
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = _encode_cursor(results[-1], ordering)
+        data = {"results": object_serializer(results, many=True).data if object_serializer else results,
+                "next_cursor": next_cursor}
+        if request.GET.get("count") != "0":
+            data["total"] = _get_cached_count(query_set)
+        return data
+
     def dispatch(self, request, *args, **kwargs):
         if self.request_parsers:
             try:
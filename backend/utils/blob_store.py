@@ -0,0 +1,157 @@
+import hashlib
+import os
+import re
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+BLOB_REF_PREFIX = "sha256:"
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def get_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def check_digest(digest):
+    # digest 会拼接到文件路径和对象名中
+    if not isinstance(digest, str) or not DIGEST_RE.fullmatch(digest):
+        raise ValueError(f"Invalid blob digest: {digest!r}")
+    return digest
+
+
+class BlobStore(object):
+    """
+    按内容的 sha256 保存数据，相同内容只保存一份，保存前用 zlib 压缩
+    子类只需要实现压缩后数据的 _exists, _write, _read 和 delete
+    """
+    def _exists(self, digest):
+        raise NotImplementedError()
+
+    def _write(self, digest, data):
+        raise NotImplementedError()
+
+    def _read(self, digest):
+        raise NotImplementedError()
+
+    def delete(self, digest):
+        raise NotImplementedError()
+
+    def put(self, data):
+        """
+        :return: 内容的 sha256
+        """
+        digest = get_digest(data)
+        if not self._exists(digest):
+            self._write(digest, zlib.compress(data, settings.BLOB_STORE_COMPRESS_LEVEL))
+        return digest
+
+    def get(self, digest):
+        return zlib.decompress(self._read(digest))
+
+
+class FileSystemBlobStore(BlobStore):
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest):
+        check_digest(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def _write(self, digest, data):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再重命名，并发写入同一内容时不会读到不完整的文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read(self, digest):
+        with open(self._path(digest), "rb") as f:
+            return f.read()
+
+    def delete(self, digest):
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    """
+    兼容 S3 协议的对象存储，例如 minio，需要安装 boto3
+    """
+    def __init__(self, bucket, prefix="", **client_kwargs):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise ImproperlyConfigured("boto3 is required for the s3 blob store")
+        self.client = boto3.client("s3", **client_kwargs)
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, digest):
+        check_digest(digest)
+        return f"{self.prefix}{digest[:2]}/{digest}"
+
+    def _exists(self, digest):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+            return True
+        except self.client_error as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def _write(self, digest, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(digest), Body=data)
+
+    def _read(self, digest):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(digest))["Body"].read()
+
+    def delete(self, digest):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(digest))
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    global _blob_store
+    if _blob_store is None:
+        if settings.BLOB_STORE == "filesystem":
+            _blob_store = FileSystemBlobStore(settings.BLOB_STORE_DIR)
+        elif settings.BLOB_STORE == "s3":
+            _blob_store = S3BlobStore(settings.BLOB_STORE_S3_BUCKET, prefix=settings.BLOB_STORE_S3_PREFIX,
+                                      endpoint_url=settings.BLOB_STORE_S3_ENDPOINT_URL or None,
+                                      aws_access_key_id=settings.BLOB_STORE_S3_ACCESS_KEY or None,
+                                      aws_secret_access_key=settings.BLOB_STORE_S3_SECRET_KEY or None)
+        else:
+            raise ImproperlyConfigured(f"Unknown blob store: {settings.BLOB_STORE}")
+    return _blob_store
+
+
+def put_blob(data):
+    """
+    :return: 保存在数据库中的引用 sha256:<hex>
+    """
+    return BLOB_REF_PREFIX + get_blob_store().put(data)
+
+
+def get_blob(ref):
+    if not isinstance(ref, str) or not ref.startswith(BLOB_REF_PREFIX):
+        raise ValueError(f"Invalid blob reference: {ref!r}")
+    return get_blob_store().get(check_digest(ref[len(BLOB_REF_PREFIX):]))
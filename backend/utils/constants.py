@@ -23,8 +23,26 @@ class ContestRuleType(Choices):
 
 class CacheKey:
     waiting_queue = "waiting_queue"
-    contest_rank_cache = "contest_rank_cache"
+    waiting_queue_metrics = "waiting_queue_metrics"
+    contest_rank_snapshot = "contest_rank_snapshot"
+    event_channel = "event_channel"
+    problem_counter = "problem_counter"
+    problem_counter_dirty = "problem_counter_dirty"
+    problem_counter_flush_scheduled = "problem_counter_flush_scheduled"
+    problem_first_ac = "problem_first_ac"
+    contest_scoreboard = "contest_scoreboard"
     website_config = "website_config"
+    pagination_count = "pagination_count"
+    judge_problem = "judge_problem"
+    options_version = "options_version"
+    options_channel = "options_channel"
+    throttling = "throttling"
+    judge_server_registry = "judge_server_registry"
+    judge_server_lease = "judge_server_lease"
+    judge_server_unhealthy = "judge_server_unhealthy"
+    rejudge_job = "rejudge_job"
+    rejudge_jobs = "rejudge_jobs"
+    test_case_job = "test_case_job"
 
 
 class Difficulty(Choices):
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+import redis.asyncio
+from django.conf import settings
+from django.core import signing
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+STREAM_PATH = "/api/events/stream"
+EVENT_TOKEN_SALT = "events"
+EVENT_TOKEN_MAX_AGE = 3600
+# 频道最后一条消息的保留时间，订阅晚于发布时仍然可以拿到当前状态
+LAST_EVENT_TTL = 600
+HEARTBEAT_INTERVAL = 15
+# 每个客户端最多缓存的消息数，推送不及时的客户端丢弃最早的消息
+CLIENT_QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def get_channel(*args):
+    return ":".join([CacheKey.event_channel] + [str(item) for item in args])
+
+
+def publish_event(channel, data, keep_last=False):
+    message = json.dumps(data)
+    pipe = cache.pipeline()
+    if keep_last:
+        pipe.set(f"{channel}:last", message, ex=LAST_EVENT_TTL)
+    pipe.publish(channel, message)
+    pipe.execute()
+
+
+def create_event_token(channel):
+    """
+    权限在签发 token 的 API 中检查，推送服务只校验签名，不访问数据库
+    """
+    return signing.dumps({"channel": channel}, salt=EVENT_TOKEN_SALT)
+
+
+class EventSubscriber(object):
+    """
+    每个进程只使用一个 redis pub/sub 连接，由一个任务读取消息，按频道分发到各个客户端的队列
+    频道的第一个客户端连接时订阅，最后一个客户端断开时取消订阅
+    """
+    def __init__(self, client):
+        self.pubsub = client.pubsub()
+        # channel -> {asyncio.Queue}
+        self.queues = {}
+        self.task = None
+
+    async def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        queues = self.queues.get(channel)
+        if queues is None:
+            queues = self.queues[channel] = set()
+            queues.add(queue)
+            await self.pubsub.subscribe(channel)
+        else:
+            queues.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    async def unsubscribe(self, channel, queue):
+        queues = self.queues.get(channel)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.queues[channel]
+            await self.pubsub.unsubscribe(channel)
+
+    def dispatch(self, channel, data):
+        for queue in self.queues.get(channel, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    async def run(self):
+        while self.queues:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+            except Exception:
+                # 连接断开时 redis-py 在下一次读取时重新连接并恢复订阅
+                logger.exception("Failed to read events")
+                await asyncio.sleep(1)
+                continue
+            if message:
+                self.dispatch(message["channel"].decode("utf-8"), message["data"])
+
+
+class EventStreamApplication(object):
+    """
+    在 ASGI 入口中处理 STREAM_PATH 的 server-sent events 长连接，把 redis pub/sub 中的消息推送给浏览器
+    其他请求交给 django 处理
+    """
+    def __init__(self, application):
+        self.application = application
+        self.redis = None
+        self.subscriber = None
+
+    def get_redis(self):
+        if self.redis is None:
+            self.redis = redis.asyncio.from_url(settings.CACHES["default"]["LOCATION"])
+        return self.redis
+
+    def get_subscriber(self):
+        if self.subscriber is None:
+            self.subscriber = EventSubscriber(self.get_redis())
+        return self.subscriber
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != STREAM_PATH:
+            return await self.application(scope, receive, send)
+        token = parse_qs(scope["query_string"].decode("latin-1")).get("token", [""])[0]
+        try:
+            channel = signing.loads(token, salt=EVENT_TOKEN_SALT, max_age=EVENT_TOKEN_MAX_AGE)["channel"]
+        except signing.BadSignature:
+            await send({"type": "http.response.start", "status": 403,
+                        "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"Invalid token"})
+            return
+        await self.stream(channel, receive, send)
+
+    async def stream(self, channel, receive, send):
+        disconnected = asyncio.Event()
+
+        async def wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(wait_disconnect())
+        subscriber = self.get_subscriber()
+        queue = await subscriber.subscribe(channel)
+        try:
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"text/event-stream"),
+                                    (b"cache-control", b"no-cache"),
+                                    # 关闭 nginx 的响应缓冲
+                                    (b"x-accel-buffering", b"no")]})
+            last = await self.get_redis().get(f"{channel}:last")
+            if last:
+                await send({"type": "http.response.body", "body": b"data: " + last + b"\n\n", "more_body": True})
+            while not disconnected.is_set():
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+                    body = b"data: " + data + b"\n\n"
+                except asyncio.TimeoutError:
+                    body = b": heartbeat\n\n"
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            watcher.cancel()
+            await subscriber.unsubscribe(channel, queue)
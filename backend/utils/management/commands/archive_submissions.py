@@ -0,0 +1,45 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from submission import partitions
+
+
+class Command(BaseCommand):
+    help = "Move monthly submission partitions older than the given age to gzipped csv files, or restore one of them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--after-months", type=int, default=settings.SUBMISSION_ARCHIVE_AFTER_MONTHS)
+        parser.add_argument("--restore", help="partition name, e.g. submission_y2020m09")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Submission partitioning requires PostgreSQL")
+        if not partitions.is_partitioned():
+            raise CommandError("The submission table is not partitioned, run partition_submissions first")
+
+        if options["restore"]:
+            if not partitions.partition_start(options["restore"]):
+                raise CommandError(f"Invalid partition name: {options['restore']}")
+            partitions.restore_partition(options["restore"])
+            self.stdout.write(self.style.SUCCESS(f"{options['restore']} restored"))
+            return
+
+        # 定时任务每月执行一次时顺便创建之后的分区
+        partitions.ensure_partitions(settings.SUBMISSION_PARTITION_MONTHS_AHEAD)
+        cutoff = partitions.month_start(timezone.now())
+        for _ in range(options["after_months"]):
+            cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+        for name in partitions.list_partitions():
+            if partitions.next_month(partitions.partition_start(name)) > cutoff:
+                break
+            if options["dry_run"]:
+                self.stdout.write(f"{name} would be archived")
+                continue
+            path = partitions.archive_partition(name)
+            self.stdout.write(f"{name} archived to {path}")
+        self.stdout.write(self.style.SUCCESS("Done"))
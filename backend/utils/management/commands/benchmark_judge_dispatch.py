@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from account.models import AdminType, User, UserProfile
+from judge.client import JudgeServerClient
+from judge.languages import languages
+from judge.scheduler import JudgeServerSlot
+from judge.tasks import _judge_concurrently
+from problem.models import Problem, ProblemRuleType
+from submission.models import Submission
+from utils.shortcuts import rand_str
+
+
+class StubJudgeServerHandler(BaseHTTPRequestHandler):
+    # 与 HTTPServer 默认的 HTTP/1.0 不同，保持连接以便测试连接复用
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    delay = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        body = json.dumps({"err": None, "data": [{"test_case": "1", "result": 0, "cpu_time": 1, "memory": 1}]})
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubJudgeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class Command(BaseCommand):
+    help = "Benchmark judge dispatch against a local stub judge server. The concurrent case runs the same code " \
+           "as judge_concurrent_task on temporary submissions, which are deleted afterwards. " \
+           "Run it against a development database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=200)
+        parser.add_argument("--delay", type=float, default=0, help="stub judge time per submission, seconds")
+        parser.add_argument("--concurrency", type=int, default=16, help="judge slots leased by one judge_concurrent_task")
+
+    def seed(self, count):
+        user = User.objects.create(username=f"benchmark-{time.time()}", admin_type=AdminType.REGULAR_USER)
+        UserProfile.objects.create(user=user)
+        problem = Problem.objects.create(_id=f"benchmark-{time.time()}", title="benchmark", description="",
+                                         input_description="", output_description="", samples=[],
+                                         test_case_id="stub", test_case_score=[], languages=["C"], template={},
+                                         created_by=user, time_limit=1000, memory_limit=256, difficulty="Low",
+                                         rule_type=ProblemRuleType.ACM, visible=False)
+        submissions = Submission.objects.bulk_create(
+            [Submission(problem=problem, user_id=user.id, username=user.username, code="int main() { return 0; }",
+                        language=languages[0]["name"]) for _ in range(count)])
+        return problem, [submission.id for submission in submissions]
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        StubJudgeServerHandler.delay = options["delay"]
+        server = StubJudgeServer(("127.0.0.1", 0), StubJudgeServerHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        slot = JudgeServerSlot(hostname="stub", service_url=f"http://127.0.0.1:{server.server_port}", token="")
+        data = {"language_config": languages[0]["config"], "src": "int main() { return 0; }",
+                "max_cpu_time": 1000, "max_memory": 256 * 1024 * 1024, "test_case_id": "stub", "output": False,
+                "spj_version": None, "spj_config": None, "spj_compile_config": None, "spj_src": None,
+                "io_mode": {"io_mode": "Standard IO", "input": "input.txt", "output": "output.txt"}}
+        url = slot.service_url + "/judge"
+
+        def one_connection_per_submission():
+            for _ in range(count):
+                requests.post(url, json=data).json()
+
+        def pooled():
+            client = JudgeServerClient(slot, "token")
+            for _ in range(count):
+                client.post("/judge", data=data)
+
+        def concurrent():
+            # 与 process_pending_task 相同，每次取出 concurrency 个任务，每个任务带一个租用的槽位
+            # 包括读取提交、保存结果和更新计数器等数据库操作，和前两项只发送请求的耗时不能直接比较
+            tasks = [{"submission_id": submission_id, "problem_id": problem.id, "slot": list(slot._replace(token=rand_str()))}
+                     for submission_id in submission_ids]
+            for index in range(0, len(tasks), options["concurrency"]):
+                asyncio.run(_judge_concurrently(tasks[index:index + options["concurrency"]]))
+
+        problem, submission_ids = self.seed(count)
+        try:
+            for name, func in [("one connection per submission", one_connection_per_submission),
+                               ("pooled session", pooled),
+                               ("concurrent dispatch", concurrent)]:
+                start = time.perf_counter()
+                func()
+                cost = time.perf_counter() - start
+                self.stdout.write(f"{name}: {cost:.3f}s total, {cost / count * 1000:.3f}ms per submission")
+        finally:
+            server.shutdown()
+            # 题目和提交随用户一起删除
+            problem.created_by.delete()
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,129 @@
+import datetime
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from account.models import AdminType, User
+from contest.models import Contest, ContestRuleType
+from problem.models import Problem, ProblemRuleType
+from submission.models import JudgeStatus, Submission
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seed synthetic submissions and compare EXPLAIN ANALYZE timings of the submission list queries " \
+           "with the old single-column indexes and with the current indexes. All data is rolled back. " \
+           "Run it against a copy of the database, swapping the indexes locks the submission table " \
+           "until the rollback."
+
+    # 添加联合索引之前 submission 表上的索引
+    legacy_indexes = [models.Index(fields=["contest"], name="bench_submission_contest"),
+                      models.Index(fields=["problem"], name="bench_submission_problem"),
+                      models.Index(fields=["user_id"], name="bench_submission_user_id")]
+
+    def add_arguments(self, parser):
+        parser.add_argument("--submissions", type=int, default=200000)
+        parser.add_argument("--users", type=int, default=5000)
+        parser.add_argument("--problems", type=int, default=500)
+        parser.add_argument("--contests", type=int, default=20)
+        parser.add_argument("--runs", type=int, default=3, help="runs per query, the fastest one is reported")
+
+    def seed(self, options):
+        creator = User.objects.create(username=f"benchmark-{time.time()}", admin_type=AdminType.SUPER_ADMIN)
+        now = time.time()
+        contests = [Contest.objects.create(title=f"benchmark {i}", description="", real_time_rank=True,
+                                           rule_type=ContestRuleType.ACM, created_by=creator,
+                                           start_time=timezone.now(), end_time=timezone.now())
+                    for i in range(options["contests"])]
+        problems = Problem.objects.bulk_create(
+            [Problem(_id=f"benchmark-{now}-{i}", title="benchmark", description="", input_description="",
+                     output_description="", samples=[], test_case_id="", test_case_score=[], languages=["C"],
+                     template={}, created_by=creator, time_limit=1000, memory_limit=256, difficulty="Low",
+                     rule_type=ProblemRuleType.ACM,
+                     contest=random.choice(contests) if contests and i % 5 == 0 else None)
+             for i in range(options["problems"])])
+        results = [JudgeStatus.ACCEPTED, JudgeStatus.WRONG_ANSWER, JudgeStatus.COMPILE_ERROR,
+                   JudgeStatus.CPU_TIME_LIMIT_EXCEEDED, JudgeStatus.RUNTIME_ERROR]
+        # auto_now_add 会覆盖 bulk_create 中的时间，插入时临时关闭，不用再 UPDATE 整张表
+        create_time = Submission._meta.get_field("create_time")
+        create_time.auto_now_add = False
+        try:
+            batch = []
+            for i in range(options["submissions"]):
+                problem = random.choice(problems)
+                user_id = random.randint(1, options["users"])
+                batch.append(Submission(problem=problem, contest_id=problem.contest_id, user_id=user_id,
+                                        username=f"user{user_id}", code="", language="C",
+                                        result=random.choice(results),
+                                        create_time=timezone.now() - datetime.timedelta(days=random.random() * 365)))
+                if len(batch) == 10000:
+                    Submission.objects.bulk_create(batch)
+                    batch = []
+            Submission.objects.bulk_create(batch)
+        finally:
+            create_time.auto_now_add = True
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE submission")
+        return problems, contests
+
+    def get_queries(self, problems, contests, users):
+        public = Submission.objects.filter(contest_id__isnull=True).order_by("-create_time", "-id")
+        middle = public[public.count() // 2]
+        problem = next(item for item in problems if not item.contest_id)
+        user_id = random.randint(1, users)
+        queries = {
+            "public list": public[:20],
+            "public list, deep cursor": public.filter(models.Q(create_time__lt=middle.create_time) |
+                                                      models.Q(create_time=middle.create_time,
+                                                               id__lt=middle.id))[:20],
+            "public list by problem": public.filter(problem=problem)[:20],
+            "public list by user": public.filter(user_id=user_id)[:20],
+            "public list by result": public.filter(result=JudgeStatus.ACCEPTED)[:20],
+            "submission exists": Submission.objects.filter(problem=problem, user_id=user_id)[:1],
+        }
+        if contests:
+            contest = Submission.objects.filter(contest=contests[0]).order_by("-create_time", "-id")
+            queries["contest list"] = contest[:20]
+            queries["contest list by user"] = contest.filter(user_id=user_id)[:20]
+        return queries
+
+    def measure(self, queries, runs):
+        ret = {}
+        for name, query in queries.items():
+            timings = []
+            for _ in range(runs):
+                plan = query.explain(analyze=True)
+                timings.append(float(re.search(r"Execution Time: ([\d.]+) ms", plan).group(1)))
+            ret[name] = min(timings)
+        return ret
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("EXPLAIN ANALYZE requires PostgreSQL")
+        try:
+            with transaction.atomic():
+                self.stdout.write(f"Seeding {options['submissions']} submissions")
+                problems, contests = self.seed(options)
+                queries = self.get_queries(problems, contests, options["users"])
+                after = self.measure(queries, options["runs"])
+                with connection.schema_editor() as schema_editor:
+                    for index in Submission._meta.indexes:
+                        schema_editor.remove_index(Submission, index)
+                    for index in self.legacy_indexes:
+                        schema_editor.add_index(Submission, index)
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE submission")
+                before = self.measure(queries, options["runs"])
+                raise Rollback()
+        except Rollback:
+            pass
+        self.stdout.write(f"{'query':<30}{'before (ms)':>14}{'after (ms)':>14}")
+        for name in queries:
+            self.stdout.write(f"{name:<30}{before[name]:>14.3f}{after[name]:>14.3f}")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from problem.test_case import dedup_test_cases, remove_legacy_test_case_zips
+
+
+class Command(BaseCommand):
+    help = "Replace existing test case files with hard links to deduplicated objects and remove legacy test case zips"
+
+    def handle(self, *args, **options):
+        # 只处理磁盘上的文件，可以重复执行，已经是硬链接的文件会被跳过
+        dedup_test_cases()
+        remove_legacy_test_case_zips()
+        self.stdout.write(self.style.SUCCESS("Done"))
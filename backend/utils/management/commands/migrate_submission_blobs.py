@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from submission.models import Submission
+
+
+class Command(BaseCommand):
+    help = "Move submission code and judge info still stored inline in the submission table to the blob store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # 旧数据的 blob_stored 为 False，读取时原样返回，写回时由 BlobTextField 和 BlobJSONField 保存到 blob store
+        submissions = Submission.objects.filter(blob_stored=False).order_by("id")
+        last_id = ""
+        count = 0
+        while True:
+            rows = list(submissions.filter(id__gt=last_id).values_list("id", "code", "info")[:options["batch"]])
+            if not rows:
+                break
+            for submission_id, code, info in rows:
+                Submission.objects.filter(id=submission_id, blob_stored=False) \
+                    .update(code=code, info=info, blob_stored=True)
+            last_id = rows[-1][0]
+            count += len(rows)
+            self.stdout.write(f"{count} submissions migrated")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from submission import partitions
+
+
+class Command(BaseCommand):
+    help = "Convert the submission table to monthly range partitions on create_time and create upcoming partitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=settings.SUBMISSION_PARTITION_MONTHS_AHEAD)
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Submission partitioning requires PostgreSQL")
+        if not partitions.is_partitioned():
+            self.stdout.write("Converting the submission table, it stays writable until the final switch")
+            partitions.convert(options["months_ahead"], batch_size=options["batch_size"],
+                               progress=lambda copied: self.stdout.write(f"{copied} rows copied"))
+            self.stdout.write("The old table is kept as submission_legacy, drop it after checking the data")
+        partitions.ensure_partitions(options["months_ahead"])
+        self.stdout.write(self.style.SUCCESS(f"{len(partitions.list_partitions())} partitions"))
@@ -1,6 +1,9 @@
+import json
+
 from django.db.models import JSONField  # NOQA
 from django.db import models
 
+from utils.blob_store import get_blob, put_blob
 from utils.xss_filter import XSSHtml
 
 
@@ -8,3 +11,31 @@ class RichTextField(models.TextField):
     def get_prep_value(self, value):
         with XSSHtml() as parser:
             return parser.clean(value or "")
+
+
+class BlobTextField(models.TextField):
+    """
+    写入时内容总是保存到 blob store，数据库中只保存 sha256:<hex>
+    列中的值是引用还是没有迁移的旧数据由模型上单独的标记决定，不根据内容判断，见 Submission.blob_stored
+    """
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return value
+        return put_blob(value.encode("utf-8"))
+
+    def from_blob_ref(self, ref):
+        return get_blob(ref).decode("utf-8")
+
+
+class BlobJSONField(JSONField):
+    """
+    JSON 序列化之后保存在 blob store 中，列的类型仍然是 jsonb，其中只保存 "sha256:<hex>" 字符串
+    """
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return super().get_prep_value(put_blob(json.dumps(value, cls=self.encoder).encode("utf-8")))
+
+    def from_blob_ref(self, ref):
+        return json.loads(get_blob(ref), cls=self.decoder)
@@ -0,0 +1,69 @@
+from django.contrib.postgres.operations import NotInTransactionMixin
+from django.db.migrations.operations.base import Operation
+from django.db.models import Case, IntegerField, Q, Value, When
+
+
+def search(query_set, fields, keyword):
+    """
+    在 fields 中搜索包含 keyword 的记录，完全匹配排在最前，其次是前缀匹配，同一级别内保持原来的顺序
+    postgres 中 icontains 和 istartswith 都可以使用 AddTrigramIndex 创建的索引
+    多个字段时每个字段单独查询后 UNION，跨表的 OR 条件无法使用各自的索引，只能顺序扫描
+    :param fields: 可以包含关联字段，例如 userprofile__real_name
+    """
+    exact, prefix = Q(), Q()
+    for field in fields:
+        exact |= Q(**{f"{field}__iexact": keyword})
+        prefix |= Q(**{f"{field}__istartswith": keyword})
+    if len(fields) == 1:
+        query_set = query_set.filter(**{f"{fields[0]}__icontains": keyword})
+    else:
+        manager = query_set.model._default_manager
+        matched = [manager.filter(**{f"{field}__icontains": keyword}).order_by().values("pk") for field in fields]
+        query_set = query_set.filter(pk__in=matched[0].union(*matched[1:]))
+    ordering = query_set.query.order_by or query_set.model._meta.ordering
+    rank = Case(When(exact, then=Value(2)), When(prefix, then=Value(1)), default=Value(0),
+                output_field=IntegerField())
+    return query_set.annotate(search_rank=rank).order_by("-search_rank", *ordering)
+
+
+class AddTrigramIndex(NotInTransactionMixin, Operation):
+    """
+    在 UPPER(column) 上创建 pg_trgm 的 GIN 索引，和 django 生成的 UPPER("column"::text) LIKE UPPER(...) 相匹配
+    索引使用 CONCURRENTLY 创建，不阻塞写入，所在的 migration 需要设置 atomic = False
+    索引不在 model 的 state 中，其他数据库上什么也不做
+    """
+    reversible = True
+
+    def __init__(self, table, column, name):
+        self.table = table
+        self.column = column
+        self.name = name
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        self._ensure_not_in_transaction(schema_editor)
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # 之前中断的并发创建会留下无效的索引，IF NOT EXISTS 会跳过它，先删除
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+                           "WHERE pg_class.relname = %s AND NOT pg_index.indisvalid", [self.name])
+            if cursor.fetchone():
+                schema_editor.execute(f'DROP INDEX CONCURRENTLY "{self.name}"')
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{self.name}" ON "{self.table}" '
+                              f'USING gin ((UPPER("{self.column}"::text)) gin_trgm_ops)')
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        self._ensure_not_in_transaction(schema_editor)
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{self.name}"')
+
+    def describe(self):
+        return f"Create trigram index {self.name} on {self.table}.{self.column}"
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {"table": self.table, "column": self.column, "name": self.name}
@@ -1,10 +1,109 @@
+import math
+import threading
 import time
 
+# 先对所有 bucket 填充并检查，全部足够时才一起扣除，任何一个不够都不消耗 token
+# ARGV: now, num, 之后每个 bucket 依次为 capacity, fill_rate, default_capacity
+# 成功时返回空列表，失败时返回每个 bucket 需要等待的秒数
+_CONSUME_SCRIPT = """
+local now = tonumber(ARGV[1])
+local num = tonumber(ARGV[2])
+local tokens = {}
+local waits = {}
+local denied = false
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 3
+    local capacity = tonumber(ARGV[base + 1])
+    local fill_rate = tonumber(ARGV[base + 2])
+    local values = redis.call("HMGET", key, "last_capacity", "last_timestamp")
+    local current = tonumber(ARGV[base + 3])
+    if values[1] then
+        local delta = math.max(now - tonumber(values[2]), 0) * fill_rate
+        current = math.min(tonumber(values[1]) + delta, capacity)
+    end
+    tokens[i] = current
+    waits[i] = "0"
+    if current < num then
+        waits[i] = tostring((num - current) / fill_rate)
+        denied = true
+    end
+end
+if denied then
+    return waits
+end
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 3
+    redis.call("HSET", key, "last_capacity", tostring(tokens[i] - num), "last_timestamp", ARGV[1])
+    local fill_rate = tonumber(ARGV[base + 2])
+    if fill_rate > 0 then
+        -- 填满之后的状态和新建的 bucket 相同，过期即可
+        redis.call("EXPIRE", key, math.ceil(tonumber(ARGV[base + 1]) / fill_rate) + 1)
+    end
+end
+return {}
+"""
 
-class TokenBucket:
+# 本进程内已知被限制的 key 和可以重试的时间，在这之前不可能攒够 token，直接拒绝，不再访问 redis
+_denied = {}
+_denied_lock = threading.Lock()
+_DENIED_MAX_SIZE = 10000
+
+_scripts = {}
+
+
+def _get_script(redis_conn):
+    script = _scripts.get(id(redis_conn))
+    if script is None:
+        script = _scripts[id(redis_conn)] = redis_conn.register_script(_CONSUME_SCRIPT)
+    return script
+
+
+def _check_denied(keys, now):
+    wait = 0
+    with _denied_lock:
+        for key in keys:
+            until = _denied.get(key)
+            if until is None:
+                continue
+            if until > now:
+                wait = max(wait, until - now)
+            else:
+                del _denied[key]
+    return wait
+
+
+def _set_denied(items):
+    with _denied_lock:
+        if len(_denied) >= _DENIED_MAX_SIZE:
+            _denied.clear()
+        _denied.update(items)
+
+
+def consume_buckets(buckets, num=1, local_check=True):
     """
-    注意：对于单个key的操作不是线程安全的
+    在一次 redis 调用中对多个 bucket 原子地填充并消耗 num 个 token，bucket 需要使用同一个 redis connection
+    :param local_check: 是否使用本进程内的拒绝缓存
+    :return: result: bool, wait_time: float
     """
+    keys = [bucket.key for bucket in buckets]
+    now = time.time()
+    if local_check:
+        wait = _check_denied(keys, now)
+        if wait:
+            return False, wait
+    args = [now, num]
+    for bucket in buckets:
+        args.extend([bucket.capacity, bucket.fill_rate, bucket.default_capacity])
+    waits = [float(item) for item in _get_script(buckets[0].redis_conn)(keys=keys, args=args)]
+    if not waits:
+        return True, 0
+    if local_check:
+        # 只记录 token 不足的 bucket，同一个 ip 的 bucket 可能被其他用户共用
+        _set_denied({key: now + wait for key, wait in zip(keys, waits) if wait and not math.isinf(wait)})
+    return False, max(waits)
+
+
+class TokenBucket:
     def __init__(self, key, capacity, fill_rate, default_capacity, redis_conn):
         """
         :param capacity: 最大容量
@@ -12,61 +111,16 @@ class TokenBucket:
         :param default_capacity: 初始容量
         :param redis_conn: redis connection
         """
-        self._key = key
-        self._capacity = capacity
-        self._fill_rate = fill_rate
-        self._default_capacity = default_capacity
-        self._redis_conn = redis_conn
-
-        self._last_capacity_key = "last_capacity"
-        self._last_timestamp_key = "last_timestamp"
-
-    def _init_key(self):
-        self._last_capacity = self._default_capacity
-        now = time.time()
-        self._last_timestamp = now
-        return self._default_capacity, now
-
-    @property
-    def _last_capacity(self):
-        last_capacity = self._redis_conn.hget(self._key, self._last_capacity_key)
-        if last_capacity is None:
-            return self._init_key()[0]
-        else:
-            return float(last_capacity)
+        self.key = key
+        self.capacity = capacity
+        self.fill_rate = fill_rate
+        self.default_capacity = default_capacity
+        self.redis_conn = redis_conn
 
-    @_last_capacity.setter
-    def _last_capacity(self, value):
-        self._redis_conn.hset(self._key, self._last_capacity_key, value)
-
-    @property
-    def _last_timestamp(self):
-        return float(self._redis_conn.hget(self._key, self._last_timestamp_key))
-
-    @_last_timestamp.setter
-    def _last_timestamp(self, value):
-        self._redis_conn.hset(self._key, self._last_timestamp_key, value)
-
-    def _try_to_fill(self, now):
-        delta = self._fill_rate * (now - self._last_timestamp)
-        return min(self._last_capacity + delta, self._capacity)
-
-    def consume(self, num=1):
+    def consume(self, num=1, local_check=True):
         """
         消耗 num 个 token，返回是否成功
         :param num:
         :return: result: bool, wait_time: float
         """
-        # print("capacity ", self.fill(time.time()))
-        if self._last_capacity >= num:
-            self._last_capacity -= num
-            return True, 0
-        else:
-            now = time.time()
-            cur_num = self._try_to_fill(now)
-            if cur_num >= num:
-                self._last_capacity = cur_num - num
-                self._last_timestamp = now
-                return True, 0
-            else:
-                return False, (num - cur_num) / self._fill_rate
+        return consume_buckets([self], num, local_check=local_check)
@@ -0,0 +1,193 @@
+import os
+import struct
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+# 不超过该大小的文件在线程池中整体压缩，更大的文件在输出时分块读取
+PARALLEL_MAX_SIZE = 4 * 1024 * 1024
+# 判断是否值得压缩时取的样本大小，压缩后超过样本大小的该比例时直接存储
+_SAMPLE_SIZE = 64 * 1024
+_STORE_RATIO = 0.9
+_COMPRESSED_EXTENSIONS = (".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst",
+                          ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".pdf")
+
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+_ZIP64_LIMIT = 0xFFFFFFFF
+# 文件名为 utf-8
+_FLAG_UTF8 = 0x800
+# sizes 和 crc 写在数据之后的 data descriptor 中
+_FLAG_DATA_DESCRIPTOR = 0x08
+
+_PreparedEntry = namedtuple("_PreparedEntry", ["name", "mtime", "method", "crc", "size", "data"])
+_LargeEntry = namedtuple("_LargeEntry", ["name", "mtime", "method", "path", "size"])
+
+
+def _should_store(name, sample):
+    if name.lower().endswith(_COMPRESSED_EXTENSIONS) or not sample:
+        return True
+    return len(zlib.compress(sample, 1)) > len(sample) * _STORE_RATIO
+
+
+def _deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _prepare(name, source):
+    """
+    在线程池中执行，zlib 和 crc32 计算时会释放 GIL
+    :param source: 文件路径或者 bytes
+    """
+    if isinstance(source, bytes):
+        data, mtime = source, time.time()
+    else:
+        mtime = os.path.getmtime(source)
+        size = os.path.getsize(source)
+        if size > PARALLEL_MAX_SIZE:
+            with open(source, "rb") as f:
+                sample = f.read(_SAMPLE_SIZE)
+            method = _ZIP_STORED if _should_store(name, sample) else _ZIP_DEFLATED
+            return _LargeEntry(name, mtime, method, source, size)
+        with open(source, "rb") as f:
+            data = f.read()
+    crc = zlib.crc32(data)
+    if not _should_store(name, data[:_SAMPLE_SIZE]):
+        compressed = _deflate(data)
+        if len(compressed) < len(data):
+            return _PreparedEntry(name, mtime, _ZIP_DEFLATED, crc, len(data), compressed)
+    return _PreparedEntry(name, mtime, _ZIP_STORED, crc, len(data), data)
+
+
+def _dos_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class ZipStreamWriter(object):
+    """
+    只追加写入的 zip 格式，生成的数据按顺序返回，不需要 seek，超过 4G 的文件和压缩包使用 zip64
+    """
+    def __init__(self):
+        self.offset = 0
+        self.central_directory = []
+
+    def _local_header(self, name, mtime, method, flags, crc, compress_size, size, zip64):
+        dos_time, dos_date = _dos_time(mtime)
+        extra = b""
+        if zip64:
+            extra = struct.pack("<HHQQ", 1, 16, size, compress_size)
+            compress_size = size = _ZIP64_LIMIT
+        version = 45 if zip64 else 20
+        return struct.pack("<IHHHHHIIIHH", 0x04034b50, version, flags, method, dos_time, dos_date,
+                           crc, compress_size, size, len(name), len(extra)) + name + extra
+
+    def _add_central_record(self, name, mtime, method, flags, crc, compress_size, size, offset):
+        self.central_directory.append((name, mtime, method, flags, crc, compress_size, size, offset))
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def write_prepared(self, entry):
+        name = entry.name.encode("utf-8")
+        offset = self.offset
+        zip64 = entry.size >= _ZIP64_LIMIT or len(entry.data) >= _ZIP64_LIMIT
+        yield self._emit(self._local_header(name, entry.mtime, entry.method, _FLAG_UTF8, entry.crc,
+                                            len(entry.data), entry.size, zip64))
+        yield self._emit(entry.data)
+        self._add_central_record(name, entry.mtime, entry.method, _FLAG_UTF8, entry.crc, len(entry.data),
+                                 entry.size, offset)
+
+    def write_large(self, entry):
+        """
+        大文件分块读取和压缩，crc 和压缩后的大小写在 data descriptor 中
+        """
+        name = entry.name.encode("utf-8")
+        offset = self.offset
+        flags = _FLAG_UTF8 | _FLAG_DATA_DESCRIPTOR
+        # 和 zipfile 相同，无法压缩的数据压缩后会略大于原大小
+        zip64 = entry.size * 1.05 >= _ZIP64_LIMIT
+        yield self._emit(self._local_header(name, entry.mtime, entry.method, flags, 0, 0, 0, zip64))
+        crc = 0
+        size = 0
+        compress_size = 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if entry.method == _ZIP_DEFLATED else None
+        with open(entry.path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    compress_size += len(chunk)
+                    yield self._emit(chunk)
+        if compressor:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            yield self._emit(chunk)
+        if zip64:
+            yield self._emit(struct.pack("<IIQQ", 0x08074b50, crc, compress_size, size))
+        else:
+            yield self._emit(struct.pack("<IIII", 0x08074b50, crc, compress_size, size))
+        self._add_central_record(name, entry.mtime, entry.method, flags, crc, compress_size, size, offset)
+
+    def write(self, entry):
+        if isinstance(entry, _LargeEntry):
+            return self.write_large(entry)
+        return self.write_prepared(entry)
+
+    def close(self):
+        start = self.offset
+        for name, mtime, method, flags, crc, compress_size, size, offset in self.central_directory:
+            dos_time, dos_date = _dos_time(mtime)
+            extra = []
+            if size >= _ZIP64_LIMIT:
+                extra.append(size)
+                size = _ZIP64_LIMIT
+            if compress_size >= _ZIP64_LIMIT:
+                extra.append(compress_size)
+                compress_size = _ZIP64_LIMIT
+            if offset >= _ZIP64_LIMIT:
+                extra.append(offset)
+                offset = _ZIP64_LIMIT
+            extra = struct.pack(f"<HH{len(extra)}Q", 1, 8 * len(extra), *extra) if extra else b""
+            version = 45 if extra else 20
+            yield self._emit(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, flags,
+                                         method, dos_time, dos_date, crc, compress_size, size, len(name),
+                                         len(extra), 0, 0, 0, 0o100644 << 16, offset) + name + extra)
+        count = len(self.central_directory)
+        size = self.offset - start
+        if count >= 0xFFFF or size >= _ZIP64_LIMIT or start >= _ZIP64_LIMIT:
+            zip64_end = self.offset
+            yield self._emit(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+            yield self._emit(struct.pack("<IIQI", 0x07064b50, 0, zip64_end, 1))
+            yield self._emit(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                         min(size, _ZIP64_LIMIT), min(start, _ZIP64_LIMIT), 0))
+        else:
+            yield self._emit(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, size, start, 0))
+
+
+def iter_zip(entries, workers=4):
+    """
+    边读取边生成 zip，不写临时文件，小文件在线程池中并行压缩，后面的文件在前面的文件输出时已经开始压缩
+    已经压缩过的文件和压缩效果不好的二进制文件直接存储
+    :param entries: 可迭代的 (压缩包中的文件名, 文件路径或者 bytes)，按顺序写入
+    """
+    writer = ZipStreamWriter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for name, source in entries:
+            window.append(executor.submit(_prepare, name, source))
+            # 已经完成的文件立即输出，最多同时准备 workers * 2 个文件，内存占用有上限
+            while window and (window[0].done() or len(window) > workers * 2):
+                yield from writer.write(window.popleft().result())
+        while window:
+            yield from writer.write(window.popleft().result())
+    yield from writer.close()
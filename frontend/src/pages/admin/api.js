@@ -208,6 +208,13 @@ export default {
       params
     })
   },
+  getTestCaseJob (id) {
+    return ajax('admin/test_case/job', 'get', {
+      params: {
+        id
+      }
+    })
+  },
   compileSPJ (data) {
     return ajax('admin/compile_spj', 'post', {
       data
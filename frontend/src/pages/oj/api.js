@@ -225,6 +225,13 @@ export default {
       }
     })
   },
+  getSubmissionEventToken (id) {
+    return ajax('submission/events', 'get', {
+      params: {
+        id
+      }
+    })
+  },
   submissionExists (problemID) {
     return ajax('submission_exists', 'get', {
       params: {
@@ -259,6 +266,13 @@ export default {
       params
     })
   },
+  getContestRankEventToken (contestID) {
+    return ajax('contest_rank/events', 'get', {
+      params: {
+        contest_id: contestID
+      }
+    })
+  },
   getACMACInfo (params) {
     return ajax('admin/contest/acm_helper', 'get', {
       params
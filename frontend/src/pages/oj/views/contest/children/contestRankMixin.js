@@ -3,6 +3,7 @@ import ScreenFull from '@admin/components/ScreenFull.vue'
 import { mapGetters, mapState } from 'vuex'
 import { types } from '@/store'
 import { CONTEST_STATUS } from '@/utils/constants'
+import utils from '@/utils/utils'
 
 export default {
   components: {
@@ -32,13 +33,34 @@ export default {
       })
     },
     handleAutoRefresh (status) {
-      if (status === true) {
-        this.refreshFunc = setInterval(() => {
-          this.page = 1
-          this.getContestRankData(1, true)
-        }, 10000)
-      } else {
-        clearInterval(this.refreshFunc)
+      this.stopAutoRefresh()
+      if (status !== true) {
+        return
+      }
+      const refresh = () => {
+        this.page = 1
+        this.getContestRankData(1, true)
+      }
+      // 排名变化时由服务端推送, 不支持或者连接出错时每10秒刷新一次
+      this.rankEvents = utils.subscribeEvents(() => api.getContestRankEventToken(this.$route.params.contestID), () => {
+        // 短时间内的多次变化合并为一次刷新
+        if (!this.refreshTimeout) {
+          this.refreshTimeout = setTimeout(() => {
+            this.refreshTimeout = null
+            refresh()
+          }, 2000)
+        }
+      }, () => {
+        this.refreshFunc = setInterval(refresh, 10000)
+      })
+    },
+    stopAutoRefresh () {
+      clearInterval(this.refreshFunc)
+      clearTimeout(this.refreshTimeout)
+      this.refreshTimeout = null
+      if (this.rankEvents) {
+        this.rankEvents.close()
+        this.rankEvents = null
       }
     }
   },
@@ -111,6 +133,6 @@ export default {
     }
   },
   beforeDestroy () {
-    clearInterval(this.refreshFunc)
+    this.stopAutoRefresh()
   }
 }
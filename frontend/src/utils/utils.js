@@ -94,6 +94,42 @@ function getLanguages () {
   })
 }
 
+// 订阅服务端推送的事件，getToken 返回签发 token 的请求
+// 浏览器不支持 EventSource、获取 token 失败或者连接出错时调用 onError，由调用方回退到轮询
+function subscribeEvents (getToken, onMessage, onError) {
+  let closed = false
+  let source = null
+  let fail = () => {
+    if (!closed) {
+      closed = true
+      onError()
+    }
+  }
+  if (!window.EventSource) {
+    fail()
+  } else {
+    getToken().then(res => {
+      if (closed) return
+      source = new window.EventSource(res.data.data.url)
+      source.onmessage = event => {
+        onMessage(JSON.parse(event.data))
+      }
+      source.onerror = () => {
+        source.close()
+        fail()
+      }
+    }, fail)
+  }
+  return {
+    close () {
+      closed = true
+      if (source) {
+        source.close()
+      }
+    }
+  }
+}
+
 export default {
   submissionMemoryFormat: submissionMemoryFormat,
   submissionTimeFormat: submissionTimeFormat,
@@ -101,5 +137,6 @@ export default {
   filterEmptyValue: filterEmptyValue,
   breakLongWords: breakLongWords,
   downloadFile: downloadFile,
-  getLanguages: getLanguages
+  getLanguages: getLanguages,
+  subscribeEvents: subscribeEvents
 }